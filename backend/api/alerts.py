@@ -0,0 +1,283 @@
+"""
+Unified alerts feed.
+
+Alerts are the pending FriendRequests and GroupInvitations a user has
+received. Their ids (``friend_request_<id>``, ``group_invite_<id>``) are
+what the client stores in AlertReadStatus when it marks them read, so an
+alert is unread when no AlertReadStatus row with its id exists. That check
+is a NOT EXISTS probe on the ``(user, alert_type)`` unique index per row,
+done in the same query that loads the page.
+
+The feed is ordered newest first by ``(created_at, kind, id)``. Pages are
+cut with keyset cursors over that key, so a response holds at most one
+page whatever the user's history looks like:
+
+- ``cursor`` continues towards older alerts (``next_cursor``)
+- ``since`` returns only alerts newer than a cursor the client already has
+  (``latest_cursor``), for cheap polling
+
+Read markers outlive their alerts, so ``prune_read_markers`` (run by the
+prune_alert_read_status command) deletes the ones whose request or
+invitation is gone or no longer pending.
+"""
+
+import base64
+import heapq
+import json
+
+from django.db.models import CharField, Exists, OuterRef, Q, Value
+from django.db.models.functions import Cast, Concat
+from django.utils.dateparse import parse_datetime
+
+from connections.models import FriendRequest, GroupInvitation
+from .models import AlertReadStatus
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+READ_STATUS_LIMIT = 200
+MAX_READ_STATUS_LIMIT = 1000
+PRUNE_BATCH_SIZE = 1000
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# ============================================================================
+# SOURCES
+# ============================================================================
+
+class AlertSource:
+    """One kind of alert: where it comes from and how it is presented"""
+
+    def __init__(self, kind, prefix, rank):
+        self.kind = kind
+        self.prefix = prefix
+        # Breaks created_at ties between kinds so the order is total
+        self.rank = rank
+
+    def alert_id(self, pk):
+        return Concat(Value(self.prefix), Cast(pk, output_field=CharField()))
+
+    def pending(self, user):
+        raise NotImplementedError
+
+    def markers(self):
+        return AlertReadStatus.objects.filter(alert_type__startswith=self.prefix)
+
+    def stale_markers(self):
+        """Read markers of this kind whose alert is no longer pending for their user"""
+        live = self.pending(OuterRef('user')).annotate(
+            alert_id=self.alert_id('id')
+        ).filter(alert_id=OuterRef('alert_type'))
+        return self.markers().exclude(Exists(live))
+
+    def with_read_flags(self, queryset, user):
+        return queryset.annotate(is_read=Exists(
+            AlertReadStatus.objects.filter(user=user, alert_type=self.alert_id(OuterRef('id')))
+        ))
+
+    def unread_count(self, user):
+        return self.with_read_flags(self.pending(user), user).filter(is_read=False).count()
+
+    def describe(self, obj):
+        return {
+            'id': f'{self.prefix}{obj.id}',
+            'type': self.kind,
+            'object_id': obj.id,
+            'created_at': obj.created_at,
+            'is_read': obj.is_read,
+        }
+
+
+class FriendRequestAlerts(AlertSource):
+    def pending(self, user):
+        return FriendRequest.objects.filter(to_user=user, status='pending')
+
+    def page(self, queryset):
+        return queryset.select_related('from_user__profile')
+
+    def describe(self, request):
+        return dict(
+            super().describe(request),
+            request_id=request.id,
+            from_user_id=request.from_user_id,
+            from_username=request.from_user.username,
+            from_profile_picture_url=request.from_user.profile.profile_picture_url,
+        )
+
+
+class GroupInvitationAlerts(AlertSource):
+    def pending(self, user):
+        return GroupInvitation.objects.filter(invited_user=user, status='pending')
+
+    def page(self, queryset):
+        return queryset.select_related('group', 'invited_by')
+
+    def describe(self, invitation):
+        return dict(
+            super().describe(invitation),
+            invitation_id=invitation.id,
+            group_id=invitation.group_id,
+            group_name=invitation.group.name,
+            invited_by_username=invitation.invited_by.username,
+            expires_at=invitation.expires_at,
+        )
+
+
+SOURCES = (
+    FriendRequestAlerts('friend_request', 'friend_request_', rank=1),
+    GroupInvitationAlerts('group_invite', 'group_invite_', rank=0),
+)
+
+
+# ============================================================================
+# CURSORS
+# ============================================================================
+
+def _encode(timestamp, *ids):
+    payload = json.dumps([timestamp.isoformat(), *ids])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def _decode(cursor, id_count):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp_value, *ids = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        timestamp = parse_datetime(timestamp_value)
+        if timestamp is None or len(ids) != id_count or not all(isinstance(i, int) for i in ids):
+            raise ValueError
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor.')
+    return (timestamp, *ids)
+
+
+def encode_cursor(source, obj):
+    return _encode(obj.created_at, source.rank, obj.id)
+
+
+def decode_cursor(cursor):
+    """``(created_at, rank, id)`` of a feed cursor"""
+    return _decode(cursor, 2)
+
+
+def _before(source, key):
+    """Rows of ``source`` strictly older than ``key`` in feed order"""
+    created_at, rank, object_id = key
+    if source.rank < rank:
+        return Q(created_at__lte=created_at)
+    if source.rank > rank:
+        return Q(created_at__lt=created_at)
+    return Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=object_id)
+
+
+def _after(source, key):
+    """Rows of ``source`` strictly newer than ``key`` in feed order"""
+    created_at, rank, object_id = key
+    if source.rank > rank:
+        return Q(created_at__gte=created_at)
+    if source.rank < rank:
+        return Q(created_at__gt=created_at)
+    return Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=object_id)
+
+
+# ============================================================================
+# FEED
+# ============================================================================
+
+def build_feed(user, limit=DEFAULT_LIMIT, cursor=None, since=None):
+    """
+    One page of the user's alerts, newest first, with unread flags and the
+    total unread count. Two queries per source, whatever the page position.
+
+    With ``since`` the page holds the alerts right after that cursor and
+    ``has_more`` says newer ones remain; otherwise it holds the newest
+    alerts (before ``cursor``, if given) and ``has_more`` says older ones do.
+    """
+    limit = max(1, min(limit, MAX_LIMIT))
+    before = decode_cursor(cursor) if cursor else None
+    after = decode_cursor(since) if since else None
+    ordering = ('created_at', 'id') if after else ('-created_at', '-id')
+
+    streams = []
+    for source in SOURCES:
+        queryset = source.with_read_flags(source.page(source.pending(user)), user)
+        if before:
+            queryset = queryset.filter(_before(source, before))
+        if after:
+            queryset = queryset.filter(_after(source, after))
+        rows = queryset.order_by(*ordering)[:limit + 1]
+        streams.append([((row.created_at, source.rank, row.id), source, row) for row in rows])
+
+    # Each stream is already sorted; merge them and keep one extra row to
+    # know whether the feed goes on past this page
+    merged = list(heapq.merge(*streams, key=lambda item: item[0], reverse=not after))[:limit + 1]
+    page, has_more = merged[:limit], len(merged) > limit
+    if after:
+        page.reverse()
+
+    return {
+        'alerts': [source.describe(row) for _, source, row in page],
+        'unread_count': sum(source.unread_count(user) for source in SOURCES),
+        'has_more': has_more,
+        'next_cursor': encode_cursor(page[-1][1], page[-1][2]) if has_more and not after else None,
+        'latest_cursor': encode_cursor(page[0][1], page[0][2]) if page else since,
+    }
+
+
+# ============================================================================
+# READ MARKERS
+# ============================================================================
+
+def read_status_page(user, since=None, limit=READ_STATUS_LIMIT):
+    """
+    The user's read markers in ``(read_at, id)`` order after the ``since``
+    cursor, with their batches grouped in the same single pass. With
+    ``limit=None`` every marker comes back in one page.
+    """
+    if limit is not None:
+        limit = max(1, min(limit, MAX_READ_STATUS_LIMIT))
+    markers = AlertReadStatus.objects.filter(user=user).only('id', 'alert_type', 'batch_id', 'read_at')
+    if since:
+        read_at, marker_id = _decode(since, 1)
+        markers = markers.filter(Q(read_at__gt=read_at) | Q(read_at=read_at, id__gt=marker_id))
+    markers = markers.order_by('read_at', 'id')
+    if limit is None:
+        page, has_more = list(markers), False
+    else:
+        page = list(markers[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+
+    batches = {}
+    for marker in page:
+        if marker.batch_id:
+            batches.setdefault(marker.batch_id, []).append(marker.alert_type)
+    return {
+        'read_alerts': [marker.alert_type for marker in page],
+        'batches': batches,
+        'has_more': has_more,
+        'next_since': _encode(page[-1].read_at, page[-1].id) if page else since,
+    }
+
+
+def prune_read_markers(batch_size=PRUNE_BATCH_SIZE, dry_run=False):
+    """
+    Delete read markers whose friend request or group invitation was
+    deleted, answered or withdrawn, in batches of ``batch_size`` so no
+    single statement locks much of the table. Markers of other alert types
+    are left alone. Returns ``{kind: count}``.
+    """
+    pruned = {}
+    for source in SOURCES:
+        stale = source.stale_markers()
+        if dry_run:
+            pruned[source.kind] = stale.count()
+            continue
+        pruned[source.kind] = 0
+        while True:
+            ids = list(stale.values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            pruned[source.kind] += AlertReadStatus.objects.filter(id__in=ids).delete()[0]
+    return pruned
@@ -0,0 +1,105 @@
+"""
+Google Sign-In.
+
+Verifying an ID token checks its signature against Google's public
+certificates. google-auth downloads those certificates on every
+verification unless the transport caches them, so ``CertCachingRequest``
+keeps each certificate response for as long as Google's Cache-Control
+allows and reuses one HTTP session. Verification then is a local
+signature check except roughly once a day.
+
+``averify_id_token`` runs verification in a worker thread so the async
+login view never blocks the event loop while a download is in flight.
+"""
+
+import os
+import re
+import threading
+import time
+
+import requests
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from google.auth.transport import requests as google_requests
+from google.oauth2 import id_token
+
+DEFAULT_CLIENT_ID = '7120580451-cmn9dcuv9eo0la2path3u1uppeegh37f.apps.googleusercontent.com'
+
+# Used when Google's response carries no max-age
+DEFAULT_CERTS_TTL = 60 * 60
+
+
+def client_id():
+    return os.environ.get('GOOGLE_CLIENT_ID') or DEFAULT_CLIENT_ID
+
+
+class CertCachingRequest(google_requests.Request):
+    """google-auth transport that caches successful GET responses"""
+
+    def __init__(self):
+        super().__init__(session=requests.Session())
+        self.lock = threading.Lock()
+        self.responses = {}
+
+    def __call__(self, url, method='GET', body=None, headers=None, **kwargs):
+        if method != 'GET' or body is not None:
+            return super().__call__(url, method, body, headers, **kwargs)
+        with self.lock:
+            cached = self.responses.get(url)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        response = super().__call__(url, method, body, headers, **kwargs)
+        if response.status == 200:
+            match = re.search(r'max-age=(\d+)', response.headers.get('cache-control', ''))
+            ttl = int(match.group(1)) if match else DEFAULT_CERTS_TTL
+            with self.lock:
+                self.responses[url] = (time.monotonic() + ttl, response)
+        return response
+
+
+_request = CertCachingRequest()
+
+
+def verify_id_token(token):
+    """The claims of a Google ID token issued to this app; ValueError if invalid"""
+    return id_token.verify_oauth2_token(token, _request, client_id())
+
+
+averify_id_token = sync_to_async(verify_id_token, thread_sensitive=False)
+
+
+def user_for_google_account(idinfo, profile_picture_url=None):
+    """The user for a verified Google account, created on first sign-in"""
+    email = idinfo['email'].lower() # Normalize email to lowercase
+    first_name = idinfo.get('given_name', '')
+    last_name = idinfo.get('family_name', '')
+
+    # Check if user with this email already exists
+    # This assumes email should be unique; if not, further logic needed to decide which user to link to
+    user = User.objects.filter(email=email).first()
+    if user is not None:
+        # Update user info if needed
+        if user.first_name != first_name or user.last_name != last_name:
+            user.first_name = first_name
+            user.last_name = last_name
+            user.save()
+    else:
+        # Create new user with a unique username from the part before @
+        username = base_username = email.split('@')[0]
+        counter = 1
+        while User.objects.filter(username=username).exists():
+            username = f"{base_username}{counter}"
+            counter += 1
+
+        user = User.objects.create_user(
+            username=username,
+            email=email, # Store normalized email
+            first_name=first_name,
+            last_name=last_name
+        )
+
+    # Update profile picture if provided (for both new and existing users)
+    if profile_picture_url:
+        user.profile.update_profile_picture(profile_picture_url)
+    return user
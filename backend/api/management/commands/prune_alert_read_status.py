@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from api.alerts import prune_read_markers, PRUNE_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Delete alert read markers whose friend request or group invitation is no longer pending'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=PRUNE_BATCH_SIZE,
+            help='Markers deleted per statement'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only count the markers that would be deleted'
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        pruned = prune_read_markers(batch_size=options['batch_size'], dry_run=options['dry_run'])
+        elapsed = time.perf_counter() - started
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        for kind, count in pruned.items():
+            self.stdout.write(f'{kind}: {count}')
+        self.stdout.write(self.style.SUCCESS(f'{verb} {sum(pruned.values())} read markers in {elapsed:.2f}s'))
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_alertreadstatus_batch_id_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alertreadstatus',
+            index=models.Index(fields=['user', 'read_at'], name='api_alertre_user_id_3189de_idx'),
+        ),
+    ]
@@ -64,4 +64,5 @@ class AlertReadStatus(models.Model):
             models.Index(fields=['user', 'alert_type']),
             models.Index(fields=['batch_id']),  # For batch operations
             models.Index(fields=['read_at']),
+            models.Index(fields=['user', 'read_at']),  # Paging a user's markers by read_at
         ]
@@ -1,3 +1,180 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
 
-# Create your tests here.
+
+@override_settings(PROFILING_ENABLED=True)
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        from project.profiling import registry
+        registry.reset()
+        self.user = User.objects.create_user('profiled', 'profiled@test.com', 'pass123')
+
+    def test_server_timing_and_metrics(self):
+        from rest_framework.test import APIClient
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/expenses/user-total-balances/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('serializer;dur=', response['Server-Timing'])
+
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics/').status_code, 403)
+            metrics = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(metrics.status_code, 200)
+        body = metrics.content.decode()
+        self.assertIn(
+            'splitkar_request_duration_seconds_count{route="/api/expenses/user-total-balances/",method="GET"} 1',
+            body
+        )
+        self.assertIn('splitkar_db_queries_bucket{route="/api/expenses/user-total-balances/",method="GET",le="+Inf"} 1', body)
+
+    @override_settings(PROFILING_ENABLED=False)
+    def test_disabled_by_setting(self):
+        from rest_framework.test import APIClient
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/expenses/user-total-balances/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
+
+
+class AlertFeedTests(TestCase):
+    def setUp(self):
+        from rest_framework.test import APIClient
+        from connections.models import FriendRequest, Group, GroupInvitation
+
+        self.user = User.objects.create_user('alerted', 'alerted@test.com', 'pass123')
+        senders = [User.objects.create_user(f'sender{i}', f'sender{i}@test.com', 'pass123') for i in range(3)]
+        self.requests = [FriendRequest.objects.create(from_user=sender, to_user=self.user) for sender in senders]
+        group = Group.objects.create(name='Trip', created_by=senders[0])
+        self.invitation = GroupInvitation.objects.create(group=group, invited_user=self.user, invited_by=senders[0])
+        # Alerts for other users never show up
+        FriendRequest.objects.create(from_user=self.user, to_user=senders[1])
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_feed_merges_sources_with_unread_flags_and_cursors(self):
+        from .models import AlertReadStatus
+
+        AlertReadStatus.objects.create(user=self.user, alert_type=f'friend_request_{self.requests[0].id}')
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/alerts/feed/', {'limit': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['unread_count'], 3)
+        self.assertTrue(response.data['has_more'])
+
+        first_page = response.data['alerts']
+        rest = self.client.get('/api/alerts/feed/', {'limit': 3, 'cursor': response.data['next_cursor']}).data
+        self.assertFalse(rest['has_more'])
+        ids = [alert['id'] for alert in first_page + rest['alerts']]
+        self.assertEqual(sorted(ids), sorted(
+            [f'friend_request_{r.id}' for r in self.requests] + [f'group_invite_{self.invitation.id}']
+        ))
+        read = {alert['id']: alert['is_read'] for alert in first_page + rest['alerts']}
+        self.assertTrue(read[f'friend_request_{self.requests[0].id}'])
+        self.assertFalse(read[f'group_invite_{self.invitation.id}'])
+
+        # Polling with since only returns what arrived afterwards
+        latest = response.data['latest_cursor']
+        self.assertEqual(self.client.get('/api/alerts/feed/', {'since': latest}).data['alerts'], [])
+        from connections.models import FriendRequest
+        newcomer = User.objects.create_user('newcomer', 'newcomer@test.com', 'pass123')
+        new_request = FriendRequest.objects.create(from_user=newcomer, to_user=self.user)
+        polled = self.client.get('/api/alerts/feed/', {'since': latest}).data
+        self.assertEqual([alert['id'] for alert in polled['alerts']], [f'friend_request_{new_request.id}'])
+        self.assertEqual(polled['unread_count'], 4)
+
+        self.assertEqual(self.client.get('/api/alerts/feed/', {'cursor': 'garbage'}).status_code, 400)
+
+    def test_read_status_pages_and_prunes_stale_markers(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import AlertReadStatus
+
+        AlertReadStatus.objects.bulk_create([
+            AlertReadStatus(user=self.user, alert_type=f'friend_request_{r.id}', batch_id='b1')
+            for r in self.requests
+        ] + [
+            AlertReadStatus(user=self.user, alert_type=f'group_invite_{self.invitation.id}'),
+            AlertReadStatus(user=self.user, alert_type='settlement_reminder_1'),
+        ])
+
+        first = self.client.get('/api/alerts/read-status/', {'limit': 3}).data
+        rest = self.client.get('/api/alerts/read-status/', {'since': first['next_since']}).data
+        self.assertTrue(first['has_more'])
+        self.assertFalse(rest['has_more'])
+        self.assertEqual(len(first['read_alerts'] + rest['read_alerts']), 5)
+        self.assertEqual(first['batches'], {'b1': first['read_alerts']})
+
+        # Answered and deleted alerts leave stale markers behind
+        self.requests[0].accept()
+        self.requests[1].delete()
+        call_command('prune_alert_read_status', '--batch-size', '1', stdout=StringIO())
+        self.assertEqual(
+            sorted(AlertReadStatus.objects.filter(user=self.user).values_list('alert_type', flat=True)),
+            sorted([f'friend_request_{self.requests[2].id}', f'group_invite_{self.invitation.id}', 'settlement_reminder_1'])
+        )
+
+        # Without paging parameters every marker comes back, however many
+        AlertReadStatus.objects.bulk_create([
+            AlertReadStatus(user=self.user, alert_type=f'settlement_reminder_{i}') for i in range(2, 302)
+        ])
+        everything = self.client.get('/api/alerts/read-status/').data
+        self.assertEqual(len(everything['read_alerts']), 303)
+        self.assertFalse(everything['has_more'])
+
+
+class EventStreamTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('listener', 'listener@test.com', 'pass123')
+        self.sender = User.objects.create_user('sender', 'sender@test.com', 'pass123')
+
+    def test_signals_publish_events_on_commit(self):
+        import json
+        from unittest import mock
+        from connections.models import FriendRequest
+
+        with mock.patch('project.events._deliver') as deliver:
+            with self.captureOnCommitCallbacks(execute=True):
+                request = FriendRequest.objects.create(from_user=self.sender, to_user=self.user)
+                deliver.assert_not_called()
+            with self.captureOnCommitCallbacks(execute=True):
+                request.accept()
+
+        (new_ids, new_message), (updated_ids, updated_message) = [c.args for c in deliver.call_args_list[:2]]
+        self.assertEqual(new_ids, {self.user.id})
+        self.assertEqual(json.loads(new_message)['type'], 'friend_request')
+        self.assertEqual(json.loads(new_message)['data']['from_username'], 'sender')
+        self.assertEqual(updated_ids, {self.user.id, self.sender.id})
+        self.assertEqual(json.loads(updated_message)['data']['status'], 'accepted')
+
+    async def test_stream_relays_events_to_the_user(self):
+        import json
+        from django.test import AsyncClient
+        from rest_framework_simplejwt.tokens import AccessToken
+        from project import events
+
+        client = AsyncClient()
+        self.assertEqual((await client.get('/api/events/stream/')).status_code, 401)
+
+        token = AccessToken.for_user(self.user)
+        response = await client.get('/api/events/stream/', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = response.streaming_content
+        self.assertEqual(await anext(stream), b'retry: 5000\n\n')
+        self.assertIn(b'event: ready', await anext(stream))
+
+        events._deliver({self.sender.id}, json.dumps({'type': 'other_user', 'data': {}}))
+        events._deliver({self.user.id}, json.dumps({'type': 'balance_changed', 'data': {'net_balance': '10.00'}}))
+        chunk = (await anext(stream)).decode()
+        self.assertTrue(chunk.startswith('event: balance_changed\n'))
+        self.assertEqual(json.loads(chunk.split('data: ', 1)[1])['data'], {'net_balance': '10.00'})
+        await stream.aclose()
+
+    def test_stream_is_refused_under_wsgi(self):
+        self.assertEqual(self.client.get('/api/events/stream/').status_code, 503)
@@ -38,10 +38,13 @@ from .views import (
     CustomTokenRefreshView,
     ProfileUpdateAPIView,
     AlertReadStatusView,
+    AlertFeedView,
     MarkAlertReadView,
     MarkAllAlertsReadView,
-    SetDarkModeAPIView
+    SetDarkModeAPIView,
+    google_login_async
 )
+from project.asyncapi import serve
 from rest_framework_simplejwt.views import TokenVerifyView
 
 # TODO: Add version prefix to all URLs
@@ -52,7 +55,7 @@ from rest_framework_simplejwt.views import TokenVerifyView
 
 urlpatterns = [
     # TODO: Add version prefix (e.g., 'api/v1/')
-    path('auth/google/', GoogleLoginAPIView.as_view(), name='google-login'),
+    path('auth/google/', serve(GoogleLoginAPIView.as_view(), google_login_async), name='google-login'),
     path('auth/register/', UserRegistrationAPIView.as_view(), name='user-register'),
     path('auth/login/', UserLoginAPIView.as_view(), name='user-login'),
     path('auth/validate/', TokenVerifyView.as_view(), name='token-verify'),
@@ -60,6 +63,7 @@ urlpatterns = [
     path('profile/', ProfileDetailsAPIView, name='profile-details'),
     path('profile/update/', ProfileUpdateAPIView.as_view(), name='profile-update'),
     path('profile/set-dark-mode/', SetDarkModeAPIView.as_view(), name='set-dark-mode'),
+    path('alerts/feed/', AlertFeedView.as_view(), name='alert-feed'),
     path('alerts/read-status/', AlertReadStatusView.as_view(), name='alert-read-status'),
     path('alerts/mark-read/', MarkAlertReadView.as_view(), name='mark-alert-read'),
     path('alerts/mark-all-read/', MarkAllAlertsReadView.as_view(), name='mark-all-read'),
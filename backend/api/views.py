@@ -4,9 +4,8 @@ from rest_framework.response import Response
 from rest_framework import status
 from django.contrib.auth.models import User
 from rest_framework_simplejwt.tokens import RefreshToken
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
-import os
+import json
+from asgiref.sync import sync_to_async
 from .serializers import UserRegistrationSerializer, UserLoginSerializer, UserSerializer, ProfileUpdateSerializer, MarkAlertReadSerializer, BatchAlertReadSerializer, DarkModeSerializer
 from django.contrib.auth import authenticate
 from django.db.models import Q
@@ -22,7 +21,9 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.core.cache import cache
 from django.conf import settings
 import time
+from project.asyncapi import async_api_view, json_response
 from .models import AlertReadStatus
+from . import alerts, google_auth
 
 
 # Helper function to generate tokens and user data response
@@ -50,8 +51,6 @@ class GoogleLoginAPIView(APIView):
         token = request.data.get('id_token')
         profile_picture_url = request.data.get('profile_picture_url')
         print('Received id_token:', token[:40] + '...' if token else None)
-        google_client_id = os.environ.get('GOOGLE_CLIENT_ID') or '7120580451-cmn9dcuv9eo0la2path3u1uppeegh37f.apps.googleusercontent.com'
-        print('GOOGLE_CLIENT_ID used for verification:', google_client_id)
         if not token:
             return Response(
                 {'error': _('No id_token provided')},
@@ -59,51 +58,9 @@ class GoogleLoginAPIView(APIView):
             )
         try:
             # Verify the token with Google
-            idinfo = id_token.verify_oauth2_token(
-                token,
-                google_requests.Request(),
-                google_client_id
-            )
-            print('Token verification succeeded. idinfo:', idinfo)
+            idinfo = google_auth.verify_id_token(token)
             print('Token audience (aud):', idinfo.get('aud'))
-            email = idinfo['email'].lower() # Normalize email to lowercase
-            first_name = idinfo.get('given_name', '')
-            last_name = idinfo.get('family_name', '')
-            
-            # Check if user with this email already exists
-            # Using filter() and then checking count to handle potential duplicates or non-existence robustly
-            users_with_email = User.objects.filter(email=email)
-
-            if users_with_email.exists():
-                # If a user with this email exists, use the first one found
-                # This assumes email should be unique; if not, further logic needed to decide which user to link to
-                user = users_with_email.first()
-                # Update user info if needed
-                if user.first_name != first_name or user.last_name != last_name:
-                    user.first_name = first_name
-                    user.last_name = last_name
-                    user.save()
-            else:
-                # Create new user
-                username = email.split('@')[0]  # Use part before @ as username
-                base_username = username
-                counter = 1
-                
-                # Ensure unique username
-                while User.objects.filter(username=username).exists():
-                    username = f"{base_username}{counter}"
-                    counter += 1
-                
-                user = User.objects.create_user(
-                    username=username,
-                    email=email, # Store normalized email
-                    first_name=first_name,
-                    last_name=last_name
-                )
-            
-            # Update profile picture if provided (for both new and existing users)
-            if profile_picture_url:
-                user.profile.update_profile_picture(profile_picture_url)
+            user = google_auth.user_for_google_account(idinfo, profile_picture_url)
             
             # Generate JWT and return response
             return Response(get_tokens_for_user(user))
@@ -121,6 +78,37 @@ class GoogleLoginAPIView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+
+@async_api_view(['POST'], authenticated=False)
+async def google_login_async(request):
+    """
+    GoogleLoginAPIView for the ASGI server. Token verification runs in a
+    worker thread; signing the user in keeps to the sync ORM because it
+    fires the signup and profile signals.
+    """
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return json_response({'error': 'Invalid JSON body'}, status=status.HTTP_400_BAD_REQUEST)
+    token = data.get('id_token')
+    if not token:
+        return json_response({'error': _('No id_token provided')}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        idinfo = await google_auth.averify_id_token(token)
+    except ValueError as e:
+        print('Token verification error:', e)
+        return json_response({'error': _('Invalid id_token')}, status=status.HTTP_400_BAD_REQUEST)
+
+    def sign_in():
+        user = google_auth.user_for_google_account(idinfo, data.get('profile_picture_url'))
+        return get_tokens_for_user(user)
+
+    try:
+        return json_response(await sync_to_async(sign_in)())
+    except Exception as e:
+        print('Unexpected error during Google sign-in:', e)
+        return json_response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 class UserRegistrationAPIView(APIView):
     permission_classes = [AllowAny]
 
@@ -245,9 +233,7 @@ class ProfileUpdateAPIView(APIView):
             
             # Update profile code only if username changed
             if 'username' in serializer.validated_data:
-                profile = user.profile
-                profile.profile_code = profile.generate_unique_code()
-                profile.save()
+                user.profile.reassign_code()
             
             return Response({
                 'message': 'Profile updated successfully',
@@ -256,18 +242,55 @@ class ProfileUpdateAPIView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 class AlertReadStatusView(APIView):
+    """
+    The user's read markers, oldest first. Without since or limit every
+    marker is returned, as clients that fetch once expect; with either the
+    markers come a page at a time.
+    Query Parameters: since (next_since of the previous page),
+    limit (default 200, max 1000)
+    """
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        # Get all read alerts for user with batch support
-        read_statuses = AlertReadStatus.objects.filter(user=request.user)
-        return Response({
-            'read_alerts': [status.alert_type for status in read_statuses],
-            'batches': {
-                status.batch_id: [s.alert_type for s in read_statuses if s.batch_id == status.batch_id]
-                for status in read_statuses if status.batch_id
-            }
-        })
+        limit = request.query_params.get('limit')
+        since = request.query_params.get('since')
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                return Response({'error': 'limit must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        elif since is not None:
+            limit = alerts.READ_STATUS_LIMIT
+        try:
+            page = alerts.read_status_page(request.user, since=since, limit=limit)
+        except alerts.InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(page)
+
+class AlertFeedView(APIView):
+    """
+    Pending friend requests and group invitations received by the user,
+    newest first, with read flags and the unread count (see api/alerts.py).
+    Query Parameters: limit (default 20, max 100), cursor (older page),
+    since (only alerts newer than a previous latest_cursor)
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get('limit', alerts.DEFAULT_LIMIT))
+        except ValueError:
+            return Response({'error': 'limit must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            feed = alerts.build_feed(
+                request.user,
+                limit=limit,
+                cursor=request.query_params.get('cursor'),
+                since=request.query_params.get('since'),
+            )
+        except alerts.InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(feed)
 
 class MarkAlertReadView(APIView):
     permission_classes = [IsAuthenticated]
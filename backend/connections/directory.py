@@ -0,0 +1,76 @@
+"""
+People directory.
+
+The list behind "add people": every other user as one ranked stream, the
+caller's friends first, then users with a pending friend request either
+way, then everyone else, each part ordered like a search (see
+connections/search.py). The relation is worked out per row in SQL, with
+``EXISTS`` probes on the Friendship and FriendRequest unique indexes folded
+into a CASE sort key, so a page is one query returning at most a page of
+rows however many friends the caller has.
+
+Pages are cut with keyset cursors over ``(relation, search_rank,
+search_text, id)``. Once a cursor is past the friends and pending requests,
+which is every page but the first few, the relation is pinned instead of
+sorted on and the search index orders the scan.
+"""
+
+from django.db.models import Case, Exists, IntegerField, OuterRef, Q, Value, When
+
+from . import search
+from .models import FriendRequest, Friendship, Profile
+
+FRIEND = 0
+PENDING = 1
+OTHER = 2
+
+SORT_FIELDS = ('relation',) + search.SORT_FIELDS
+
+
+def people(user, query=''):
+    """
+    Profiles of everyone but ``user`` matching ``query``, annotated with
+    ``relation``, ``is_friend``, ``request_sent`` and ``request_received``
+    """
+    other = OuterRef('user_id')
+    profiles = Profile.objects.exclude(user=user).select_related('user').annotate(
+        is_friend=Exists(Friendship.objects.filter(
+            Q(user1=user, user2=other) | Q(user1=other, user2=user)
+        )),
+        request_sent=Exists(FriendRequest.objects.filter(from_user=user, to_user=other, status='pending')),
+        request_received=Exists(FriendRequest.objects.filter(from_user=other, to_user=user, status='pending')),
+    ).annotate(relation=Case(
+        When(is_friend=True, then=Value(FRIEND)),
+        When(Q(request_sent=True) | Q(request_received=True), then=Value(PENDING)),
+        default=Value(OTHER),
+        output_field=IntegerField(),
+    ))
+    return search.search_profiles(profiles, query)
+
+
+def ranked(profiles):
+    return search.ranked(profiles, SORT_FIELDS)
+
+
+def paginate_by_cursor(profiles, cursor=None, limit=search.DEFAULT_LIMIT):
+    """
+    ``(page, next_cursor)`` for a queryset from ``people``. ``next_cursor``
+    is None on the last page.
+    """
+    pinned = ()
+    if cursor and search.decode_cursor(cursor, SORT_FIELDS)[0] == OTHER:
+        # Only others are left: filter on the relation rather than sort on
+        # it, so the rows come off the search_text index in order
+        profiles = profiles.filter(relation=OTHER)
+        pinned = ('relation',)
+    return search.paginate_by_cursor(profiles, cursor, limit, SORT_FIELDS, pinned)
+
+
+def friend_request_status(profile):
+    if profile.is_friend:
+        return 'none'
+    if profile.request_sent:
+        return 'sent'
+    if profile.request_received:
+        return 'received'
+    return 'none'
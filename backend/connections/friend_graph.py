@@ -0,0 +1,120 @@
+"""
+Friend graph.
+
+Each user's friends are kept in the cache as a packed array of user ids,
+so checking a friendship, listing friend ids or intersecting two users'
+friends costs a couple of cache reads instead of a join over Friendship,
+User and Profile. A missing entry is rebuilt from Friendship with one
+``values_list`` query (one query for any number of users in the ``_many``
+helpers).
+
+Entries are keyed by the user's ``friend-graph`` version (see
+project/caching.py), which the Friendship signals bump once the writing
+transaction commits. A friendship created or deleted earlier in the current
+transaction is therefore not visible here yet; code that must see its own
+writes asks the Friendship manager instead.
+"""
+
+from array import array
+from collections import Counter
+from heapq import nsmallest
+
+from django.core.cache import cache
+from django.db.models import Q
+
+from project import caching
+from .models import Friendship
+
+SCOPE = 'friend-graph'
+DEFAULT_SUGGESTIONS = 20
+
+
+def _user_id(user):
+    return getattr(user, 'id', user)
+
+
+def _entry_key(user_id, version):
+    return f'{SCOPE}:{user_id}:{version}'
+
+
+def _pack(ids):
+    return array('q', sorted(ids)).tobytes()
+
+
+def _unpack(data):
+    packed = array('q')
+    packed.frombytes(data)
+    return frozenset(packed)
+
+
+def load_friend_ids(user_ids):
+    """``{user_id: frozenset(friend ids)}`` straight from the database"""
+    user_ids = set(user_ids)
+    friends = {user_id: set() for user_id in user_ids}
+    pairs = Friendship.objects.filter(
+        Q(user1_id__in=user_ids) | Q(user2_id__in=user_ids)
+    ).values_list('user1_id', 'user2_id')
+    for user1_id, user2_id in pairs:
+        if user1_id in friends:
+            friends[user1_id].add(user2_id)
+        if user2_id in friends:
+            friends[user2_id].add(user1_id)
+    return {user_id: frozenset(ids) for user_id, ids in friends.items()}
+
+
+# ============================================================================
+# LOOKUPS
+# ============================================================================
+
+def friend_ids_many(users):
+    """``{user_id: frozenset(friend ids)}`` for users or user ids"""
+    user_ids = list({_user_id(user) for user in users})
+    if not user_ids:
+        return {}
+    versions = caching.get_versions([(SCOPE, user_id) for user_id in user_ids])
+    keys = {user_id: _entry_key(user_id, version) for user_id, version in zip(user_ids, versions)}
+    cached = cache.get_many(list(keys.values()))
+
+    result = {user_id: _unpack(cached[key]) for user_id, key in keys.items() if key in cached}
+    missing = [user_id for user_id in user_ids if user_id not in result]
+    if missing:
+        loaded = load_friend_ids(missing)
+        cache.set_many({keys[user_id]: _pack(ids) for user_id, ids in loaded.items()}, caching.RESPONSE_TIMEOUT)
+        result.update(loaded)
+    return result
+
+
+def friend_ids(user):
+    """Ids of the user's friends"""
+    user_id = _user_id(user)
+    return friend_ids_many([user_id])[user_id]
+
+
+def are_friends(user_a, user_b):
+    return _user_id(user_b) in friend_ids(user_a)
+
+
+def mutual_friends(user_a, user_b):
+    """Ids of the friends two users have in common"""
+    friends = friend_ids_many([user_a, user_b])
+    return friends[_user_id(user_a)] & friends[_user_id(user_b)]
+
+
+def suggestions(user, limit=DEFAULT_SUGGESTIONS):
+    """
+    Friends of the user's friends who aren't friends yet, as
+    ``(user_id, mutual friend count)`` pairs, most mutual friends first.
+    """
+    user_id = _user_id(user)
+    mine = friend_ids(user_id)
+    counts = Counter()
+    for ids in friend_ids_many(mine).values():
+        counts.update(ids)
+    for excluded in mine | {user_id}:
+        counts.pop(excluded, None)
+    return nsmallest(limit, counts.items(), key=lambda item: (-item[1], item[0]))
+
+
+def invalidate(user_ids):
+    """Drop the cached friends of ``user_ids`` once the transaction commits"""
+    caching.bump(SCOPE, user_ids)
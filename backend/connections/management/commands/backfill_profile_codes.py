@@ -0,0 +1,30 @@
+import time
+from django.core.management.base import BaseCommand
+from connections.profile_codes import backfill, BULK_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Give profiles without a profile code (or, with --all, every profile) a derived code'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BULK_BATCH_SIZE,
+            help='Profiles updated per batch'
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Replace existing codes too; codes users have already shared stop working'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Backfilling profile codes...')
+        started = time.perf_counter()
+        written = backfill(batch_size=options['batch_size'], reassign=options['all'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} profile codes in {elapsed:.2f}s'))
+        if written:
+            # bulk_update sends no signals, so cached responses aren't invalidated
+            self.stdout.write('Cached responses may show the old codes for up to an hour')
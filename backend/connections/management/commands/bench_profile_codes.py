@@ -0,0 +1,151 @@
+import json
+import random
+import sys
+import time
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    CaptureQueriesContext, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+)
+from django.utils import timezone
+
+from connections.models import Profile
+from connections.profile_codes import HALF_BITS, code_for
+from connections.search import build_search_text
+from expense.management.commands.bench import percentile
+
+BULK_BATCH_SIZE = 10000
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark profile code allocation: per-code latency at user ids from '
+        'thousands to billions, uniqueness over millions of consecutive ids, and '
+        'the queries and latency of signing up a user as the profile table grows. '
+        'Prints a JSON report.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profiles', type=int, default=1_000_000,
+            help='Consecutive user ids to allocate codes for and check for clashes (default: 1000000)'
+        )
+        parser.add_argument('--samples', type=int, default=2000, help='Timed allocations per id scale (default: 2000)')
+        parser.add_argument(
+            '--table-sizes', default='0,10000,100000',
+            help='Comma separated profile table sizes to time sign-ups at (default: 0,10000,100000)'
+        )
+        parser.add_argument('--signups', type=int, default=50, help='Timed sign-ups per table size (default: 50)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+        parser.add_argument('--output', help='Also write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        try:
+            table_sizes = sorted(int(size) for size in options['table_sizes'].split(','))
+        except ValueError:
+            raise CommandError('--table-sizes must be comma separated integers')
+        self.rng = random.Random(options['seed'])
+
+        report = {
+            'database': connection.vendor,
+            'created_at': timezone.now().isoformat(),
+            'allocation_by_id_scale': self.allocation_by_scale(options['samples']),
+            'consecutive_ids': self.consecutive_ids(options['profiles']),
+        }
+        # Signals print progress; keep stdout for the JSON report
+        with redirect_stdout(sys.stderr):
+            # Same isolation as the test runner: a fresh database, migrated, then dropped
+            setup_test_environment()
+            old_config = setup_databases(verbosity=0, interactive=False)
+            try:
+                report['signup_by_table_size'] = self.signups(table_sizes, options['signups'])
+            finally:
+                teardown_databases(old_config, verbosity=0)
+                teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+
+    def allocation_by_scale(self, samples):
+        """Microseconds per code for random ids of each order of magnitude"""
+        results = {}
+        scale = 1000
+        while scale < 1 << 2 * HALF_BITS:
+            users = [
+                SimpleNamespace(id=self.rng.randrange(scale, min(scale * 10, 1 << 2 * HALF_BITS)), username='rahul')
+                for _ in range(samples)
+            ]
+            timings = []
+            for user in users:
+                started = time.perf_counter()
+                code_for(user)
+                timings.append((time.perf_counter() - started) * 1_000_000)
+            results[f'1e{len(str(scale)) - 1}'] = {
+                'p50_us': round(percentile(timings, 0.50), 2),
+                'p95_us': round(percentile(timings, 0.95), 2),
+                'mean_us': round(sum(timings) / len(timings), 2),
+            }
+            scale *= 10
+        return results
+
+    def consecutive_ids(self, count):
+        """Codes for ids 1..count under one common prefix, checked for clashes"""
+        self.stderr.write(f'Allocating {count} codes...')
+        user = SimpleNamespace(id=0, username='rahul')
+        codes = set()
+        started = time.perf_counter()
+        for user.id in range(1, count + 1):
+            codes.add(code_for(user))
+        elapsed = time.perf_counter() - started
+        return {
+            'codes': count,
+            'distinct': len(codes),
+            'seconds': round(elapsed, 2),
+            'codes_per_second': round(count / elapsed) if elapsed else None,
+        }
+
+    def signups(self, table_sizes, signups):
+        """Queries and latency of creating a user (and so a profile) as the table grows"""
+        results = {}
+        seeded = 0
+        for size in table_sizes:
+            self.stderr.write(f'Seeding {size} profiles...')
+            seeded += self.seed_profiles(size - seeded)
+            timings, query_counts = [], []
+            for i in range(signups):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    User.objects.create_user(f'rahul_{size}_{i}', password=None)
+                    timings.append((time.perf_counter() - started) * 1000)
+                query_counts.append(len(queries))
+            seeded += signups
+            results[str(size)] = {
+                'queries': max(query_counts),
+                'p50_ms': round(percentile(timings, 0.50), 2),
+                'p95_ms': round(percentile(timings, 0.95), 2),
+            }
+        return results
+
+    def seed_profiles(self, count):
+        """Bulk create ``count`` users and profiles sharing one username prefix"""
+        created = 0
+        prefix = f'rahul{int(time.time())}'
+        while created < count:
+            batch = min(BULK_BATCH_SIZE, count - created)
+            users = User.objects.bulk_create([
+                User(username=f'{prefix}_{created + i}', password='!') for i in range(batch)
+            ])
+            codes = [code_for(user) for user in users]
+            Profile.objects.bulk_create([
+                Profile(user=user, profile_code=code, search_text=build_search_text(user, code))
+                for user, code in zip(users, codes)
+            ])
+            created += batch
+        return max(count, 0)
@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from connections.suggestions import rebuild_all, BULK_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Recompute every user\'s "people you may know" suggestions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BULK_BATCH_SIZE,
+            help='Users recomputed per batch'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding friend suggestions...')
+        started = time.perf_counter()
+        written = rebuild_all(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} suggestions in {elapsed:.2f}s'))
@@ -0,0 +1,90 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:29
+
+from django.conf import settings
+from django.db import migrations, models
+
+FTS_TABLE = 'connections_profile_search_fts'
+PROFILE_TABLE = 'connections_profile'
+
+POSTGRES_INDEXES = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    f'CREATE INDEX profile_search_trgm_idx ON {PROFILE_TABLE} USING gin (search_text gin_trgm_ops)',
+]
+
+# External-content FTS5 table kept in sync with the profile table by triggers.
+# The trigram tokenizer gives substring matches like the old icontains filters.
+SQLITE_INDEXES = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(search_text, content='{PROFILE_TABLE}', content_rowid='id', tokenize='trigram')",
+    f"""CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {PROFILE_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {PROFILE_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF search_text ON {PROFILE_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text);
+        INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text);
+    END""",
+]
+
+
+def backfill_search_text(apps, schema_editor):
+    """Same text as connections.search.build_search_text"""
+    Profile = apps.get_model('connections', 'Profile')
+    profiles = []
+    for profile in Profile.objects.select_related('user').iterator(chunk_size=1000):
+        user = profile.user
+        parts = (user.username, user.first_name, user.last_name, profile.profile_code)
+        profile.search_text = ' '.join(' '.join(part for part in parts if part).split()).lower()
+        profiles.append(profile)
+    Profile.objects.bulk_update(profiles, ['search_text'], batch_size=1000)
+
+
+def create_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        for sql in POSTGRES_INDEXES:
+            schema_editor.execute(sql)
+    elif vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('SELECT sqlite_version()')
+            version = tuple(int(part) for part in cursor.fetchone()[0].split('.'))
+        # Older SQLite builds lack the trigram tokenizer; search then falls
+        # back to a LIKE scan over the profile table.
+        if version >= (3, 34, 0):
+            for sql in SQLITE_INDEXES:
+                schema_editor.execute(sql)
+            # Index the profiles backfilled above
+            schema_editor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def drop_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS profile_search_trgm_idx')
+    elif vendor == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connections', '0004_friendsuggestion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='search_text',
+            field=models.CharField(blank=True, default='', max_length=400),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['search_text'], name='profile_search_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(backfill_search_text, migrations.RunPython.noop),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
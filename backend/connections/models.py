@@ -1,12 +1,12 @@
-from django.db import models 
+from contextlib import nullcontext
+
+from django.db import IntegrityError, connection, models, transaction
 from django.contrib.auth.models import User 
 from django.db.models import Q, Case, When, F 
 from django.core.exceptions import ValidationError 
 from django.db.models.signals import post_save 
 from django.dispatch import receiver 
 import uuid 
-import string 
-import random 
  
 # Create your models here.
 
@@ -24,38 +24,51 @@ class Profile(TimeStampedModel):
     is_active = models.BooleanField(default=True) 
     profile_picture_url = models.URLField(max_length=500, blank=True, null=True)
     isDarkMode  = models.BooleanField(default=False)
+    # Lowercased username, names and profile code (see connections/search.py)
+    search_text = models.CharField(max_length=400, blank=True, default='')
     
     class Meta: 
         indexes = [ 
             models.Index(fields=['profile_code']), 
             models.Index(fields=['is_active']), 
+            # Prefix matches; the substring indexes are created in migration 0005
+            models.Index(fields=['search_text'], name='profile_search_prefix_idx', opclasses=['varchar_pattern_ops']),
         ] 
      
     def __str__(self): 
         return f"{self.user.username} Profile" 
      
-    def generate_unique_code(self):
-        """Generate a unique profile code using username and random characters"""
-        # Get first 6 chars of username, or full username if shorter
-        # Remove any special characters and spaces from username
-        clean_username = ''.join(c for c in self.user.username if c.isalnum())
-        username_prefix = clean_username[:7].upper()
-        
-        # Generate 3 random chars to ensure uniqueness
-        random_suffix = ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))
-        code = f"{username_prefix}@{random_suffix}"
-        
-        # If code already exists, try again with different random suffix
-        while Profile.objects.filter(profile_code=code).exists():
-            random_suffix = ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))
-            code = f"{username_prefix}@{random_suffix}"
-        
-        return code
+    def generate_unique_code(self, attempt=0):
+        """Derive the profile code from the username and user id, without a query"""
+        from .profile_codes import code_for
+        return code_for(self.user, attempt)
+
+    def reassign_code(self):
+        """Re-derive the profile code, e.g. after a username change"""
+        self.profile_code = ''
+        self.save()
 
     def save(self, *args, **kwargs): 
-        if not self.profile_code: 
-            self.profile_code = self.generate_unique_code() 
-        super().save(*args, **kwargs) 
+        from .search import build_search_text
+        if self.profile_code:
+            self.search_text = build_search_text(self.user, self.profile_code)
+            return super().save(*args, **kwargs)
+
+        from .profile_codes import MAX_ATTEMPTS
+        for attempt in range(MAX_ATTEMPTS):
+            self.profile_code = self.generate_unique_code(attempt)
+            self.search_text = build_search_text(self.user, self.profile_code)
+            try:
+                # Inside a transaction a failed INSERT must not abort it
+                with transaction.atomic() if connection.in_atomic_block else nullcontext():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                # Derived codes only clash with codes set by hand or under
+                # another SECRET_KEY; any other integrity error is real
+                taken = Profile.objects.filter(profile_code=self.profile_code).exclude(pk=self.pk).exists()
+                if not taken or attempt == MAX_ATTEMPTS - 1:
+                    self.profile_code = ''
+                    raise
 
     def get_high_res_photo_url(self, photo_url):
         """Convert profile picture URL to highest resolution version"""
@@ -173,22 +186,30 @@ class FriendshipManager(models.Manager):
         user1, user2 = (user_a, user_b) if user_a.id < user_b.id else (user_b, user_a) 
         return self.filter(user1=user1, user2=user2).exists() 
      
-    def friends_of(self, user): 
-        """Get all friends of a user - optimized query with latest first""" 
-        friendships = self.filter( 
+    def friendships_of(self, user): 
+        """A user's friendships with both users' profiles loaded, latest first""" 
+        return self.filter( 
             Q(user1=user) | Q(user2=user) 
         ).select_related('user1', 'user2', 'user1__profile', 'user2__profile').order_by('-created_at')
-         
+
+    def friends_of(self, user): 
+        """Get all friends of a user - optimized query with latest first""" 
         return [ 
             fs.user2 if fs.user1 == user else fs.user1  
-            for fs in friendships 
+            for fs in self.friendships_of(user) 
+        ] 
+
+    async def afriends_of(self, user): 
+        """``friends_of`` through the async ORM""" 
+        return [ 
+            fs.user2 if fs.user1_id == user.id else fs.user1 
+            async for fs in self.friendships_of(user) 
         ] 
      
     def mutual_friends(self, user_a, user_b): 
         """Find mutual friends between two users""" 
-        friends_a = set(self.friends_of(user_a)) 
-        friends_b = set(self.friends_of(user_b)) 
-        return list(friends_a.intersection(friends_b)) 
+        from .friend_graph import mutual_friends
+        return list(User.objects.filter(id__in=mutual_friends(user_a, user_b)).select_related('profile'))
      
     def delete_friendship(self, user_a, user_b): 
         """Remove friendship between two users""" 
@@ -365,4 +386,35 @@ class GroupInvitation(TimeStampedModel):
         if not self.expires_at: 
             return False 
         from django.utils import timezone 
-        return timezone.now() > self.expires_at
\ No newline at end of file
+        return timezone.now() > self.expires_at
+
+class FriendSuggestion(models.Model):
+    """
+    One precomputed "people you may know" entry: ``suggested_user`` is not
+    yet a friend of ``user``, scored by mutual friends plus shared groups.
+    Maintained by connections/suggestions.py.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='friend_suggestions'
+    )
+    suggested_user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    mutual_friends = models.PositiveIntegerField(default=0)
+    shared_groups = models.PositiveIntegerField(default=0)
+    score = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'suggested_user')
+        indexes = [
+            # Serves a user's suggestions in page order
+            models.Index(fields=['user', '-score', 'suggested_user']),
+        ]
+
+    def __str__(self):
+        return f"Suggest {self.suggested_user_id} to {self.user_id} ({self.score})"
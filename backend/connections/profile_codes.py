@@ -0,0 +1,110 @@
+"""
+Profile codes.
+
+A profile code is the first seven letters and digits of the username,
+uppercased, then ``@`` and eight base32 characters derived from the user
+id, e.g. ``RAHUL@K3Q7ZM2A``. The suffix is a keyed Feistel permutation of
+the id over 40 bits: distinct ids always get distinct suffixes, so a new
+code is unique whatever its prefix without asking the database, and the
+key (derived from SECRET_KEY) keeps codes from giving away sign-up order.
+
+Codes issued before this scheme have four-character suffixes and can never
+equal a derived one. A clash is still possible with a code set by hand or
+derived under another SECRET_KEY; Profile.save then retries with the next
+``attempt``, which permutes with a different tweak.
+"""
+
+import hashlib
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils.encoding import force_bytes
+
+ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ234567'
+PREFIX_LENGTH = 7
+SUFFIX_LENGTH = 8
+HALF_BITS = SUFFIX_LENGTH * 5 // 2
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+MAX_ATTEMPTS = 8
+BULK_BATCH_SIZE = 1000
+
+
+# ============================================================================
+# CODES
+# ============================================================================
+
+@lru_cache(maxsize=4)
+def _key(secret):
+    return hashlib.blake2b(force_bytes(secret), digest_size=32, person=b'profile-code').digest()
+
+
+def _round(key, round_number, tweak, half):
+    digest = hashlib.blake2b(
+        half.to_bytes(3, 'big') + bytes((round_number, tweak)), key=key, digest_size=3
+    ).digest()
+    return int.from_bytes(digest, 'big') & HALF_MASK
+
+
+def permute(number, tweak=0):
+    """Keyed bijection on ``[0, 2**40)``; each ``tweak`` is another permutation"""
+    if not 0 <= number < 1 << 2 * HALF_BITS:
+        raise ValueError(f'{number} is outside the profile code space')
+    key = _key(settings.SECRET_KEY)
+    left, right = number >> HALF_BITS, number & HALF_MASK
+    for round_number in range(ROUNDS):
+        left, right = right, left ^ _round(key, round_number, tweak, right)
+    return left << HALF_BITS | right
+
+
+def encode(number):
+    return ''.join(
+        ALPHABET[number >> shift & 31] for shift in range(5 * (SUFFIX_LENGTH - 1), -1, -5)
+    )
+
+
+def prefix(username):
+    return ''.join(c for c in username if c.isalnum())[:PREFIX_LENGTH].upper()
+
+
+def code_for(user, attempt=0):
+    """The user's profile code; no query, the same for the same username and id"""
+    return f'{prefix(user.username)}@{encode(permute(user.id, attempt))}'
+
+
+# ============================================================================
+# BACKFILL
+# ============================================================================
+
+def backfill(batch_size=BULK_BATCH_SIZE, reassign=False):
+    """
+    Give every profile without a code (with ``reassign``, every profile) its
+    derived code, ``batch_size`` profiles per UPDATE. Returns the number of
+    profiles written.
+    """
+    from .models import Profile
+    from .search import build_search_text
+
+    profiles = Profile.objects.select_related('user').order_by('id')
+    if not reassign:
+        profiles = profiles.filter(profile_code='')
+    written, last_id = 0, 0
+    while True:
+        batch = list(profiles.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return written
+        last_id = batch[-1].id
+        for profile in batch:
+            profile.profile_code = code_for(profile.user)
+            # bulk_update skips Profile.save, which keeps search_text in step
+            profile.search_text = build_search_text(profile.user, profile.profile_code)
+        try:
+            with transaction.atomic():
+                Profile.objects.bulk_update(batch, ['profile_code', 'search_text'])
+        except IntegrityError:
+            # A code in the batch is taken; save one by one so the clash retries
+            for profile in batch:
+                profile.profile_code = ''
+                profile.save()
+        written += len(batch)
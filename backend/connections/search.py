@@ -0,0 +1,179 @@
+"""
+User search.
+
+Each Profile carries ``search_text``: the username, first and last name and
+profile code, lowercased, username first. Searches match against that one
+column of one table instead of an ``icontains`` across the user join, and
+every match is served by an index:
+
+- queries of three characters or more match anywhere in the text, through
+  a pg_trgm GIN index on PostgreSQL or an FTS5 trigram table on SQLite
+- shorter queries (and databases without those indexes) match the start of
+  the text, i.e. the username, through a btree range scan
+
+Matches are ranked exact username, then username prefix, then the start of
+any other word, then anywhere, and ordered by ``search_text`` within a rank.
+Pages are cut with keyset cursors over ``(rank, search_text, id)``, so
+every page costs the same whatever its depth.
+
+``search_text`` is written by ``Profile.save`` and refreshed when the
+user's names change (see connections/signals.py); the indexes are created
+in migration 0005.
+"""
+
+import base64
+import json
+from functools import reduce
+from operator import or_
+
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'connections_profile_search_fts'
+MIN_SUBSTRING_LENGTH = 3
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+SORT_FIELDS = ('search_rank', 'search_text', 'id')
+
+_fts_available = None
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# ============================================================================
+# DOCUMENTS
+# ============================================================================
+
+def normalize(text):
+    """Lowercase and collapse whitespace, the form search text is stored in"""
+    return ' '.join(text.split()).lower()
+
+
+def build_search_text(user, profile_code):
+    return normalize(' '.join(
+        part for part in (user.username, user.first_name, user.last_name, profile_code) if part
+    ))
+
+
+def index_user(user):
+    """Refresh the search text of the user's profile after a name change"""
+    from .models import Profile
+
+    for profile in Profile.objects.filter(user_id=user.id).only('id', 'profile_code', 'search_text'):
+        text = build_search_text(user, profile.profile_code)
+        if text != profile.search_text:
+            Profile.objects.filter(id=profile.id).update(search_text=text)
+
+
+# ============================================================================
+# MATCHING
+# ============================================================================
+
+def has_fts_table():
+    """Whether the SQLite FTS5 table was created by the migration"""
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = FTS_TABLE in connection.introspection.table_names()
+    return _fts_available
+
+
+def _prefix(needle):
+    if connection.vendor == 'postgresql':
+        # LIKE 'needle%', served by the varchar_pattern_ops index
+        return Q(search_text__startswith=needle)
+    # SQLite's LIKE is case-insensitive and can't use a plain index; a
+    # range over the binary-collated column can
+    return Q(search_text__gte=needle, search_text__lt=needle + '\U0010ffff')
+
+
+def _substring(needle):
+    if connection.vendor == 'postgresql':
+        # LIKE '%needle%', served by the pg_trgm index
+        return Q(search_text__contains=needle)
+    if connection.vendor == 'sqlite' and has_fts_table():
+        phrase = '"' + needle.replace('"', '""') + '"'
+        return Q(id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [phrase]))
+    return Q(search_text__contains=needle)
+
+
+def search_profiles(profiles, query):
+    """
+    ``profiles`` narrowed to matches of ``query`` and annotated with
+    ``search_rank`` (0 is best). A blank query matches everything at rank 0.
+    """
+    needle = normalize(query or '')
+    if not needle:
+        return profiles.annotate(search_rank=Value(0, output_field=IntegerField()))
+    match = _substring(needle) if len(needle) >= MIN_SUBSTRING_LENGTH else _prefix(needle)
+    return profiles.filter(match).annotate(search_rank=Case(
+        When(search_text__startswith=needle + ' ', then=Value(0)),
+        When(search_text__startswith=needle, then=Value(1)),
+        When(search_text__contains=' ' + needle, then=Value(2)),
+        default=Value(3),
+        output_field=IntegerField(),
+    ))
+
+
+# ============================================================================
+# PAGES
+# ============================================================================
+
+def encode_cursor(profile, fields=SORT_FIELDS):
+    payload = json.dumps([getattr(profile, field) for field in fields])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, fields=SORT_FIELDS):
+    """The ``fields`` values of a page cursor, e.g. ``(search_rank, search_text, id)``"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(fields):
+            raise ValueError
+        for field, value in zip(fields, values):
+            if not isinstance(value, str if field == 'search_text' else int):
+                raise ValueError
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor.')
+    return tuple(values)
+
+
+def after(fields, values):
+    """Filter for the rows past ``values`` in ascending ``fields`` order"""
+    return reduce(or_, (
+        Q(**dict(zip(fields[:i], values[:i])), **{f'{field}__gt': values[i]})
+        for i, field in enumerate(fields)
+    ))
+
+
+def _order_fields(profiles, fields, pinned=()):
+    """
+    ``fields`` less those every row shares: ``pinned`` ones, filtered to a
+    single value by the caller, and the rank of a blank search. Sorting on
+    a constant would keep the database from reading rows in index order.
+    """
+    constant = set(pinned)
+    if isinstance(profiles.query.annotations.get('search_rank'), Value):
+        constant.add('search_rank')
+    return [field for field in fields if field not in constant]
+
+
+def ranked(profiles, fields=SORT_FIELDS):
+    return profiles.order_by(*_order_fields(profiles, fields))
+
+
+def paginate_by_cursor(profiles, cursor=None, limit=DEFAULT_LIMIT, fields=SORT_FIELDS, pinned=()):
+    """
+    ``(page, next_cursor)`` for a queryset from ``search_profiles``, sorted
+    on ``fields``. ``next_cursor`` is None on the last page.
+    """
+    limit = max(1, min(limit, MAX_LIMIT))
+    order = _order_fields(profiles, fields, pinned)
+    if cursor:
+        values = dict(zip(fields, decode_cursor(cursor, fields)))
+        profiles = profiles.filter(after(order, [values[field] for field in order]))
+    page = list(profiles.order_by(*order)[:limit + 1])
+    return page[:limit], encode_cursor(page[limit - 1], fields) if len(page) > limit else None
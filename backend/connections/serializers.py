@@ -327,7 +327,9 @@ class UserGroupListSerializer(serializers.ModelSerializer):
         return obj.created_by.username
 
     def get_member_count(self, obj):
-        return obj.members.count()
+        # Views annotate member_total so listing groups doesn't count each one
+        member_total = getattr(obj, 'member_total', None)
+        return obj.members.count() if member_total is None else member_total
 
     def get_is_creator(self, obj):
         request = self.context.get('request')
@@ -576,11 +578,13 @@ class GroupDetailsSerializer(serializers.ModelSerializer):
 
     def get_sent_invitations(self, obj):
         try:
-            # Get pending invitations sent by the group
-            invitations = GroupInvitation.objects.filter(
-                group=obj,
-                status='pending'
-            ).select_related('invited_user', 'invited_user__profile')
+            # Get pending invitations sent by the group (prefetched by the views)
+            invitations = getattr(obj, 'pending_invitations', None)
+            if invitations is None:
+                invitations = GroupInvitation.objects.filter(
+                    group=obj,
+                    status='pending'
+                ).select_related('invited_user', 'invited_user__profile')
             
             return [
                 {
@@ -0,0 +1,189 @@
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from project import caching, events
+from . import friend_graph, search, suggestions
+from .models import Profile, FriendRequest, Friendship, Group, GroupInvitation
+
+# ============================================================================
+# CACHE INVALIDATION HELPERS
+# ============================================================================
+
+def invalidate_groups(group_ids, user_ids=()):
+    """
+    Group details and member counts appear in every member's group list,
+    so a group change invalidates the group and the group list of each
+    member (plus ``user_ids`` that just left).
+    """
+    group_ids = set(group_ids)
+    member_ids = set(user_ids)
+    member_ids.update(
+        Group.members.through.objects.filter(group_id__in=group_ids).values_list('user_id', flat=True)
+    )
+    caching.bump('group', group_ids)
+    caching.bump('groups', member_ids)
+
+
+def _counterparts(pairs, user_id):
+    return {other_id for pair in pairs for other_id in pair if other_id != user_id}
+
+
+def invalidate_user(user_id):
+    """
+    A user's name, code or picture shows in friends' lists, in pending
+    requests and invitations, in balance lists and in their groups.
+    """
+    from expense.models import UserTotalBalance
+
+    friendships = Friendship.objects.filter(Q(user1_id=user_id) | Q(user2_id=user_id))
+    caching.bump('friends', _counterparts(friendships.values_list('user1_id', 'user2_id'), user_id))
+    requests = FriendRequest.objects.filter(Q(from_user_id=user_id) | Q(to_user_id=user_id), status='pending')
+    caching.bump('friend-requests', _counterparts(requests.values_list('from_user_id', 'to_user_id'), user_id))
+    invitations = GroupInvitation.objects.filter(Q(invited_by_id=user_id) | Q(invited_user_id=user_id), status='pending')
+    caching.bump('group-invitations', _counterparts(invitations.values_list('invited_by_id', 'invited_user_id'), user_id))
+    totals = UserTotalBalance.objects.filter(Q(user1_id=user_id) | Q(user2_id=user_id))
+    caching.bump('balances', _counterparts(totals.values_list('user1_id', 'user2_id'), user_id))
+    invalidate_groups(Group.members.through.objects.filter(user_id=user_id).values_list('group_id', flat=True))
+
+# ============================================================================
+# FRIENDSHIP SIGNALS
+# ============================================================================
+
+@receiver(post_save, sender=Friendship)
+@receiver(post_delete, sender=Friendship)
+def invalidate_friends_on_friendship_change(sender, instance, **kwargs):
+    caching.bump('friends', [instance.user1_id, instance.user2_id])
+    friend_graph.invalidate([instance.user1_id, instance.user2_id])
+
+@receiver(post_save, sender=Profile)
+def invalidate_on_profile_change(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_user(instance.user_id)
+
+@receiver(post_save, sender=User)
+def invalidate_on_user_change(sender, instance, created, update_fields=None, **kwargs):
+    # Logins only touch last_login, which no cached response shows
+    if created or update_fields == frozenset(['last_login']):
+        return
+    invalidate_user(instance.id)
+
+@receiver(post_save, sender=FriendRequest)
+@receiver(post_delete, sender=FriendRequest)
+def invalidate_friend_requests_on_change(sender, instance, **kwargs):
+    caching.bump('friend-requests', [instance.from_user_id, instance.to_user_id])
+
+# ============================================================================
+# GROUP SIGNALS
+# ============================================================================
+
+@receiver(post_save, sender=Group)
+def invalidate_on_group_change(sender, instance, created, **kwargs):
+    invalidate_groups([instance.id])
+    if not created:
+        # Group names and descriptions show in pending invitations
+        invitations = instance.invitations.filter(status='pending').values_list('invited_by_id', 'invited_user_id')
+        caching.bump('group-invitations', {user_id for pair in invitations for user_id in pair})
+
+@receiver(pre_delete, sender=Group)
+def invalidate_on_group_delete(sender, instance, **kwargs):
+    # Memberships are gone by post_delete, so collect the members now
+    invalidate_groups([instance.id])
+
+@receiver(m2m_changed, sender=Group.members.through)
+def invalidate_on_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        # user.groups_joined.add(...): instance is the user, pk_set the groups
+        group_ids = pk_set if pk_set is not None else Group.members.through.objects.filter(
+            user_id=instance.id).values_list('group_id', flat=True)
+        invalidate_groups(group_ids, user_ids=[instance.id])
+    else:
+        invalidate_groups([instance.id], user_ids=pk_set or ())
+
+@receiver(post_save, sender=GroupInvitation)
+@receiver(post_delete, sender=GroupInvitation)
+def invalidate_on_invitation_change(sender, instance, **kwargs):
+    # Pending invitations are part of the group details
+    caching.bump('group', [instance.group_id])
+    caching.bump('group-invitations', [instance.invited_user_id, instance.invited_by_id])
+
+# ============================================================================
+# PUSH EVENT SIGNALS
+# ============================================================================
+
+@receiver(post_save, sender=FriendRequest)
+def publish_friend_request_event(sender, instance, created, **kwargs):
+    if created:
+        events.publish([instance.to_user_id], 'friend_request', {
+            'request_id': instance.id,
+            'from_user_id': instance.from_user_id,
+            'from_username': instance.from_user.username,
+        })
+    else:
+        events.publish([instance.from_user_id, instance.to_user_id], 'friend_request_updated', {
+            'request_id': instance.id,
+            'status': instance.status,
+        })
+
+@receiver(post_save, sender=GroupInvitation)
+def publish_group_invitation_event(sender, instance, created, **kwargs):
+    if created:
+        events.publish([instance.invited_user_id], 'group_invitation', {
+            'invitation_id': instance.id,
+            'group_id': instance.group_id,
+            'group_name': instance.group.name,
+            'invited_by_username': instance.invited_by.username,
+        })
+    else:
+        events.publish([instance.invited_by_id, instance.invited_user_id], 'group_invitation_updated', {
+            'invitation_id': instance.id,
+            'group_id': instance.group_id,
+            'status': instance.status,
+        })
+
+# ============================================================================
+# USER SEARCH SIGNALS
+# ============================================================================
+
+@receiver(post_save, sender=User)
+def index_user_on_change(sender, instance, created, update_fields=None, **kwargs):
+    # New users are indexed when their profile is created
+    if created or update_fields == frozenset(['last_login']):
+        return
+    search.index_user(instance)
+
+# ============================================================================
+# FRIEND SUGGESTION SIGNALS
+# ============================================================================
+
+@receiver(post_save, sender=Friendship)
+def queue_suggestions_on_friendship_save(sender, instance, created, **kwargs):
+    if created:
+        suggestions.friendship_changed(instance.user1_id, instance.user2_id)
+
+@receiver(post_delete, sender=Friendship)
+def queue_suggestions_on_friendship_delete(sender, instance, **kwargs):
+    suggestions.friendship_changed(instance.user1_id, instance.user2_id)
+
+@receiver(m2m_changed, sender=Group.members.through)
+def queue_suggestions_on_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        if reverse:
+            for group_id in pk_set:
+                suggestions.membership_changed(group_id, [instance.id])
+        else:
+            suggestions.membership_changed(instance.id, pk_set)
+    elif action == 'pre_clear':
+        # The memberships are gone by commit time, so name them now
+        memberships = Group.members.through.objects.filter(
+            **({'user_id': instance.id} if reverse else {'group_id': instance.id})
+        ).values_list('group_id', 'user_id')
+        for group_id, user_id in memberships:
+            suggestions.membership_changed(group_id, [user_id])
+
+@receiver(pre_delete, sender=Group)
+def queue_suggestions_on_group_delete(sender, instance, **kwargs):
+    suggestions.membership_changed(instance.id, instance.members.values_list('id', flat=True))
@@ -0,0 +1,251 @@
+"""
+"People you may know".
+
+FriendSuggestion holds, for each user, a ranked list of people who are not
+their friends yet. A candidate's score is the number of mutual friends plus
+the number of groups the two share, so serving a page is one indexed range
+read on ``(user, -score, suggested_user)``.
+
+The lists are maintained incrementally, on commit:
+
+- a friendship between A and B recomputes A's and B's whole lists, and the
+  single entries (friend of A, B) and (friend of B, A) whose mutual count
+  it changed
+- joining or leaving a group recomputes the entries between that user and
+  every other member, in both directions
+
+Only those pairs are rescored, so a write costs a few queries however
+large the graph is. Entries added this way may grow a list past
+MAX_SUGGESTIONS until the next full rebuild (rebuild_friend_suggestions).
+"""
+
+import base64
+import json
+import threading
+from collections import Counter
+from functools import reduce
+from heapq import nsmallest
+from operator import or_
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+
+from .friend_graph import load_friend_ids
+from .models import FriendSuggestion, Group
+
+MAX_SUGGESTIONS = 100
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+BULK_BATCH_SIZE = 1000
+
+Membership = Group.members.through
+
+_state = threading.local()
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# ============================================================================
+# SCORING
+# ============================================================================
+
+def _group_ids_of(user_ids):
+    groups = {user_id: set() for user_id in user_ids}
+    for user_id, group_id in Membership.objects.filter(user_id__in=user_ids).values_list('user_id', 'group_id'):
+        groups[user_id].add(group_id)
+    return groups
+
+
+def _suggestion(user_id, suggested_user_id, mutual_friends, shared_groups):
+    return FriendSuggestion(
+        user_id=user_id,
+        suggested_user_id=suggested_user_id,
+        mutual_friends=mutual_friends,
+        shared_groups=shared_groups,
+        score=mutual_friends + shared_groups,
+    )
+
+
+def build_suggestions(user_ids):
+    """Unsaved FriendSuggestion rows: the top MAX_SUGGESTIONS for each user"""
+    user_ids = set(user_ids)
+    friends = load_friend_ids(user_ids)
+    friends_of_friends = load_friend_ids(set().union(*friends.values()))
+    groups = _group_ids_of(user_ids)
+    members = {}
+    for group_id, member_id in Membership.objects.filter(
+        group_id__in=set().union(*groups.values())
+    ).values_list('group_id', 'user_id'):
+        members.setdefault(group_id, []).append(member_id)
+
+    rows = []
+    for user_id in user_ids:
+        mutual = Counter()
+        for friend_id in friends[user_id]:
+            mutual.update(friends_of_friends[friend_id])
+        shared = Counter()
+        for group_id in groups[user_id]:
+            shared.update(members.get(group_id, ()))
+        candidates = (set(mutual) | set(shared)) - friends[user_id] - {user_id}
+        top = nsmallest(
+            MAX_SUGGESTIONS, candidates,
+            key=lambda candidate: (-(mutual[candidate] + shared[candidate]), candidate)
+        )
+        rows.extend(_suggestion(user_id, candidate, mutual[candidate], shared[candidate]) for candidate in top)
+    return rows
+
+
+def refresh_users(user_ids):
+    """Recompute the whole suggestion list of each of ``user_ids``"""
+    # Users queued by a transaction that was rolled back may not exist
+    user_ids = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+    if not user_ids:
+        return 0
+    rows = build_suggestions(user_ids)
+    with transaction.atomic():
+        FriendSuggestion.objects.filter(user_id__in=user_ids).delete()
+        FriendSuggestion.objects.bulk_create(rows, batch_size=BULK_BATCH_SIZE)
+    return len(rows)
+
+
+def refresh_pairs(pairs):
+    """Rescore the ``(user_id, suggested_user_id)`` entries in ``pairs``"""
+    pairs = {(user_id, other_id) for user_id, other_id in pairs if user_id != other_id}
+    ids = {user_id for pair in pairs for user_id in pair}
+    existing = set(User.objects.filter(id__in=ids).values_list('id', flat=True))
+    pairs = {pair for pair in pairs if pair[0] in existing and pair[1] in existing}
+    if not pairs:
+        return
+    friends = load_friend_ids(existing)
+    groups = _group_ids_of(existing)
+
+    upserts, removals = [], {}
+    for user_id, other_id in pairs:
+        mutual = 0 if other_id in friends[user_id] else len(friends[user_id] & friends[other_id])
+        shared = 0 if other_id in friends[user_id] else len(groups[user_id] & groups[other_id])
+        if mutual + shared:
+            upserts.append(_suggestion(user_id, other_id, mutual, shared))
+        else:
+            removals.setdefault(user_id, []).append(other_id)
+
+    with transaction.atomic():
+        if removals:
+            FriendSuggestion.objects.filter(reduce(or_, (
+                Q(user_id=user_id, suggested_user_id__in=other_ids) for user_id, other_ids in removals.items()
+            ))).delete()
+        FriendSuggestion.objects.bulk_create(
+            upserts,
+            batch_size=BULK_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['user', 'suggested_user'],
+            update_fields=['mutual_friends', 'shared_groups', 'score', 'updated_at'],
+        )
+
+
+def rebuild_all(batch_size=BULK_BATCH_SIZE):
+    """Recompute every user's list, ``batch_size`` users at a time"""
+    user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+    written = 0
+    for start in range(0, len(user_ids), batch_size):
+        written += refresh_users(user_ids[start:start + batch_size])
+    return written
+
+
+# ============================================================================
+# DEFERRED REFRESH
+# ============================================================================
+
+def _pending():
+    pending = getattr(_state, 'pending', None)
+    if pending is None:
+        pending = _state.pending = {'friendships': set(), 'memberships': {}}
+    return pending
+
+
+def friendship_changed(user1_id, user2_id):
+    """Queue a created or deleted friendship; refreshed once, on commit"""
+    _pending()['friendships'].add((user1_id, user2_id))
+    transaction.on_commit(flush_dirty)
+
+
+def membership_changed(group_id, user_ids):
+    """
+    Queue users who joined or left ``group_id``; refreshed once, on commit.
+    Pass every member when the whole group goes away.
+    """
+    _pending()['memberships'].setdefault(group_id, set()).update(user_ids)
+    transaction.on_commit(flush_dirty)
+
+
+def flush_dirty():
+    """Refresh every list and entry touched by the queued changes"""
+    pending = getattr(_state, 'pending', None)
+    if not pending:
+        return
+    _state.pending = None
+
+    users, pairs = set(), set()
+    friendships = pending['friendships']
+    if friendships:
+        # Friends as of the commit: a friend of A now has B one mutual
+        # friend closer (or further, if the friendship was deleted)
+        friends = load_friend_ids({user_id for pair in friendships for user_id in pair})
+        for user1_id, user2_id in friendships:
+            users.update((user1_id, user2_id))
+            pairs.update((friend_id, user2_id) for friend_id in friends[user1_id])
+            pairs.update((friend_id, user1_id) for friend_id in friends[user2_id])
+
+    memberships = pending['memberships']
+    if memberships:
+        members = {group_id: set(user_ids) for group_id, user_ids in memberships.items()}
+        for group_id, user_id in Membership.objects.filter(group_id__in=members).values_list('group_id', 'user_id'):
+            members[group_id].add(user_id)
+        for group_id, user_ids in memberships.items():
+            for user_id in user_ids:
+                for other_id in members[group_id]:
+                    pairs.update(((user_id, other_id), (other_id, user_id)))
+
+    refresh_users(users)
+    # Entries of fully recomputed users are already current
+    refresh_pairs({pair for pair in pairs if pair[0] not in users})
+
+
+# ============================================================================
+# PAGES
+# ============================================================================
+
+def encode_cursor(suggestion):
+    payload = json.dumps([suggestion.score, suggestion.suggested_user_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """``(score, suggested_user_id)`` of a page cursor"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        score, suggested_user_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(score, int) or not isinstance(suggested_user_id, int):
+            raise ValueError
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor.')
+    return score, suggested_user_id
+
+
+def suggestions_page(user, cursor=None, limit=DEFAULT_LIMIT):
+    """
+    One page of the user's suggestions, best first, as ``(rows, next_cursor)``.
+    Rows come with the suggested user's profile loaded.
+    """
+    limit = max(1, min(limit, MAX_LIMIT))
+    rows = FriendSuggestion.objects.filter(
+        user=user, suggested_user__profile__is_active=True
+    ).select_related('suggested_user__profile')
+    if cursor:
+        score, suggested_user_id = decode_cursor(cursor)
+        rows = rows.filter(Q(score__lt=score) | Q(score=score, suggested_user_id__gt=suggested_user_id))
+    rows = list(rows.order_by('-score', 'suggested_user_id')[:limit + 1])
+    page = rows[:limit]
+    return page, encode_cursor(page[-1]) if len(rows) > limit else None
@@ -1,3 +1,361 @@
-from django.test import TestCase
+import json
+from types import SimpleNamespace
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from expense.views import list_user_total_balances_async
+from . import friend_graph, profile_codes
+from .models import FriendRequest, Friendship, Group, GroupInvitation, Profile
+from .views import get_friends_list_async, get_group_details_async, list_user_groups_async
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=True)
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user('user1', 'user1@test.com', 'pass123')
+        self.user2 = User.objects.create_user('user2', 'user2@test.com', 'pass123')
+        self.user3 = User.objects.create_user('user3', 'user3@test.com', 'pass123')
+        with self.captureOnCommitCallbacks(execute=True):
+            Friendship.objects.create(user1=self.user1, user2=self.user2)
+            self.group = Group.objects.create(name='Trip', created_by=self.user1)
+            self.group.members.add(self.user1, self.user2)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user1)
+
+    def test_friends_list_is_cached_until_friendships_change(self):
+        first = self.client.get('/api/friends/list/')
+        self.assertEqual([friend['username'] for friend in first.data], ['user2'])
+        etag = first['ETag']
+
+        with CaptureQueriesContext(connection) as ctx:
+            second = self.client.get('/api/friends/list/')
+        self.assertEqual(len(ctx.captured_queries), 0)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['ETag'], etag)
+
+        not_modified = self.client.get('/api/friends/list/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Friendship.objects.create(user1=self.user1, user2=self.user3)
+        third = self.client.get('/api/friends/list/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(third.status_code, 200)
+        self.assertNotEqual(third['ETag'], etag)
+        self.assertEqual(sorted(friend['username'] for friend in third.data), ['user2', 'user3'])
+
+        # Profile changes reach friends' cached lists
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user3.profile.profile_picture_url = 'https://example.com/user3.png'
+            self.user3.profile.save()
+        fourth = self.client.get('/api/friends/list/')
+        pictures = {friend['username']: friend['profile_picture_url'] for friend in fourth.data}
+        self.assertEqual(pictures['user3'], 'https://example.com/user3.png')
+
+    def test_group_responses_follow_membership_changes(self):
+        details = self.client.get(f'/api/group/details/{self.group.id}/')
+        groups = self.client.get('/api/group/list/')
+        self.assertEqual(details.data['member_count'], 2)
+        self.assertEqual(groups.data[0]['member_count'], 2)
+
+        # Non-members are refused even while a member's response is cached
+        outsider = APIClient()
+        outsider.force_authenticate(self.user3)
+        self.assertEqual(outsider.get(f'/api/group/details/{self.group.id}/').status_code, 403)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.members.add(self.user3)
+        details = self.client.get(f'/api/group/details/{self.group.id}/', HTTP_IF_NONE_MATCH=details['ETag'])
+        groups = self.client.get('/api/group/list/', HTTP_IF_NONE_MATCH=groups['ETag'])
+        self.assertEqual(details.status_code, 200)
+        self.assertEqual(details.data['member_count'], 3)
+        self.assertEqual(groups.data[0]['member_count'], 3)
+        self.assertEqual(outsider.get(f'/api/group/details/{self.group.id}/').status_code, 200)
+
+    def test_pending_friend_requests_answer_conditional_gets(self):
+        first = self.client.get('/api/friend-request/pending/')
+        self.assertEqual(first.data['sent_requests'], [])
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/friend-request/pending/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            FriendRequest.objects.create(from_user=self.user1, to_user=self.user3)
+        response = self.client.get('/api/friend-request/pending/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['to_username'] for r in response.data['sent_requests']], ['user3'])
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=True)
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user('user1', 'user1@test.com', 'pass123')
+        self.user2 = User.objects.create_user('user2', 'user2@test.com', 'pass123')
+        self.user3 = User.objects.create_user('user3', 'user3@test.com', 'pass123')
+        Friendship.objects.create(user1=self.user1, user2=self.user2)
+        self.group = Group.objects.create(name='Trip', created_by=self.user1)
+        self.group.members.add(self.user1, self.user2)
+        GroupInvitation.objects.create(group=self.group, invited_by=self.user1, invited_user=self.user3)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user1)
+        self.headers = {'Authorization': f'Bearer {RefreshToken.for_user(self.user1).access_token}'}
+        self.outsider = {'Authorization': f'Bearer {RefreshToken.for_user(self.user3).access_token}'}
+        self.factory = AsyncRequestFactory()
+
+    async def test_async_views_match_sync_views(self):
+        views = [
+            ('/api/friends/list/', get_friends_list_async, {}),
+            ('/api/group/list/', list_user_groups_async, {}),
+            (f'/api/group/details/{self.group.id}/', get_group_details_async, {'group_id': self.group.id}),
+            ('/api/expenses/user-total-balances/', list_user_total_balances_async, {}),
+        ]
+        for path, view, kwargs in views:
+            expected = await sync_to_async(self.client.get)(path)
+            response = await view(self.factory.get(path, headers=self.headers), **kwargs)
+            self.assertEqual(response.status_code, 200, path)
+            self.assertEqual(json.loads(response.content), json.loads(expected.content), path)
+
+            # Cached bodies and conditional GETs behave like the sync views
+            repeat = await view(self.factory.get(path, headers=self.headers), **kwargs)
+            self.assertEqual(repeat.content, response.content)
+            revalidated = await view(
+                self.factory.get(path, headers={**self.headers, 'If-None-Match': response['ETag']}), **kwargs
+            )
+            self.assertEqual(revalidated.status_code, 304, path)
+
+    async def test_async_views_authenticate_and_authorize(self):
+        response = await get_friends_list_async(self.factory.get('/api/friends/list/'))
+        self.assertEqual(response.status_code, 401)
+
+        path = f'/api/group/details/{self.group.id}/'
+        response = await get_group_details_async(self.factory.get(path, headers=self.outsider), group_id=self.group.id)
+        self.assertEqual(response.status_code, 403)
+        response = await get_group_details_async(self.factory.get(path, headers=self.headers), group_id=0)
+        self.assertEqual(response.status_code, 404)
+
+
+class FriendGraphTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create_user(f'user{i}', f'user{i}@test.com', 'pass123') for i in range(5)]
+        u = self.users
+        with self.captureOnCommitCallbacks(execute=True):
+            for a, b in [(0, 1), (0, 2), (1, 2), (1, 3), (2, 3), (3, 4)]:
+                Friendship.objects.create(user1=u[a], user2=u[b])
+
+    def test_lookups_are_served_from_the_cache(self):
+        u = self.users
+        self.assertEqual(friend_graph.friend_ids(u[1]), {u[0].id, u[2].id, u[3].id})
+        with self.assertNumQueries(0):
+            self.assertTrue(friend_graph.are_friends(u[1], u[3].id))
+            self.assertFalse(friend_graph.are_friends(u[1], u[4]))
+        self.assertEqual(friend_graph.mutual_friends(u[0], u[3]), {u[1].id, u[2].id})
+        # u3 shares u1 and u2 with u0; u4 is not connected to u0's friends
+        self.assertEqual(friend_graph.suggestions(u[0]), [(u[3].id, 2)])
+
+    def test_friendship_changes_reach_the_graph_on_commit(self):
+        u = self.users
+        self.assertFalse(friend_graph.are_friends(u[0], u[4]))
+        with self.captureOnCommitCallbacks(execute=True):
+            Friendship.objects.create(user1=u[0], user2=u[4])
+            Friendship.objects.delete_friendship(u[0], u[1])
+        self.assertTrue(friend_graph.are_friends(u[4], u[0]))
+        self.assertEqual(friend_graph.friend_ids(u[0]), {u[2].id, u[4].id})
+        self.assertEqual(friend_graph.suggestions(u[0]), [(u[3].id, 2), (u[1].id, 1)])
+
+
+class FriendSuggestionTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(f'user{i}', f'user{i}@test.com', 'pass123') for i in range(5)]
+        u = self.users
+        with self.captureOnCommitCallbacks(execute=True):
+            for a, b in [(0, 1), (0, 2), (1, 3), (2, 3)]:
+                Friendship.objects.create(user1=u[a], user2=u[b])
+            group = Group.objects.create(name='Flat', created_by=u[0])
+            group.members.add(u[0], u[4])
+
+        self.client = APIClient()
+        self.client.force_authenticate(u[0])
+
+    def suggested(self, **params):
+        response = self.client.get('/api/friends/suggestions/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_suggestions_are_ranked_and_paginated(self):
+        u = self.users
+        data = self.suggested()
+        self.assertEqual(
+            [(s['username'], s['mutual_friends'], s['shared_groups']) for s in data['suggestions']],
+            [('user3', 2, 0), ('user4', 0, 1)]
+        )
+
+        first = self.suggested(limit=1)
+        self.assertTrue(first['has_more'])
+        second = self.suggested(limit=1, cursor=first['next_cursor'])
+        self.assertEqual([s['user_id'] for s in second['suggestions']], [u[4].id])
+        self.assertFalse(second['has_more'])
+        self.assertEqual(self.client.get('/api/friends/suggestions/', {'cursor': 'bogus'}).status_code, 400)
+
+    def test_friendship_and_membership_changes_refresh_suggestions(self):
+        u = self.users
+        with self.captureOnCommitCallbacks(execute=True):
+            Friendship.objects.create(user1=u[0], user2=u[3])
+        # user3 is a friend now, and user4 gains user3 as a mutual friend
+        self.assertEqual([s['username'] for s in self.suggested()['suggestions']], ['user4'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Friendship.objects.create(user1=u[3], user2=u[4])
+        self.assertEqual(
+            [(s['username'], s['mutual_friends'], s['shared_groups']) for s in self.suggested()['suggestions']],
+            [('user4', 1, 1)]
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Group.objects.get(name='Flat').members.remove(u[4])
+            Friendship.objects.delete_friendship(u[3], u[4])
+        self.assertEqual(self.suggested()['suggestions'], [])
+
+
+class UserSearchTests(TestCase):
+    def setUp(self):
+        self.me = User.objects.create_user('me', 'me@test.com', 'pass123')
+        for username, first_name in [('rahul', ''), ('rahulk', ''), ('arahul', ''), ('priya', 'Rahul'), ('amit', '')]:
+            User.objects.create_user(username, f'{username}@test.com', 'pass123', first_name=first_name)
+        self.client = APIClient()
+        self.client.force_authenticate(self.me)
+
+    def usernames(self, **params):
+        response = self.client.get('/api/profile/list-others/', params)
+        self.assertEqual(response.status_code, 200)
+        return [user['username'] for user in response.data['users']], response.data['pagination']
+
+    def test_search_ranks_username_matches_first(self):
+        # Exact username, username prefix, another word's prefix, then anywhere
+        usernames, pagination = self.usernames(search='Rahul')
+        self.assertEqual(usernames, ['rahul', 'rahulk', 'priya', 'arahul'])
+        self.assertEqual(pagination['total_count'], 4)
+        # Queries too short for trigrams match username prefixes
+        self.assertEqual(self.usernames(search='ra')[0], ['rahul', 'rahulk'])
+
+    def test_search_pages_by_cursor(self):
+        seen, cursor = [], ''
+        while cursor is not None:
+            usernames, pagination = self.usernames(search='rahul', page_size=3, cursor=cursor)
+            self.assertNotIn('total_count', pagination)
+            seen += usernames
+            cursor = pagination['next_cursor']
+        self.assertEqual(seen, ['rahul', 'rahulk', 'priya', 'arahul'])
+
+    def test_name_changes_are_searchable(self):
+        amit = User.objects.get(username='amit')
+        amit.last_name = 'Rahulson'
+        amit.save()
+        self.assertIn('amit', self.usernames(search='rahulson')[0])
+
+
+class PeopleDirectoryTests(TestCase):
+    def setUp(self):
+        self.me = User.objects.create_user('me', 'me@test.com', 'pass123')
+        users = {
+            username: User.objects.create_user(username, f'{username}@test.com', 'pass123')
+            for username in ['amit', 'bela', 'chen', 'dev', 'esha', 'farah']
+        }
+        Friendship.objects.create(user1=self.me, user2=users['esha'])
+        Friendship.objects.create(user1=self.me, user2=users['chen'])
+        FriendRequest.objects.create(from_user=self.me, to_user=users['dev'])
+        FriendRequest.objects.create(from_user=users['farah'], to_user=self.me)
+        self.client = APIClient()
+        self.client.force_authenticate(self.me)
+
+    def get(self, **params):
+        response = self.client.get('/api/profile/list-all/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_friends_then_pending_then_others(self):
+        data = self.get(page_size=20)
+        self.assertEqual(
+            [(user['username'], user['is_friend'], user['friend_request_status']) for user in data['users']],
+            [
+                ('chen', True, 'none'), ('esha', True, 'none'),
+                ('dev', False, 'sent'), ('farah', False, 'received'),
+                ('amit', False, 'none'), ('bela', False, 'none'),
+            ]
+        )
+        self.assertEqual(data['pagination']['total_count'], 6)
+
+    def test_pages_are_bounded(self):
+        # Friends are no longer repeated ahead of every page
+        first, second = self.get(page_size=2), self.get(page=2, page_size=2)
+        self.assertEqual([user['username'] for user in first['users']], ['chen', 'esha'])
+        self.assertEqual([user['username'] for user in second['users']], ['dev', 'farah'])
+        self.assertEqual(first['pagination']['total_pages'], 3)
+
+    def test_cursor_pages_cover_the_stream_in_one_query_each(self):
+        seen, cursor = [], ''
+        while cursor is not None:
+            with CaptureQueriesContext(connection) as queries:
+                data = self.get(page_size=2, cursor=cursor)
+            self.assertEqual(len(queries), 1)
+            seen += [user['username'] for user in data['users']]
+            cursor = data['pagination']['next_cursor']
+        self.assertEqual(seen, ['chen', 'esha', 'dev', 'farah', 'amit', 'bela'])
+
+    def test_search_within_the_stream(self):
+        data = self.get(search='e')
+        self.assertEqual([user['username'] for user in data['users']], ['esha'])
+        self.assertEqual(self.client.get('/api/profile/list-all/', {'cursor': 'junk'}).status_code, 400)
+
+
+class ProfileCodeTests(TestCase):
+    def test_codes_are_derived_without_queries(self):
+        users = [SimpleNamespace(id=user_id, username='rahul.k') for user_id in range(1, 5001)]
+        with CaptureQueriesContext(connection) as queries:
+            codes = {profile_codes.code_for(user) for user in users}
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(len(codes), len(users))
+        self.assertRegex(next(iter(codes)), r'^RAHULK@[A-Z2-7]{8}$')
+
+    def test_signup_and_rename(self):
+        user = User.objects.create_user('priya', 'priya@test.com', 'pass123')
+        code = user.profile.profile_code
+        self.assertEqual(code, profile_codes.code_for(user))
+        self.assertIn(code.lower(), user.profile.search_text)
+
+        user.username = 'meera'
+        user.save()
+        user.profile.reassign_code()
+        user.profile.refresh_from_db()
+        # Same suffix, new prefix
+        self.assertEqual(user.profile.profile_code, 'MEERA@' + code.split('@')[1])
+
+    def test_taken_code_is_retried(self):
+        user = User.objects.create_user('amit', 'amit@test.com', 'pass123')
+        other = User.objects.create_user('bela', 'bela@test.com', 'pass123')
+        other.profile.profile_code = user.profile.profile_code
+        user.profile.profile_code = 'AMIT@OLD1'
+        user.profile.save()
+        other.profile.save()
+
+        user.profile.reassign_code()
+        self.assertEqual(user.profile.profile_code, profile_codes.code_for(user, attempt=1))
+        self.assertNotEqual(user.profile.profile_code, other.profile.profile_code)
+
+    def test_backfill(self):
+        user = User.objects.create_user('chen', 'chen@test.com', 'pass123')
+        Profile.objects.filter(user=user).update(profile_code='', search_text='chen')
+        self.assertEqual(profile_codes.backfill(), 1)
+        profile = Profile.objects.get(user=user)
+        self.assertEqual(profile.profile_code, profile_codes.code_for(user))
+        self.assertEqual(profile.search_text, f'chen {profile.profile_code.lower()}')
@@ -1,5 +1,6 @@
 from django.urls import path
 from django.contrib.admin.views.autocomplete import AutocompleteJsonView
+from project.asyncapi import serve
 from . import views
 
 app_name = 'connections'
@@ -12,7 +13,8 @@ urlpatterns = [
     path('friend-request/send/', views.send_friend_request, name='send-friend-request'),
     path('friend-request/accept/', views.accept_friend_request, name='accept-friend-request'),
     path('friend-request/decline/', views.decline_friend_request, name='decline-friend-request'),
-    path('friends/list/', views.get_friends_list, name='friends-list'),
+    path('friends/list/', serve(views.get_friends_list, views.get_friends_list_async), name='friends-list'),
+    path('friends/suggestions/', views.get_friend_suggestions, name='friend-suggestions'),
     path('friends/remove/', views.remove_friend, name='remove-friend'),
     path('group/create/', views.create_group, name='create-group'),
     path('group/invite/', views.invite_to_group, name='invite-to-group'),
@@ -20,8 +22,8 @@ urlpatterns = [
     path('group/invitation/pending/', views.list_pending_group_invitations, name='list-pending-group-invitations'),
     path('group/invitation/accept/', views.accept_group_invitation, name='accept-group-invitation'),
     path('group/invitation/decline/', views.decline_group_invitation, name='decline-group-invitation'),
-    path('group/list/', views.list_user_groups, name='list-user-groups'),
+    path('group/list/', serve(views.list_user_groups, views.list_user_groups_async), name='list-user-groups'),
     path('group/batch-create/', views.batch_create_group, name='batch-create-group'),
     path('admin/user-lookup/', AutocompleteJsonView.as_view(), name='admin-user-lookup'),
-    path('group/details/<int:group_id>/', views.get_group_details, name='get-group-details'),
+    path('group/details/<int:group_id>/', serve(views.get_group_details, views.get_group_details_async), name='get-group-details'),
 ]
@@ -14,11 +14,42 @@ from .serializers import (
     PendingGroupInvitationSerializer, UserGroupListSerializer, RemoveFriendSerializer, RemoveGroupMemberSerializer,
     GroupDetailsSerializer
 )
-from django.db.models import Q
+from django.db.models import Count, Prefetch, Q
+from . import directory, friend_graph, search, suggestions
+from project.asyncapi import async_api_view, json_response
+from project.caching import async_cached_response, cached_response, conditional_response
 import logging
 
 logger = logging.getLogger(__name__)
 
+
+def groups_of(user):
+    """
+    The user's groups, newest first, with member counts. The count is
+    annotated before filtering on the user so it counts every member.
+    """
+    return Group.objects.annotate(
+        member_total=Count('members')
+    ).filter(members=user).select_related('created_by').order_by('-created_at')
+
+
+def groups_with_details():
+    """Groups with everything GroupDetailsSerializer reads already loaded"""
+    return Group.objects.select_related(
+        'created_by',
+        'created_by__profile'
+    ).prefetch_related(
+        'members',
+        'members__profile',
+        Prefetch(
+            'invitations',
+            queryset=GroupInvitation.objects.filter(status='pending').select_related(
+                'invited_user', 'invited_user__profile'
+            ),
+            to_attr='pending_invitations'
+        ),
+    )
+
 # Create your views here.
 
 @api_view(['GET'])
@@ -114,39 +145,41 @@ def list_users_with_profiles(request):
     Returns a paginated list of users with their usernames, profile codes, and friend request status.
     Supports:
     - Pagination (page, page_size)
-    - Search query (search)
+    - cursor: Opaque next_cursor from a previous response; switches to keyset
+      pagination, which costs the same on every page and skips the count
+      (pass it empty for the first page)
+    - Search query (search), ranked best match first (see connections/search.py)
     """
     # Get pagination parameters
     page = int(request.GET.get('page', 1))
     page_size = int(request.GET.get('page_size', 10))  # Smaller page size for testing
+    cursor = request.GET.get('cursor')
     search_query = request.GET.get('search', '').strip()
     
-    # Calculate offset
-    offset = (page - 1) * page_size
-    
     # Get IDs of current user's friends
-    friend_ids = set(friend.id for friend in Friendship.objects.friends_of(request.user))
+    friend_ids = set(friend_graph.friend_ids(request.user))
     friend_ids.add(request.user.id)  # Add current user's ID to exclusion set
     
-    # Base query for non-friend profiles
-    profiles = Profile.objects.select_related('user').exclude(
-        user_id__in=friend_ids
-    ).filter(
-        is_active=True  # Only show active profiles
+    # Base query for non-friend profiles, through the search index
+    profiles = search.search_profiles(
+        Profile.objects.select_related('user').exclude(user_id__in=friend_ids).filter(
+            is_active=True  # Only show active profiles
+        ),
+        search_query
     )
     
-    # Apply search if provided
-    if search_query:
-        profiles = profiles.filter(
-            Q(user__username__icontains=search_query) |
-            Q(profile_code__icontains=search_query)
-        )
-    
-    # Get total count for pagination
-    total_count = profiles.count()
-    
-    # Apply pagination
-    profiles = profiles[offset:offset + page_size]
+    if cursor is not None:
+        try:
+            profiles, next_cursor = search.paginate_by_cursor(profiles, cursor, page_size)
+        except search.InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        total_count = None
+    else:
+        # Get total count for pagination
+        total_count = profiles.count()
+        offset = (page - 1) * page_size
+        profiles = list(search.ranked(profiles)[offset:offset + page_size])
+        next_cursor = None
     
     # Get pending friend requests in a single query
     pending_requests = FriendRequest.objects.filter(
@@ -170,7 +203,15 @@ def list_users_with_profiles(request):
                 else 'none'
             )
         } for profile in profiles],
-        'pagination': {
+    }
+    if cursor is not None:
+        response_data['pagination'] = {
+            'page_size': page_size,
+            'has_next': next_cursor is not None,
+            'next_cursor': next_cursor,
+        }
+    else:
+        response_data['pagination'] = {
             'total_count': total_count,
             'page': page,
             'page_size': page_size,
@@ -178,12 +219,12 @@ def list_users_with_profiles(request):
             'has_next': (offset + page_size) < total_count,
             'has_previous': page > 1
         }
-    }
     
     return Response(response_data)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional_response(lambda request: [('friend-requests', request.user.id)])
 def list_pending_friend_requests(request):
     """
     List all pending friend requests for the current user (both sent and received).
@@ -216,6 +257,7 @@ def list_pending_friend_requests(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_response(lambda request: [('friends', request.user.id)])
 def get_friends_list(request):
     """
     Get a list of all friends for the authenticated user.
@@ -225,6 +267,60 @@ def get_friends_list(request):
     serializer = FriendListSerializer(friends, many=True)
     return Response(serializer.data)
 
+@async_api_view(['GET'])
+@async_cached_response(lambda request: [('friends', request.user.id)])
+async def get_friends_list_async(request):
+    """
+    get_friends_list for the ASGI server.
+    """
+    friends = await Friendship.objects.afriends_of(request.user)
+    return json_response(FriendListSerializer(friends, many=True).data)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_friend_suggestions(request):
+    """
+    People the current user may know, best match first: users who are not
+    their friends yet, scored by mutual friends plus shared groups
+    (see connections/suggestions.py).
+    Query Parameters: limit (default 20, max 100), cursor (next page)
+    """
+    try:
+        limit = int(request.GET.get('limit', suggestions.DEFAULT_LIMIT))
+    except ValueError:
+        return Response({'error': 'limit must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        page, next_cursor = suggestions.suggestions_page(request.user, request.GET.get('cursor'), limit)
+    except suggestions.InvalidCursor as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Pending requests between the user and this page only
+    pending_requests = FriendRequest.objects.filter(
+        Q(from_user=request.user, to_user_id__in=[row.suggested_user_id for row in page]) |
+        Q(to_user=request.user, from_user_id__in=[row.suggested_user_id for row in page]),
+        status='pending'
+    ).values_list('from_user_id', 'to_user_id')
+    sent_requests = {to_id for from_id, to_id in pending_requests if from_id == request.user.id}
+    received_requests = {from_id for from_id, to_id in pending_requests if to_id == request.user.id}
+
+    return Response({
+        'suggestions': [{
+            'user_id': row.suggested_user_id,
+            'username': row.suggested_user.username,
+            'profile_code': row.suggested_user.profile.profile_code,
+            'profile_picture_url': row.suggested_user.profile.profile_picture_url,
+            'mutual_friends': row.mutual_friends,
+            'shared_groups': row.shared_groups,
+            'friend_request_status': (
+                'sent' if row.suggested_user_id in sent_requests
+                else 'received' if row.suggested_user_id in received_requests
+                else 'none'
+            ),
+        } for row in page],
+        'has_more': next_cursor is not None,
+        'next_cursor': next_cursor,
+    })
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def remove_friend(request):
@@ -363,6 +459,7 @@ def decline_group_invitation(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional_response(lambda request: [('group-invitations', request.user.id)])
 def list_pending_group_invitations(request):
     """
     List all pending group invitations for the current user (both sent and received).
@@ -391,6 +488,7 @@ def list_pending_group_invitations(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_response(lambda request: [('groups', request.user.id)])
 def list_user_groups(request):
     """
     List all groups that the authenticated user is a member of.
@@ -404,13 +502,23 @@ def list_user_groups(request):
     - Trip details (if it's a trip group)
     """
     # Get all groups where the user is a member
-    user_groups = Group.objects.filter(members=request.user).select_related('created_by').order_by('-created_at')
+    user_groups = groups_of(request.user)
     
     # Serialize the groups
     serializer = UserGroupListSerializer(user_groups, many=True, context={'request': request})
     
     return Response(serializer.data)
 
+@async_api_view(['GET'])
+@async_cached_response(lambda request: [('groups', request.user.id)])
+async def list_user_groups_async(request):
+    """
+    list_user_groups for the ASGI server.
+    """
+    user_groups = [group async for group in groups_of(request.user)]
+    serializer = UserGroupListSerializer(user_groups, many=True, context={'request': request})
+    return json_response(serializer.data)
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def remove_group_member(request):
@@ -439,136 +547,61 @@ def remove_group_member(request):
 @permission_classes([IsAuthenticated])
 def list_all_users(request):
     """
-    List all users except the current user, with pagination and search support.
-    Returns all friends first, then paginates remaining users.
+    List all users except the current user as one ranked stream: friends
+    first, then users with a pending friend request, then everyone else
+    (see connections/directory.py). Every page is bounded by page_size.
+    Supports:
+    - Pagination (page, page_size)
+    - cursor: Opaque next_cursor from a previous response; switches to keyset
+      pagination, which costs the same on every page and skips the count
+      (pass it empty for the first page)
+    - Search query (search), ranked best match first within each part
     """
     try:
-        # Get pagination parameters
         page = int(request.GET.get('page', 1))
         page_size = int(request.GET.get('page_size', 10))
-        search_query = request.GET.get('search', '').strip()
-        
-        # Get current user's profile with error handling
-        try:
-            current_profile = request.user.profile
-        except Profile.DoesNotExist:
-            return Response(
-                {'error': 'Profile not found for current user'},
-                status=status.HTTP_404_NOT_FOUND
-            )
-        
-        # Get friend IDs for current user
-        try:
-            friend_pairs = Friendship.objects.filter(
-                Q(user1=request.user) | Q(user2=request.user)
-            ).values_list('user1_id', 'user2_id')
-            
-            # Extract friend IDs from pairs
-            friend_ids = set()
-            for user1_id, user2_id in friend_pairs:
-                friend_ids.add(user1_id if user1_id != request.user.id else user2_id)
-        except Exception as e:
-            print(f"Error getting friend IDs: {str(e)}")
-            friend_ids = set()
-
-        # Get pending friend request IDs
-        try:
-            pending_sent = set(FriendRequest.objects.filter(
-                from_user=request.user,
-                status='pending'
-            ).values_list('to_user_id', flat=True))
-            
-            pending_received = set(FriendRequest.objects.filter(
-                to_user=request.user,
-                status='pending'
-            ).values_list('from_user_id', flat=True))
-        except Exception as e:
-            print(f"Error getting pending friend requests: {str(e)}")
-            pending_sent = set()
-            pending_received = set()
+    except ValueError:
+        return Response({'error': 'page and page_size must be integers.'}, status=status.HTTP_400_BAD_REQUEST)
+    page = max(page, 1)
+    page_size = max(1, min(page_size, search.MAX_LIMIT))
+    cursor = request.GET.get('cursor')
+    search_query = request.GET.get('search', '').strip()
 
-        # Base queryset - all profiles except current user
-        profiles = Profile.objects.exclude(id=current_profile.id)
-        
-        # Apply search if provided
-        if search_query:
-            profiles = profiles.filter(
-                Q(user__username__icontains=search_query) |
-                Q(profile_code__icontains=search_query)
-            )
+    profiles = directory.people(request.user, search_query)
 
-        # Get all friends first
-        friend_profiles = profiles.filter(user_id__in=friend_ids).select_related('user')
-        friend_data = []
-        for profile in friend_profiles:
-            try:
-                user = profile.user
-                friend_data.append({
-                    'id': user.id,
-                    'username': user.username,
-                    'profile_code': profile.profile_code,
-                    'profile_picture_url': profile.profile_picture_url,
-                    'is_friend': True,
-                    'friend_request_status': 'none',
-                })
-            except Exception as e:
-                print(f"Error processing friend profile {profile.id}: {str(e)}")
-                continue
-
-        # Get non-friend profiles for pagination
-        non_friend_profiles = profiles.exclude(user_id__in=friend_ids)
-        total_non_friends = non_friend_profiles.count()
-        
-        # Calculate offset for non-friends
+    if cursor is not None:
+        try:
+            profiles, next_cursor = directory.paginate_by_cursor(profiles, cursor, page_size)
+        except search.InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        pagination = {
+            'page_size': page_size,
+            'has_next': next_cursor is not None,
+            'next_cursor': next_cursor,
+        }
+    else:
+        total_count = profiles.count()
         offset = (page - 1) * page_size
-        
-        # Get paginated non-friend profiles
-        non_friend_profiles = non_friend_profiles.select_related('user')[offset:offset + page_size]
-        
-        # Prepare non-friend data
-        non_friend_data = []
-        for profile in non_friend_profiles:
-            try:
-                user = profile.user
-                friend_request_status = 'sent' if user.id in pending_sent else 'received' if user.id in pending_received else 'none'
-                
-                non_friend_data.append({
-                    'id': user.id,
-                    'username': user.username,
-                    'profile_code': profile.profile_code,
-                    'profile_picture_url': profile.profile_picture_url,
-                    'is_friend': False,
-                    'friend_request_status': friend_request_status,
-                })
-            except Exception as e:
-                print(f"Error processing non-friend profile {profile.id}: {str(e)}")
-                continue
-
-        # Combine friends and paginated non-friends
-        users_data = friend_data + non_friend_data
-        
-        # Calculate pagination info for non-friends
-        total_pages = (total_non_friends + page_size - 1) // page_size
-        has_next = page < total_pages
-        
-        return Response({
-            'users': users_data,
-            'pagination': {
-                'page': page,
-                'page_size': page_size,
-                'total_count': total_non_friends,  # Only count non-friends for pagination
-                'total_pages': total_pages,
-                'has_next': has_next,
-                'friend_count': len(friend_data),  # Add friend count for frontend reference
-            }
-        })
-        
-    except Exception as e:
-        print(f"Error in list_all_users: {str(e)}")
-        return Response(
-            {'error': str(e)},
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        profiles = list(directory.ranked(profiles)[offset:offset + page_size])
+        pagination = {
+            'page': page,
+            'page_size': page_size,
+            'total_count': total_count,
+            'total_pages': (total_count + page_size - 1) // page_size,
+            'has_next': (offset + page_size) < total_count,
+        }
+
+    return Response({
+        'users': [{
+            'id': profile.user.id,
+            'username': profile.user.username,
+            'profile_code': profile.profile_code,
+            'profile_picture_url': profile.profile_picture_url,
+            'is_friend': profile.is_friend,
+            'friend_request_status': directory.friend_request_status(profile),
+        } for profile in profiles],
+        'pagination': pagination,
+    })
 
 
 # backend/connections/views.py
@@ -642,6 +675,7 @@ def batch_create_group(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_response(lambda request, group_id: [('group', group_id)])
 def get_group_details(request, group_id):
     """
     Get comprehensive details of a specific group including:
@@ -654,13 +688,7 @@ def get_group_details(request, group_id):
         logger.info(f'Fetching group details for group ID: {group_id}')
         
         # Get the group and prefetch related data
-        group = Group.objects.select_related(
-            'created_by',
-            'created_by__profile'
-        ).prefetch_related(
-            'members',
-            'members__profile'
-        ).get(id=group_id)
+        group = groups_with_details().get(id=group_id)
 
         logger.info(f'Found group: {group.name}')
 
@@ -690,4 +718,24 @@ def get_group_details(request, group_id):
         return Response(
             {'error': str(e)},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
\ No newline at end of file
+        )
+
+@async_api_view(['GET'])
+@async_cached_response(lambda request, group_id: [('group', group_id)])
+async def get_group_details_async(request, group_id):
+    """
+    get_group_details for the ASGI server.
+    """
+    try:
+        group = await groups_with_details().aget(id=group_id)
+    except Group.DoesNotExist:
+        return json_response({'error': 'Group not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    if request.user not in group.members.all():
+        logger.warning(f'User {request.user.username} is not a member of group {group.id}')
+        return json_response(
+            {'error': 'You are not a member of this group'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+    serializer = GroupDetailsSerializer(group, context={'request': request})
+    return json_response(serializer.data)
@@ -0,0 +1,373 @@
+"""
+Incremental balance ledger.
+
+Every expense contributes a fixed set of pairwise debts: each share holder owes
+each payer ``amount_owed * amount_paid / total_amount``. Instead of replaying a
+user's whole history after every write, expense create/edit/delete compute that
+contribution for the one expense and apply the difference to Balance and
+UserTotalBalance in a single batched write.
+
+Deltas are plain dicts keyed by ``(user1_id, user2_id, group_id)`` with
+``user1_id < user2_id``, holding the change in ``Balance.balance_amount``
+(positive = user1 owes user2 more).
+"""
+
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from project import caching
+from .models import Balance, UserTotalBalance, ExpenseShare, Settlement
+from . import settle_plan, summaries
+
+CENT = Decimal('0.01')
+BULK_BATCH_SIZE = 1000
+# Keys per pair filter; SQLite rejects an OR chain much over a thousand terms
+PAIR_FILTER_BATCH_SIZE = 300
+
+_state = threading.local()
+
+
+# ============================================================================
+# SIGNAL SUSPENSION
+# ============================================================================
+
+@contextmanager
+def suspended():
+    """Mute the per-share balance signals while a code path applies its own deltas"""
+    _state.depth = getattr(_state, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _state.depth -= 1
+
+
+def is_suspended():
+    return getattr(_state, 'depth', 0) > 0
+
+
+# ============================================================================
+# DELTA COMPUTATION
+# ============================================================================
+
+def add_debt(deltas, debtor_id, creditor_id, amount, group_id=None):
+    """Record that ``debtor_id`` owes ``creditor_id`` ``amount`` more"""
+    if debtor_id == creditor_id or not amount:
+        return deltas
+    if debtor_id < creditor_id:
+        key = (debtor_id, creditor_id, group_id)
+    else:
+        key = (creditor_id, debtor_id, group_id)
+        amount = -amount
+    deltas[key] = deltas.get(key, Decimal('0')) + amount
+    return deltas
+
+
+def share_debt(amount_owed, amount_paid, total_amount):
+    """What a share of ``amount_owed`` owes a payment of ``amount_paid``"""
+    if not total_amount:
+        return Decimal('0')
+    return (amount_owed * amount_paid / total_amount).quantize(CENT)
+
+
+def share_deltas(expense, share, payments, deltas=None):
+    """Debts created by a single share against every payer of the expense"""
+    deltas = {} if deltas is None else deltas
+    total_amount = expense.total_amount
+    if not total_amount:
+        return deltas
+    for payment in payments:
+        amount = share_debt(share.amount_owed, payment.amount_paid, total_amount)
+        add_debt(deltas, share.user_id, payment.payer_id, amount, expense.group_id)
+    return deltas
+
+
+def expense_deltas(expense, payments=None, shares=None, deltas=None):
+    """
+    Pairwise debts contributed by one expense.
+    Payments and shares are loaded from the database unless passed in.
+    """
+    deltas = {} if deltas is None else deltas
+    if payments is None:
+        payments = list(expense.payments.all())
+    if shares is None:
+        shares = list(expense.shares.all())
+    for share in shares:
+        share_deltas(expense, share, payments, deltas)
+    return deltas
+
+
+def settlement_deltas(settlement, deltas=None):
+    """A settlement reduces what the payer owes the payee"""
+    deltas = {} if deltas is None else deltas
+    return add_debt(deltas, settlement.payer_id, settlement.payee_id, -settlement.amount, settlement.group_id)
+
+
+def merge(deltas, other, sign=1):
+    """Add ``other`` (scaled by ``sign``) into ``deltas``"""
+    for key, amount in other.items():
+        deltas[key] = deltas.get(key, Decimal('0')) + sign * amount
+    return deltas
+
+
+def diff(after, before):
+    """Deltas that turn the ``before`` contribution into ``after``"""
+    return merge(dict(after), before, sign=-1)
+
+
+# ============================================================================
+# APPLYING DELTAS
+# ============================================================================
+
+def _pair_filter(keys, with_group=True):
+    query = Q()
+    for key in keys:
+        if with_group:
+            query |= Q(user1_id=key[0], user2_id=key[1], group_id=key[2])
+        else:
+            query |= Q(user1_id=key[0], user2_id=key[1])
+    return query
+
+
+def _pair_filters(keys, with_group=True):
+    """``_pair_filter`` over ``keys`` in batches of PAIR_FILTER_BATCH_SIZE"""
+    keys = list(keys)
+    for start in range(0, len(keys), PAIR_FILTER_BATCH_SIZE):
+        yield _pair_filter(keys[start:start + PAIR_FILTER_BATCH_SIZE], with_group)
+
+
+def apply_deltas(deltas):
+    """
+    Apply balance deltas to Balance and UserTotalBalance.
+    Existing rows are locked and updated with one bulk_update per table,
+    missing rows are inserted with one bulk_create per table.
+    """
+    deltas = {key: amount for key, amount in deltas.items() if amount}
+    if not deltas:
+        return
+
+    # UserTotalBalance keeps the total from user1's perspective
+    # (positive = user2 owes user1), the opposite sign of Balance.
+    totals = {}
+    for (user1_id, user2_id, group_id), amount in deltas.items():
+        totals[(user1_id, user2_id)] = totals.get((user1_id, user2_id), Decimal('0')) - amount
+    totals = {key: amount for key, amount in totals.items() if amount}
+
+    now = timezone.now()
+    with transaction.atomic():
+        existing = {
+            (b.user1_id, b.user2_id, b.group_id): b
+            for scope in _pair_filters(deltas)
+            for b in Balance.objects.select_for_update().filter(scope)
+        }
+        to_update, to_create = [], []
+        for key, amount in deltas.items():
+            balance = existing.get(key)
+            if balance is None:
+                to_create.append(Balance(
+                    user1_id=key[0], user2_id=key[1], group_id=key[2], balance_amount=amount
+                ))
+            else:
+                balance.balance_amount += amount
+                balance.updated_at = now
+                to_update.append(balance)
+        if to_update:
+            Balance.objects.bulk_update(to_update, ['balance_amount', 'updated_at'])
+        if to_create:
+            Balance.objects.bulk_create(to_create)
+
+        if totals:
+            existing = {
+                (t.user1_id, t.user2_id): t
+                for scope in _pair_filters(totals, with_group=False)
+                for t in UserTotalBalance.objects.select_for_update().filter(scope)
+            }
+            to_update, to_create = [], []
+            for key, amount in totals.items():
+                total = existing.get(key)
+                if total is None:
+                    to_create.append(UserTotalBalance(user1_id=key[0], user2_id=key[1], total_balance=amount))
+                else:
+                    total.total_balance += amount
+                    total.last_updated = now
+                    to_update.append(total)
+            if to_update:
+                UserTotalBalance.objects.bulk_update(to_update, ['total_balance', 'last_updated'])
+            if to_create:
+                UserTotalBalance.objects.bulk_create(to_create)
+
+        # Queued inside the block so summaries, cached plans and response
+        # versions move after these writes commit, even in autocommit
+        user_ids = {user_id for key in deltas for user_id in key[:2]}
+        summaries.mark_users_dirty(user_ids)
+        settle_plan.invalidate(key[2] for key in deltas)
+        caching.bump('balances', user_ids)
+        caching.bump('group-balances', {key[2] for key in deltas})
+
+
+def record_expense(expense, payments=None, shares=None):
+    """Add a newly created expense to the balances"""
+    apply_deltas(expense_deltas(expense, payments, shares))
+
+
+def reverse_expense(expense, payments=None, shares=None):
+    """Remove a deleted expense from the balances"""
+    apply_deltas(merge({}, expense_deltas(expense, payments, shares), sign=-1))
+
+
+# ============================================================================
+# USER TOTAL BALANCE SYNC
+# ============================================================================
+
+def sync_totals(scope):
+    """
+    Recompute UserTotalBalance for the pairs matched by ``scope`` (a Q on
+    user1/user2) with one grouped query over Balance and bulk writes.
+    Returns ``(updated, created)`` row counts.
+    """
+    totals = {
+        (row['user1_id'], row['user2_id']): -row['amount']
+        for row in Balance.objects.filter(scope).values('user1_id', 'user2_id')
+        .annotate(amount=Sum('balance_amount')).order_by()
+    }
+    now = timezone.now()
+    with transaction.atomic():
+        to_update = []
+        for total in UserTotalBalance.objects.select_for_update().filter(scope):
+            amount = totals.pop((total.user1_id, total.user2_id), Decimal('0'))
+            if total.total_balance != amount:
+                total.total_balance = amount
+                total.last_updated = now
+                to_update.append(total)
+        to_create = [
+            UserTotalBalance(user1_id=key[0], user2_id=key[1], total_balance=amount)
+            for key, amount in totals.items() if amount
+        ]
+        UserTotalBalance.objects.bulk_update(to_update, ['total_balance', 'last_updated'], batch_size=BULK_BATCH_SIZE)
+        UserTotalBalance.objects.bulk_create(to_create, batch_size=BULK_BATCH_SIZE)
+    changed = to_update + to_create
+    if changed:
+        summaries.mark_users_dirty({user_id for t in changed for user_id in (t.user1_id, t.user2_id)})
+        caching.bump('balances', {user_id for t in changed for user_id in (t.user1_id, t.user2_id)})
+    return len(to_update), len(to_create)
+
+
+def mark_pair_dirty(user1_id, user2_id):
+    """
+    Queue a pair whose Balance rows changed through a regular save().
+    All pairs queued during a transaction are synced once, on commit.
+    """
+    pending = getattr(_state, 'dirty_pairs', None)
+    if pending is None:
+        pending = _state.dirty_pairs = set()
+    pending.add((min(user1_id, user2_id), max(user1_id, user2_id)))
+    transaction.on_commit(flush_dirty_pairs)
+
+
+def flush_dirty_pairs():
+    """Sync UserTotalBalance for every queued pair"""
+    pending = getattr(_state, 'dirty_pairs', None)
+    if not pending:
+        return
+    _state.dirty_pairs = set()
+    for scope in _pair_filters(pending, with_group=False):
+        sync_totals(scope)
+
+
+# ============================================================================
+# FULL REBUILD
+# ============================================================================
+
+def _aggregated_debts(user=None, group=None):
+    """
+    Net pairwise debts: one query streaming every ExpenseShare x ExpensePayment
+    pair, plus one grouped query over Settlement. Each pair is rounded with
+    share_debt before summing, exactly as the incremental ledger does, so a
+    rebuild writes the same balances the ledger keeps.
+    """
+    shares = ExpenseShare.objects.filter(expense__is_deleted=False)
+    settlements = Settlement.objects.all()
+    if user is not None:
+        shares = shares.filter(Q(user=user) | Q(expense__payments__payer=user))
+        settlements = settlements.filter(Q(payer=user) | Q(payee=user))
+    if group is not None:
+        shares = shares.filter(expense__group=group)
+        settlements = settlements.filter(group=group)
+
+    rows = shares.values_list(
+        'user_id', 'expense__payments__payer_id', 'expense__group_id',
+        'amount_owed', 'expense__payments__amount_paid', 'expense__total_amount',
+    ).order_by()
+
+    deltas = {}
+    for debtor_id, creditor_id, group_id, amount_owed, amount_paid, total_amount in rows.iterator(chunk_size=BULK_BATCH_SIZE):
+        if creditor_id is None:
+            continue
+        add_debt(deltas, debtor_id, creditor_id, share_debt(amount_owed, amount_paid, total_amount), group_id)
+    for row in settlements.values('payer_id', 'payee_id', 'group_id').annotate(amount=Sum('amount')).order_by():
+        add_debt(deltas, row['payer_id'], row['payee_id'], -row['amount'], row['group_id'])
+    return deltas
+
+
+def rebuild_balances(user=None, group=None):
+    """
+    Recompute Balance and UserTotalBalance from scratch for one user, one group
+    or (with no arguments) the whole database, using set-based aggregation.
+    Returns counts of the rows written.
+    """
+    if user is not None:
+        balance_scope = Q(user1=user) | Q(user2=user)
+    elif group is not None:
+        balance_scope = Q(group=group)
+    else:
+        balance_scope = Q()
+
+    targets = _aggregated_debts(user=user, group=group)
+    stats = {'pairs': len(targets), 'balances_updated': 0, 'balances_created': 0,
+             'totals_updated': 0, 'totals_created': 0}
+    now = timezone.now()
+
+    with transaction.atomic():
+        to_update = []
+        touched_pairs = set()
+        for balance in Balance.objects.select_for_update().filter(balance_scope):
+            key = (balance.user1_id, balance.user2_id, balance.group_id)
+            amount = targets.pop(key, Decimal('0'))
+            touched_pairs.add(key[:2])
+            if balance.balance_amount != amount:
+                balance.balance_amount = amount
+                balance.updated_at = now
+                to_update.append(balance)
+        to_create = [
+            Balance(user1_id=key[0], user2_id=key[1], group_id=key[2], balance_amount=amount)
+            for key, amount in targets.items() if amount
+        ]
+        touched_pairs.update(key[:2] for key in targets)
+        Balance.objects.bulk_update(to_update, ['balance_amount', 'updated_at'], batch_size=BULK_BATCH_SIZE)
+        Balance.objects.bulk_create(to_create, batch_size=BULK_BATCH_SIZE)
+        stats['balances_updated'] = len(to_update)
+        stats['balances_created'] = len(to_create)
+        if to_update or to_create:
+            summaries.mark_users_dirty({user_id for pair in touched_pairs for user_id in pair})
+            settle_plan.invalidate(balance.group_id for balance in to_update + to_create)
+            caching.bump('balances', {user_id for pair in touched_pairs for user_id in pair})
+            caching.bump('group-balances', {balance.group_id for balance in to_update + to_create})
+
+        # Totals are summed over every group, so re-aggregate the touched pairs
+        # (or every pair on a full rebuild) from the freshly written Balance rows.
+        if user is not None:
+            total_scopes = [Q(user1=user) | Q(user2=user)]
+        elif group is not None:
+            total_scopes = _pair_filters(touched_pairs, with_group=False)
+        else:
+            total_scopes = [Q()]
+        for total_scope in total_scopes:
+            updated, created = sync_totals(total_scope)
+            stats['totals_updated'] += updated
+            stats['totals_created'] += created
+
+    return stats
@@ -0,0 +1,362 @@
+import json
+import random
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from connections.models import Friendship, Group, Profile
+from connections.profile_codes import code_for
+from connections.search import build_search_text
+from expense import ledger, search
+from expense.models import Expense, ExpenseCategory, ExpensePayment, ExpenseShare, EXPENSE_CATEGORIES
+from expense.signals import recalculate_user_balances
+from project.profiling import QueryRecorder
+
+DESCRIPTIONS = [
+    'Dinner', 'Groceries', 'Taxi', 'Movie tickets', 'Hotel', 'Fuel', 'Coffee',
+    'Electricity bill', 'Internet', 'Lunch', 'Train tickets', 'Snacks', 'Rent',
+]
+
+SCENARIOS = [
+    'add_expense', 'group_expenses', 'expenses_and_balance_with_friend',
+    'list_user_total_balances', 'recalculate_user_balances', 'friends_list',
+    'profile_list_all', 'profile_list_others',
+]
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a synthetic dataset and benchmark the expense, balance and friend '
+        'hot paths through the Django test client. Prints a JSON report.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Users to create (default: 200)')
+        parser.add_argument('--friends-per-user', type=int, default=10, help='Average friends per user (default: 10)')
+        parser.add_argument('--groups', type=int, default=20, help='Groups to create (default: 20)')
+        parser.add_argument('--group-size', type=int, default=8, help='Average members per group (default: 8)')
+        parser.add_argument('--expenses', type=int, default=2000, help='Expenses to create (default: 2000)')
+        parser.add_argument('--iterations', type=int, default=20, help='Timed runs per scenario (default: 20)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+        parser.add_argument(
+            '--only',
+            help=f'Comma separated scenarios to run (default: all of {", ".join(SCENARIOS)})'
+        )
+        parser.add_argument('--output', help='Also write the JSON report to this file')
+        parser.add_argument(
+            '--use-current-db',
+            action='store_true',
+            help='Write the dataset into the configured database instead of a throwaway test database'
+        )
+
+    def handle(self, *args, **options):
+        scenarios = SCENARIOS
+        if options['only']:
+            scenarios = [name.strip() for name in options['only'].split(',')]
+            unknown = set(scenarios) - set(SCENARIOS)
+            if unknown:
+                raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+        if options['users'] < 4:
+            raise CommandError('--users must be at least 4')
+
+        # Signals and views print progress; keep stdout for the JSON report
+        with redirect_stdout(sys.stderr):
+            if options['use_current_db']:
+                report = self.run(options, scenarios)
+            else:
+                # Same isolation as the test runner: a fresh database, migrated, then dropped
+                setup_test_environment()
+                old_config = setup_databases(verbosity=0, interactive=False)
+                try:
+                    report = self.run(options, scenarios)
+                finally:
+                    teardown_databases(old_config, verbosity=0)
+                    teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+
+    def run(self, options, scenarios):
+        self.rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        dataset = self.generate(options)
+        dataset['generation_seconds'] = round(time.perf_counter() - started, 2)
+        self.stderr.write(f'Generated dataset in {dataset["generation_seconds"]}s')
+
+        results = {}
+        for name in scenarios:
+            self.stderr.write(f'Benchmarking {name}...')
+            results[name] = self.benchmark(getattr(self, f'scenario_{name}'), options['iterations'])
+        return {
+            'database': connection.vendor,
+            'debug': settings.DEBUG,
+            'created_at': timezone.now().isoformat(),
+            'dataset': dataset,
+            'results': results,
+        }
+
+    # ========================================================================
+    # DATASET
+    # ========================================================================
+
+    def generate(self, options):
+        rng = self.rng
+        prefix = f'bench{int(time.time())}'
+
+        users = User.objects.bulk_create([
+            User(username=f'{prefix}_{i}', first_name=f'Bench{i}', last_name='User', password='!')
+            for i in range(options['users'])
+        ])
+        codes = [code_for(user) for user in users]
+        Profile.objects.bulk_create([
+            Profile(user=user, profile_code=code, search_text=build_search_text(user, code))
+            for user, code in zip(users, codes)
+        ])
+
+        # Friend graph: each user befriends a few random others
+        pairs = set()
+        for user in users:
+            for other in rng.sample(users, min(options['friends_per_user'] // 2 + 1, len(users) - 1)):
+                if other.id != user.id:
+                    pairs.add((min(user.id, other.id), max(user.id, other.id)))
+        Friendship.objects.bulk_create([Friendship(user1_id=a, user2_id=b) for a, b in pairs])
+        friends = {}
+        for a, b in pairs:
+            friends.setdefault(a, []).append(b)
+            friends.setdefault(b, []).append(a)
+
+        groups = Group.objects.bulk_create([
+            Group(name=f'Bench group {i}', created_by=rng.choice(users)) for i in range(options['groups'])
+        ])
+        Membership = Group.members.through
+        group_members = {}
+        memberships = []
+        for group in groups:
+            size = max(2, min(len(users), int(rng.gauss(options['group_size'], options['group_size'] / 3))))
+            members = {group.created_by_id} | {user.id for user in rng.sample(users, size - 1)}
+            group_members[group.id] = sorted(members)
+            memberships.extend(Membership(group_id=group.id, user_id=user_id) for user_id in members)
+        Membership.objects.bulk_create(memberships)
+
+        if not ExpenseCategory.objects.exists():
+            ExpenseCategory.objects.bulk_create([
+                ExpenseCategory(name=name, icon=icon, color=color) for name, icon, color in EXPENSE_CATEGORIES
+            ])
+        category_ids = list(ExpenseCategory.objects.values_list('id', flat=True))
+
+        # Expenses: 70% in groups, the rest between friends
+        now = timezone.now()
+        friend_pairs = sorted(pairs)
+        specs = []
+        for _ in range(options['expenses']):
+            if rng.random() < 0.7 or not friend_pairs:
+                group = rng.choice(groups)
+                members = group_members[group.id]
+                participants = rng.sample(members, rng.randint(2, len(members)))
+                group_id = group.id
+            else:
+                participants = list(rng.choice(friend_pairs))
+                group_id = None
+            specs.append((group_id, participants))
+
+        expenses = Expense.objects.bulk_create([
+            Expense(
+                description=rng.choice(DESCRIPTIONS),
+                total_amount=Decimal(rng.randint(100, 500000)) / 100,
+                date=now - timedelta(minutes=rng.randint(0, 525600)),
+                category_id=rng.choice(category_ids),
+                group_id=group_id,
+                split_type=rng.choice(['equal', 'percentage']),
+                created_by_id=participants[0],
+            )
+            for group_id, participants in specs
+        ], batch_size=1000)
+
+        payments, shares = [], []
+        for expense, (group_id, participants) in zip(expenses, specs):
+            payers = rng.sample(participants, rng.randint(1, min(3, len(participants))))
+            for payer_id, amount in zip(payers, self.split(expense.total_amount, len(payers))):
+                payments.append(ExpensePayment(expense=expense, payer_id=payer_id, amount_paid=amount))
+            if expense.split_type == 'equal':
+                amounts = self.split(expense.total_amount, len(participants))
+                percentages = [None] * len(participants)
+            else:
+                percentages = self.split(Decimal('100'), len(participants), weighted=True)
+                amounts = [(expense.total_amount * p / 100).quantize(Decimal('0.01')) for p in percentages]
+            for user_id, amount, percentage in zip(participants, amounts, percentages):
+                shares.append(ExpenseShare(
+                    expense=expense, user_id=user_id, amount_owed=amount, percentage=percentage
+                ))
+        ExpensePayment.objects.bulk_create(payments, batch_size=1000)
+        ExpenseShare.objects.bulk_create(shares, batch_size=1000)
+
+        ledger.rebuild_balances()
+        search.rebuild_index()
+
+        self.users = users
+        self.groups = groups
+        self.group_members = group_members
+        self.friends = friends
+        self.tokens = {}
+        return {
+            'users': len(users),
+            'friendships': len(pairs),
+            'groups': len(groups),
+            'memberships': len(memberships),
+            'expenses': len(expenses),
+            'payments': len(payments),
+            'shares': len(shares),
+        }
+
+    def split(self, total, parts, weighted=False):
+        """Split ``total`` into ``parts`` amounts with two decimals that add up exactly"""
+        weights = [self.rng.randint(1, 10) if weighted else 1 for _ in range(parts)]
+        amounts = [(total * w / sum(weights)).quantize(Decimal('0.01')) for w in weights]
+        amounts[-1] += total - sum(amounts)
+        return amounts
+
+    # ========================================================================
+    # MEASUREMENT
+    # ========================================================================
+
+    def client_for(self, user):
+        if user.id not in self.tokens:
+            self.tokens[user.id] = str(AccessToken.for_user(user))
+        return Client(HTTP_AUTHORIZATION=f'Bearer {self.tokens[user.id]}')
+
+    def benchmark(self, scenario, iterations):
+        """
+        Time ``iterations`` runs, counting queries, then repeat one run under
+        tracemalloc for allocations (kept separate so tracing doesn't skew timings).
+        """
+        scenario()  # warm up
+        timings, query_counts = [], []
+        for _ in range(iterations):
+            call = scenario(prepare_only=True)
+            stats = {'queries': 0, 'db_time': 0.0}
+            with connection.execute_wrapper(QueryRecorder(stats)):
+                started = time.perf_counter()
+                call()
+                timings.append((time.perf_counter() - started) * 1000)
+            query_counts.append(stats['queries'])
+
+        call = scenario(prepare_only=True)
+        tracemalloc.start()
+        call()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return {
+            'iterations': iterations,
+            'p50_ms': round(percentile(timings, 0.50), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            'mean_ms': round(sum(timings) / len(timings), 2),
+            'queries_p50': percentile(query_counts, 0.50),
+            'queries_max': max(query_counts),
+            'alloc_peak_kb': round(peak / 1024, 1),
+            'alloc_retained_kb': round(current / 1024, 1),
+        }
+
+    def request(self, user, method, path, data=None):
+        """A callable performing one request; raises if it doesn't succeed"""
+        client = self.client_for(user)
+
+        def call():
+            if method == 'POST':
+                response = client.post(path, data=json.dumps(data), content_type='application/json')
+            else:
+                response = client.get(path, data)
+            if response.status_code >= 400:
+                raise CommandError(f'{method} {path} returned {response.status_code}: {response.content[:300]}')
+            return response
+        return call
+
+    def run_or_prepare(self, call, prepare_only):
+        if prepare_only:
+            return call
+        return call()
+
+    # ========================================================================
+    # SCENARIOS
+    # ========================================================================
+
+    def scenario_add_expense(self, prepare_only=False):
+        rng = self.rng
+        group = rng.choice(self.groups)
+        members = self.group_members[group.id]
+        participants = rng.sample(members, rng.randint(2, len(members)))
+        total = Decimal(rng.randint(100, 100000)) / 100
+        payers = rng.sample(participants, rng.randint(1, min(3, len(participants))))
+        data = {
+            'description': rng.choice(DESCRIPTIONS),
+            'total_amount': str(total),
+            'group_id': group.id,
+            'user_ids': participants,
+            'payments': [
+                {'payer_id': payer_id, 'amount_paid': str(amount)}
+                for payer_id, amount in zip(payers, self.split(total, len(payers)))
+            ],
+        }
+        if rng.random() < 0.5:
+            data['split_type'] = 'percentage'
+            data['splits'] = [
+                {'user_id': user_id, 'percentage': str(percentage)}
+                for user_id, percentage in zip(participants, self.split(Decimal('100'), len(participants), weighted=True))
+            ]
+        user = User(id=participants[0])
+        return self.run_or_prepare(self.request(user, 'POST', '/api/expenses/add/', data), prepare_only)
+
+    def scenario_group_expenses(self, prepare_only=False):
+        group = max(self.groups, key=lambda g: len(self.group_members[g.id]))
+        user = User(id=self.group_members[group.id][0])
+        call = self.request(user, 'GET', '/api/expenses/group-expenses/', {'group_id': group.id, 'page_size': 20})
+        return self.run_or_prepare(call, prepare_only)
+
+    def scenario_expenses_and_balance_with_friend(self, prepare_only=False):
+        user_id = max(self.friends, key=lambda uid: len(self.friends[uid]))
+        friend_id = self.rng.choice(self.friends[user_id])
+        call = self.request(User(id=user_id), 'GET', '/api/expenses/expenses-with-friend/', {'user_id': friend_id})
+        return self.run_or_prepare(call, prepare_only)
+
+    def scenario_list_user_total_balances(self, prepare_only=False):
+        call = self.request(self.rng.choice(self.users), 'GET', '/api/expenses/user-total-balances/')
+        return self.run_or_prepare(call, prepare_only)
+
+    def scenario_recalculate_user_balances(self, prepare_only=False):
+        user = self.rng.choice(self.users)
+        return self.run_or_prepare(lambda: recalculate_user_balances(user), prepare_only)
+
+    def scenario_friends_list(self, prepare_only=False):
+        user_id = max(self.friends, key=lambda uid: len(self.friends[uid]))
+        call = self.request(User(id=user_id), 'GET', '/api/friends/list/')
+        return self.run_or_prepare(call, prepare_only)
+
+    def scenario_profile_list_all(self, prepare_only=False):
+        call = self.request(self.rng.choice(self.users), 'GET', '/api/profile/list-all/')
+        return self.run_or_prepare(call, prepare_only)
+
+    def scenario_profile_list_others(self, prepare_only=False):
+        call = self.request(self.rng.choice(self.users), 'GET', '/api/profile/list-others/')
+        return self.run_or_prepare(call, prepare_only)
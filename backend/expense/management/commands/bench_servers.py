@@ -0,0 +1,196 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from contextlib import redirect_stdout
+
+import requests
+from django.conf import settings
+from django.core.management.base import CommandError
+from django.db import connection
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from expense.management.commands import bench
+from expense.management.commands.bench import percentile
+
+SERVERS = {
+    # The sync views behind gunicorn's default sync workers
+    'wsgi': ['project.wsgi:application'],
+    # The async views behind uvicorn workers
+    'asgi': ['project.asgi:application', '-k', 'uvicorn_worker.UvicornWorker'],
+}
+
+
+class Command(bench.Command):
+    help = (
+        'Seed a synthetic dataset into the configured database, then serve it with '
+        'gunicorn under WSGI and under ASGI and load the read endpoints (friends, '
+        'groups, group details, balances) with concurrent clients. Prints a JSON '
+        'report of throughput and latency per server.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Users to create (default: 200)')
+        parser.add_argument('--friends-per-user', type=int, default=10, help='Average friends per user (default: 10)')
+        parser.add_argument('--groups', type=int, default=20, help='Groups to create (default: 20)')
+        parser.add_argument('--group-size', type=int, default=8, help='Average members per group (default: 8)')
+        parser.add_argument('--expenses', type=int, default=500, help='Expenses to create (default: 500)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+        parser.add_argument(
+            '--servers', default='wsgi,asgi',
+            help=f'Comma separated servers to measure (default: all of {", ".join(SERVERS)})'
+        )
+        parser.add_argument('--workers', type=int, default=2, help='gunicorn workers per server (default: 2)')
+        parser.add_argument('--concurrency', type=int, default=32, help='Concurrent clients (default: 32)')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds of load per server (default: 10)')
+        parser.add_argument('--port', type=int, default=8765, help='Local port to serve on (default: 8765)')
+        parser.add_argument(
+            '--no-cache', action='store_true',
+            help='Disable the response cache so every request reaches the database'
+        )
+        parser.add_argument('--output', help='Also write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        servers = [name.strip() for name in options['servers'].split(',')]
+        unknown = set(servers) - set(SERVERS)
+        if unknown:
+            raise CommandError(f'Unknown servers: {", ".join(sorted(unknown))}')
+        if options['users'] < 4:
+            raise CommandError('--users must be at least 4')
+        if connection.vendor == 'sqlite' and connection.settings_dict['NAME'] == ':memory:':
+            raise CommandError('The servers run in separate processes and need a file or server database')
+
+        # Signals print progress; keep stdout for the JSON report
+        with redirect_stdout(sys.stderr):
+            self.rng = random.Random(options['seed'])
+            dataset = self.generate(options)
+            targets = self.targets()
+            # Seeding ran in this process; the servers read it from the database
+            connection.close()
+
+        results = {}
+        for name in servers:
+            self.stderr.write(f'Loading {name}...')
+            results[name] = self.measure(name, targets, options)
+
+        report = {
+            'database': connection.vendor,
+            'created_at': timezone.now().isoformat(),
+            'response_cache': not options['no_cache'],
+            'workers': options['workers'],
+            'concurrency': options['concurrency'],
+            'duration_seconds': options['duration'],
+            'dataset': dataset,
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+
+    def targets(self):
+        """``(headers, path)`` for each endpoint of up to 50 group members"""
+        targets = []
+        members = [(user_id, group_id) for group_id, ids in self.group_members.items() for user_id in ids]
+        for user_id, group_id in self.rng.sample(members, min(50, len(members))):
+            user = next(user for user in self.users if user.id == user_id)
+            headers = {'Authorization': f'Bearer {AccessToken.for_user(user)}'}
+            targets.extend((headers, path) for path in (
+                '/api/friends/list/',
+                '/api/group/list/',
+                f'/api/group/details/{group_id}/',
+                '/api/expenses/user-total-balances/',
+            ))
+        return targets
+
+    # ========================================================================
+    # SERVERS
+    # ========================================================================
+
+    def start(self, name, options):
+        env = dict(
+            os.environ,
+            ASYNC_VIEWS='true' if name == 'asgi' else 'false',
+            RESPONSE_CACHE_ENABLED='false' if options['no_cache'] else 'true',
+            # One log line per request would dominate the measurement
+            PROFILING_LOG_LEVEL='WARNING',
+        )
+        command = [
+            sys.executable, '-m', 'gunicorn', *SERVERS[name],
+            '--bind', f'127.0.0.1:{options["port"]}',
+            '--workers', str(options['workers']),
+            '--log-level', 'warning',
+        ]
+        server = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL)
+
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'{name} server exited with status {server.returncode}')
+            try:
+                requests.get(f'http://127.0.0.1:{options["port"]}/health/', timeout=5)
+                return server
+            except requests.RequestException:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError(f'{name} server did not start within 30 seconds')
+
+    def measure(self, name, targets, options):
+        base_url = f'http://127.0.0.1:{options["port"]}'
+        server = self.start(name, options)
+        try:
+            # Warm up every worker's connections and caches before timing
+            with requests.Session() as session:
+                for headers, path in targets:
+                    response = session.get(base_url + path, headers=headers)
+                    if response.status_code != 200:
+                        raise CommandError(f'{name}: GET {path} returned {response.status_code}')
+
+            latencies, errors = [], []
+            lock = threading.Lock()
+            deadline = time.monotonic() + options['duration']
+
+            def client(seed):
+                rng = random.Random(seed)
+                timings, failures = [], 0
+                with requests.Session() as session:
+                    while time.monotonic() < deadline:
+                        headers, path = rng.choice(targets)
+                        started = time.perf_counter()
+                        try:
+                            ok = session.get(base_url + path, headers=headers, timeout=30).status_code == 200
+                        except requests.RequestException:
+                            ok = False
+                        timings.append((time.perf_counter() - started) * 1000)
+                        failures += not ok
+                with lock:
+                    latencies.extend(timings)
+                    errors.append(failures)
+
+            started = time.perf_counter()
+            threads = [threading.Thread(target=client, args=(options['seed'] + i,)) for i in range(options['concurrency'])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+        if not latencies:
+            raise CommandError(f'{name}: no requests completed')
+        return {
+            'requests': len(latencies),
+            'errors': sum(errors),
+            'requests_per_second': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.50), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 2),
+        }
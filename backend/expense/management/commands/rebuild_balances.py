@@ -0,0 +1,57 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from connections.models import Group
+from expense.ledger import rebuild_balances
+
+
+class Command(BaseCommand):
+    help = 'Rebuild Balance and UserTotalBalance from expenses and settlements using set-based aggregation'
+
+    def add_arguments(self, parser):
+        scope = parser.add_mutually_exclusive_group(required=True)
+        scope.add_argument(
+            '--user',
+            help='Rebuild balances involving one user (ID or username)'
+        )
+        scope.add_argument(
+            '--group',
+            type=int,
+            help='Rebuild balances inside one group (ID)'
+        )
+        scope.add_argument(
+            '--all',
+            action='store_true',
+            help='Rebuild every balance in the database'
+        )
+
+    def handle(self, *args, **options):
+        user = group = None
+        if options['user']:
+            value = options['user']
+            lookup = {'id': int(value)} if value.isdigit() else {'username': value}
+            try:
+                user = User.objects.get(**lookup)
+            except User.DoesNotExist:
+                raise CommandError(f'User {value} not found')
+            scope = f'user {user.username}'
+        elif options['group']:
+            try:
+                group = Group.objects.get(id=options['group'])
+            except Group.DoesNotExist:
+                raise CommandError(f'Group {options["group"]} not found')
+            scope = f'group {group.name}'
+        else:
+            scope = 'all users'
+
+        self.stdout.write(f'Rebuilding balances for {scope}...')
+        started = time.perf_counter()
+        stats = rebuild_balances(user=user, group=group)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(f'  Pairs with a balance:    {stats["pairs"]}')
+        self.stdout.write(f'  Balance rows updated:    {stats["balances_updated"]}')
+        self.stdout.write(f'  Balance rows created:    {stats["balances_created"]}')
+        self.stdout.write(f'  Total rows updated:      {stats["totals_updated"]}')
+        self.stdout.write(f'  Total rows created:      {stats["totals_created"]}')
+        self.stdout.write(self.style.SUCCESS(f'Balances rebuilt in {elapsed:.2f}s'))
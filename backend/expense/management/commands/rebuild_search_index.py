@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from expense.search import rebuild_index, BULK_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the expense search documents used by group expense search'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BULK_BATCH_SIZE,
+            help='Expenses indexed per batch'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding expense search index...')
+        started = time.perf_counter()
+        written = rebuild_index(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Indexed {written} expenses in {elapsed:.2f}s'))
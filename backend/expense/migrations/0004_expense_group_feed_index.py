@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connections', '0003_profile_isdarkmode'),
+        ('expense', '0003_update_timezone_settings'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='expense',
+            name='expense_exp_group_i_b288b6_idx',
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['group', 'is_deleted', 'date', 'id'], name='expense_exp_group_i_bf5e1e_idx'),
+        ),
+    ]
@@ -0,0 +1,109 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+FTS_TABLE = 'expense_search_fts'
+DOCUMENT_TABLE = 'expense_expensesearchdocument'
+BATCH_SIZE = 1000
+
+POSTGRES_INDEXES = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    f"CREATE INDEX expense_search_tsv_idx ON {DOCUMENT_TABLE} USING gin (to_tsvector('simple', document))",
+    f'CREATE INDEX expense_search_trgm_idx ON {DOCUMENT_TABLE} USING gin (document gin_trgm_ops)',
+]
+
+# External-content FTS5 table kept in sync with the document table by triggers.
+# The trigram tokenizer gives substring matches like the old icontains search.
+SQLITE_INDEXES = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(document, content='{DOCUMENT_TABLE}', content_rowid='expense_id', tokenize='trigram')",
+    f"""CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {DOCUMENT_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, document) VALUES (new.expense_id, new.document);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {DOCUMENT_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, document) VALUES ('delete', old.expense_id, old.document);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE ON {DOCUMENT_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, document) VALUES ('delete', old.expense_id, old.document);
+        INSERT INTO {FTS_TABLE}(rowid, document) VALUES (new.expense_id, new.document);
+    END""",
+]
+
+
+def create_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        for sql in POSTGRES_INDEXES:
+            schema_editor.execute(sql)
+    elif vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('SELECT sqlite_version()')
+            version = tuple(int(part) for part in cursor.fetchone()[0].split('.'))
+        # Older SQLite builds lack the trigram tokenizer; search then falls
+        # back to a LIKE scan over the document table.
+        if version >= (3, 34, 0):
+            for sql in SQLITE_INDEXES:
+                schema_editor.execute(sql)
+
+
+def drop_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS expense_search_trgm_idx')
+        schema_editor.execute('DROP INDEX IF EXISTS expense_search_tsv_idx')
+    elif vendor == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def backfill_search_documents(apps, schema_editor):
+    """Index every existing expense, BATCH_SIZE documents per INSERT"""
+    # build_document only reads fields and relations the historical models
+    # have too, so documents match the ones the signals write
+    from expense.search import build_document
+
+    Expense = apps.get_model('expense', 'Expense')
+    ExpenseSearchDocument = apps.get_model('expense', 'ExpenseSearchDocument')
+    expenses = Expense.objects.order_by('id').select_related('category').prefetch_related(
+        'payments__payer', 'shares__user'
+    )
+    documents = []
+    for expense in expenses.iterator(chunk_size=BATCH_SIZE):
+        documents.append(ExpenseSearchDocument(
+            expense_id=expense.id,
+            group_id=expense.group_id,
+            is_deleted=expense.is_deleted,
+            date=expense.date,
+            document=build_document(expense),
+        ))
+        if len(documents) >= BATCH_SIZE:
+            ExpenseSearchDocument.objects.bulk_create(documents)
+            documents = []
+    ExpenseSearchDocument.objects.bulk_create(documents)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('connections', '0003_profile_isdarkmode'),
+        ('expense', '0004_expense_group_feed_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpenseSearchDocument',
+            fields=[
+                ('expense', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='expense.expense')),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('date', models.DateTimeField()),
+                ('document', models.TextField(blank=True)),
+                ('group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='connections.group')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['group', 'is_deleted', 'date'], name='expense_exp_group_i_0c6196_idx')],
+            },
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+        migrations.RunPython(backfill_search_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:41
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('expense', '0005_expensesearchdocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserBalanceSummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='balance_summary', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('you_owe', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('you_are_owed', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('net_balance', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('owe_count', models.PositiveIntegerField(default=0)),
+                ('owed_by_count', models.PositiveIntegerField(default=0)),
+                ('top_counterparties', models.JSONField(default=list)),
+                ('groups', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'User Balance Summaries',
+            },
+        ),
+    ]
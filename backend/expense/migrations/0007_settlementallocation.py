@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expense', '0006_userbalancesummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SettlementAllocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('expense_share', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='settlement_allocations', to='expense.expenseshare')),
+                ('settlement', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='allocations', to='expense.settlement')),
+            ],
+            options={
+                'unique_together': {('settlement', 'expense_share')},
+            },
+        ),
+    ]
@@ -1,7 +1,7 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from django.db.models import Q, Sum, F, Case, When, DecimalField
+from django.db.models import Q, Sum, F, Case, When, DecimalField, Exists, OuterRef
 from django.utils import timezone
 from decimal import Decimal
 from connections.models import Group, Friendship, Profile
@@ -123,7 +123,8 @@ class Expense(TimeStampedModel):
     class Meta:
         indexes = [
             models.Index(fields=['date', 'is_deleted']),
-            models.Index(fields=['group', 'is_deleted']),
+            # Serves keyset pagination of group feeds ordered by (-date, -id)
+            models.Index(fields=['group', 'is_deleted', 'date', 'id']),
             models.Index(fields=['created_by', 'date']),
             models.Index(fields=['expense_id']),
         ]
@@ -160,6 +161,38 @@ class Expense(TimeStampedModel):
         share_holders = set(self.shares.values_list('user', flat=True))
         return User.objects.filter(id__in=payers.union(share_holders))
 
+class ExpenseSearchDocument(models.Model):
+    """
+    Denormalized, lowercased search text for one expense: description, notes,
+    amount, category name and the usernames of payers and share holders.
+    Kept up to date by expense.search; the full-text indexes over ``document``
+    are database specific and created in migration 0005.
+    """
+    expense = models.OneToOneField(
+        Expense,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='search_document'
+    )
+    group = models.ForeignKey(
+        'connections.Group',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    is_deleted = models.BooleanField(default=False)
+    date = models.DateTimeField()
+    document = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['group', 'is_deleted', 'date']),
+        ]
+
+    def __str__(self):
+        return f"Search document for expense {self.expense_id}"
+
 class ExpensePayment(TimeStampedModel):
     """Track who paid how much for an expense - supports multiple payers"""
     
@@ -247,24 +280,108 @@ class ExpenseShare(TimeStampedModel):
             raise ValidationError("Amount owed cannot be negative")
 
 class SettlementManager(models.Manager):
-    def create_settlement(self, payer, payee, amount, expense_shares=None, **kwargs):
-        """Create settlement and update related expense shares"""
-        settlement = self.create(
-            payer=payer,
-            payee=payee, 
-            amount=amount,
-            **kwargs
+    def outstanding_shares(self, payer, payee, group=None):
+        """
+        Shares ``payer`` still owes on expenses ``payee`` paid for, oldest first.
+        ``group=None`` means friend (non-group) expenses, matching the Balance row
+        a settlement without a group adjusts.
+        """
+        return ExpenseShare.objects.filter(
+            # EXISTS rather than a join on payments, so no share is returned twice
+            Exists(ExpensePayment.objects.filter(expense=OuterRef('expense'), payer=payee)),
+            user=payer,
+            expense__group=group,
+            expense__is_deleted=False,
+            amount_paid_back__lt=F('amount_owed'),
+        ).order_by('expense__date', 'expense_id', 'id')
+
+    def owed_to_payee(self, shares, payee):
+        """
+        ``{share id: amount}`` each share still owes ``payee``: its part of the
+        payee's payments on the expense, as the ledger computes it, less what
+        earlier settlements to the payee allocated to it.
+        """
+        from . import ledger
+
+        payments = {}
+        for expense_id, amount_paid, total_amount in ExpensePayment.objects.filter(
+            expense_id__in={share.expense_id for share in shares}, payer=payee
+        ).values_list('expense_id', 'amount_paid', 'expense__total_amount'):
+            payments.setdefault(expense_id, []).append((amount_paid, total_amount))
+        covered = dict(
+            SettlementAllocation.objects.filter(expense_share__in=shares, settlement__payee=payee)
+            .values('expense_share_id').annotate(total=Sum('amount')).values_list('expense_share_id', 'total')
         )
-        
-        if expense_shares:
-            settlement.expense_shares.set(expense_shares)
-            # Update amount_paid_back for each expense share
-            for share in expense_shares:
-                share.amount_paid_back = F('amount_paid_back') + (amount * share.amount_owed / sum(s.amount_owed for s in expense_shares))
-                share.save()
-        
+        return {
+            share.id: sum(
+                (ledger.share_debt(share.amount_owed, amount_paid, total_amount)
+                 for amount_paid, total_amount in payments.get(share.expense_id, ())),
+                Decimal('0')
+            ) - covered.get(share.id, Decimal('0'))
+            for share in shares
+        }
+
+    def create_settlement(self, payer, payee, amount, expense_shares=None, **kwargs):
+        """
+        Record that ``payer`` paid ``payee`` ``amount`` and allocate it across
+        the payer's outstanding shares, oldest first (or across
+        ``expense_shares`` in the given order). A share takes at most what it
+        still owes the payee, so on expenses with several payers the others
+        can still be settled. The shares are written with one bulk_update and
+        the Balance delta is applied once.
+        """
+        from . import ledger
+
+        with transaction.atomic(), ledger.suspended():
+            settlement = self.create(payer=payer, payee=payee, amount=amount, **kwargs)
+            if expense_shares is None:
+                shares = list(
+                    self.outstanding_shares(payer, payee, settlement.group).select_for_update(of=('self',))
+                )
+            else:
+                locked = ExpenseShare.objects.select_for_update().in_bulk([share.id for share in expense_shares])
+                shares = [locked[share.id] for share in expense_shares]
+
+            owed = self.owed_to_payee(shares, payee) if shares else {}
+            remaining = amount
+            allocations = []
+            for share in shares:
+                if remaining <= 0:
+                    break
+                portion = min(remaining, share.amount_remaining, owed[share.id])
+                if portion <= 0:
+                    continue
+                share.amount_paid_back += portion
+                remaining -= portion
+                allocations.append(SettlementAllocation(settlement=settlement, expense_share=share, amount=portion))
+
+            allocated = [allocation.expense_share for allocation in allocations]
+            if allocated:
+                ExpenseShare.objects.bulk_update(allocated, ['amount_paid_back'])
+                SettlementAllocation.objects.bulk_create(allocations)
+                settlement.expense_shares.add(*allocated)
+            ledger.apply_deltas(ledger.settlement_deltas(settlement))
         return settlement
 
+    def undo_settlement(self, settlement):
+        """Delete a settlement, giving its allocations back to the shares and reversing the Balance delta"""
+        from . import ledger
+
+        with transaction.atomic(), ledger.suspended():
+            allocations = list(settlement.allocations.all())
+            shares = {
+                share.id: share
+                for share in ExpenseShare.objects.select_for_update().filter(
+                    id__in=[allocation.expense_share_id for allocation in allocations]
+                )
+            }
+            for allocation in allocations:
+                shares[allocation.expense_share_id].amount_paid_back -= allocation.amount
+            if shares:
+                ExpenseShare.objects.bulk_update(shares.values(), ['amount_paid_back'])
+            ledger.apply_deltas(ledger.merge({}, ledger.settlement_deltas(settlement), sign=-1))
+            settlement.delete()
+
 class Settlement(TimeStampedModel):
     """Track payments/settlements between users"""
     
@@ -339,6 +456,26 @@ class Settlement(TimeStampedModel):
         if self.amount <= 0:
             raise ValidationError("Settlement amount must be positive")
 
+class SettlementAllocation(models.Model):
+    """How much of a settlement went to each expense share, so it can be undone"""
+    settlement = models.ForeignKey(
+        Settlement,
+        on_delete=models.CASCADE,
+        related_name='allocations'
+    )
+    expense_share = models.ForeignKey(
+        ExpenseShare,
+        on_delete=models.CASCADE,
+        related_name='settlement_allocations'
+    )
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+
+    class Meta:
+        unique_together = ('settlement', 'expense_share')
+
+    def __str__(self):
+        return f"₹{self.amount} of settlement {self.settlement_id} to share {self.expense_share_id}"
+
 class BalanceManager(models.Manager):
     def get_balance_between_users(self, user1, user2, group=None):
         """Get balance between two users, optionally within a group"""
@@ -480,6 +617,35 @@ class UserTotalBalance(models.Model):
         else:
             return f"{self.user1.username} and {self.user2.username} are settled"
 
+class UserBalanceSummary(models.Model):
+    """
+    Materialized home screen totals for one user, refreshed by
+    expense.summaries whenever the user's balances change.
+    Amounts are from the user's perspective: positive = owed to them.
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='balance_summary'
+    )
+    you_owe = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    you_are_owed = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    net_balance = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    owe_count = models.PositiveIntegerField(default=0)  # People the user owes
+    owed_by_count = models.PositiveIntegerField(default=0)  # People who owe the user
+    # [{'user_id', 'username', 'name', 'amount'}], largest balances first
+    top_counterparties = models.JSONField(default=list)
+    # [{'group_id', 'name', 'amount'}] for every group with a non-zero balance
+    groups = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "User Balance Summaries"
+
+    def __str__(self):
+        return f"Balance summary for {self.user.username}: ₹{self.net_balance}"
+
 # Default expense categories
 EXPENSE_CATEGORIES = [
     ('Food & Dining', '🍽️', '#FF6B6B'),
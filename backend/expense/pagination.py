@@ -0,0 +1,54 @@
+"""
+Keyset (cursor) pagination for expense feeds.
+
+Feeds are ordered by ``(-date, -id)``. A cursor is the opaque, URL-safe
+encoding of the last row's ``(date, id)``; the next page is everything strictly
+after it in that order, so every page costs the same index range scan no
+matter how deep the client has scrolled.
+"""
+
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+FEED_ORDERING = ('-date', '-id')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(expense):
+    payload = json.dumps([expense.date.isoformat(), expense.id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        date_value, expense_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        date = parse_datetime(date_value)
+        if date is None or not isinstance(expense_id, int):
+            raise ValueError
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor.')
+    return date, expense_id
+
+
+def paginate_by_cursor(expenses, cursor=None, page_size=20):
+    """
+    Return ``(page, next_cursor)`` for a feed queryset.
+    ``next_cursor`` is None on the last page.
+    """
+    if page_size < 1:
+        raise ValueError('page_size must be at least 1.')
+    expenses = expenses.order_by(*FEED_ORDERING)
+    if cursor:
+        date, expense_id = decode_cursor(cursor)
+        expenses = expenses.filter(Q(date__lt=date) | Q(date=date, id__lt=expense_id))
+    # Fetch one extra row to know whether there is a next page
+    page = list(expenses[:page_size + 1])
+    next_cursor = encode_cursor(page[page_size - 1]) if len(page) > page_size else None
+    return page[:page_size], next_cursor
@@ -0,0 +1,177 @@
+"""
+Expense search index.
+
+Each expense has one ExpenseSearchDocument row holding its searchable text
+(description, notes, amount, category and the usernames of everyone on it),
+so a search is a lookup in one indexed table instead of an ``icontains`` over
+a six-way join followed by ``DISTINCT``.
+
+The documents are rebuilt on commit for every expense touched during a
+transaction (see mark_dirty). Matching uses the database's own index:
+
+- PostgreSQL: ``to_tsvector`` GIN index for word prefixes, plus a pg_trgm GIN
+  index for substring matches anywhere in the text
+- SQLite: an FTS5 table with the trigram tokenizer, kept in sync by triggers
+- anything else, or queries shorter than a trigram: a LIKE over the documents
+"""
+
+import re
+import threading
+
+from django.db import connection, transaction
+from django.db.models import Q, BooleanField
+from django.db.models.expressions import RawSQL
+
+from .models import Expense, ExpenseSearchDocument
+
+FTS_TABLE = 'expense_search_fts'
+BULK_BATCH_SIZE = 1000
+MAX_RESULTS = 200
+
+_state = threading.local()
+_fts_available = None
+
+
+# ============================================================================
+# DOCUMENTS
+# ============================================================================
+
+def normalize(text):
+    """Lowercase and collapse whitespace, the form documents are stored in"""
+    return ' '.join(text.split()).lower()
+
+
+def build_document(expense):
+    """
+    Search text for an expense whose category, payments__payer and
+    shares__user are already loaded.
+    """
+    parts = [expense.description, expense.notes, str(expense.total_amount)]
+    if expense.category is not None:
+        parts.append(expense.category.name)
+    parts.extend(payment.payer.username for payment in expense.payments.all())
+    parts.extend(share.user.username for share in expense.shares.all())
+    return normalize(' '.join(part for part in parts if part))
+
+
+def index_expenses(expense_ids):
+    """
+    (Re)build the search documents of the given expenses with one load and
+    one upsert. Returns the number of documents written.
+    """
+    expense_ids = list(expense_ids)
+    if not expense_ids:
+        return 0
+    expenses = Expense.objects.filter(id__in=expense_ids).select_related('category').prefetch_related(
+        'payments__payer', 'shares__user'
+    )
+    documents = [
+        ExpenseSearchDocument(
+            expense_id=expense.id,
+            group_id=expense.group_id,
+            is_deleted=expense.is_deleted,
+            date=expense.date,
+            document=build_document(expense),
+        )
+        for expense in expenses
+    ]
+    ExpenseSearchDocument.objects.bulk_create(
+        documents,
+        batch_size=BULK_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['expense'],
+        update_fields=['group', 'is_deleted', 'date', 'document'],
+    )
+    return len(documents)
+
+
+def rebuild_index(batch_size=BULK_BATCH_SIZE):
+    """Index every expense; returns the number of documents written"""
+    written = 0
+    expense_ids = Expense.objects.order_by('id').values_list('id', flat=True)
+    batch = []
+    for expense_id in expense_ids.iterator(chunk_size=batch_size):
+        batch.append(expense_id)
+        if len(batch) >= batch_size:
+            written += index_expenses(batch)
+            batch = []
+    return written + index_expenses(batch)
+
+
+# ============================================================================
+# KEEPING THE INDEX FRESH
+# ============================================================================
+
+def mark_dirty(expense_id):
+    """
+    Queue an expense whose searchable fields may have changed.
+    Every expense queued during a transaction is re-indexed once, on commit.
+    """
+    pending = getattr(_state, 'dirty_expenses', None)
+    if pending is None:
+        pending = _state.dirty_expenses = set()
+    pending.add(expense_id)
+    transaction.on_commit(flush_dirty)
+
+
+def flush_dirty():
+    """Re-index every queued expense"""
+    pending = getattr(_state, 'dirty_expenses', None)
+    if not pending:
+        return
+    _state.dirty_expenses = set()
+    index_expenses(pending)
+
+
+# ============================================================================
+# QUERYING
+# ============================================================================
+
+def has_fts_table():
+    """Whether the SQLite FTS5 table was created by the migration"""
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = FTS_TABLE in connection.introspection.table_names()
+    return _fts_available
+
+
+def _prefix_query(needle):
+    """``to_tsquery`` text requiring every word of the query as a prefix"""
+    words = re.findall(r'\w+', needle)
+    return ' & '.join(f'{word}:*' for word in words)
+
+
+def matching_documents(group, query):
+    """Search documents of a group's live expenses that match ``query``"""
+    documents = ExpenseSearchDocument.objects.filter(group=group, is_deleted=False)
+    needle = normalize(query)
+    if not needle:
+        return documents.none()
+
+    if connection.vendor == 'postgresql':
+        match = Q(document__contains=needle)
+        tsquery = _prefix_query(needle)
+        if tsquery:
+            match |= Q(RawSQL(
+                f"to_tsvector('simple', {ExpenseSearchDocument._meta.db_table}.document) @@ to_tsquery('simple', %s)",
+                [tsquery],
+                output_field=BooleanField(),
+            ))
+        return documents.filter(match)
+
+    if connection.vendor == 'sqlite' and len(needle) >= 3 and has_fts_table():
+        phrase = '"' + needle.replace('"', '""') + '"'
+        return documents.filter(expense_id__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [phrase]
+        ))
+
+    return documents.filter(document__contains=needle)
+
+
+def search_expense_ids(group, query, limit=MAX_RESULTS):
+    """Public ``expense_id`` UUIDs of a group's matching expenses, newest first"""
+    return list(
+        matching_documents(group, query)
+        .order_by('-date', '-expense_id')
+        .values_list('expense__expense_id', flat=True)[:limit]
+    )
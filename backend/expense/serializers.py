@@ -2,11 +2,13 @@ from rest_framework import serializers
 from django.contrib.auth.models import User
 from decimal import Decimal
 from django.utils import timezone
-from .models import Expense, ExpensePayment, ExpenseShare, ExpenseCategory, UserTotalBalance, Balance
-from connections.models import Group, Friendship
+from .models import Expense, ExpensePayment, ExpenseShare, ExpenseCategory, UserTotalBalance, Balance, UserBalanceSummary, Settlement
+from connections import friend_graph
+from connections.models import Group
 from django.db.models import Sum
 from django.db import transaction
-from .signals import recalculate_user_balances
+from . import ledger, search
+from .signals import notify_expenses_added
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -64,18 +66,41 @@ class AddExpenseSerializer(serializers.Serializer):
             raise serializers.ValidationError("Duplicate payer_id in payments.")
         return value
 
+    def validate_category_id(self, value):
+        if value is None:
+            return value
+        # Categories are a small fixed table, load their IDs once per context
+        if 'category_ids' not in self.context:
+            self.context['category_ids'] = set(ExpenseCategory.objects.values_list('id', flat=True))
+        if value not in self.context['category_ids']:
+            raise serializers.ValidationError("Invalid category ID")
+        return value
+
+    def get_group_members(self, group_id):
+        """
+        Load an active group and a map of its members in two queries.
+        Lookups are cached in the serializer context so several expenses for
+        the same group can be validated against one membership lookup.
+        """
+        cache = self.context.setdefault('group_members', {})
+        if group_id not in cache:
+            try:
+                group = Group.objects.get(id=group_id, is_active=True)
+            except Group.DoesNotExist:
+                raise serializers.ValidationError("Group not found or inactive.")
+            cache[group_id] = (group, {user.id: user for user in group.members.all()})
+        return cache[group_id]
+
     def validate(self, attrs):
         user_ids = [int(uid) for uid in attrs['user_ids']]
+        if len(set(user_ids)) != len(user_ids):
+            duplicate_ids = sorted({uid for uid in user_ids if user_ids.count(uid) > 1})
+            raise serializers.ValidationError(f"Duplicate user IDs in user_ids: {duplicate_ids}")
         group_id = attrs['group_id']
         payments = attrs['payments']
         total_amount = attrs['total_amount']
-        # Validate all payers exist and are in user_ids
+        # Validate all payers are in user_ids
         payer_ids = [p['payer_id'] for p in payments]
-        existing_users = User.objects.filter(id__in=payer_ids)
-        if len(existing_users) != len(payer_ids):
-            existing_ids = set(existing_users.values_list('id', flat=True))
-            missing_ids = set(payer_ids) - existing_ids
-            raise serializers.ValidationError(f"Payers with IDs {missing_ids} not found")
         for pid in payer_ids:
             if pid not in user_ids:
                 raise serializers.ValidationError(f"Payer {pid} must be included in user_ids")
@@ -83,14 +108,14 @@ class AddExpenseSerializer(serializers.Serializer):
         sum_paid = sum(Decimal(p['amount_paid']) for p in payments)
         if abs(sum_paid - total_amount) > Decimal('0.01'):
             raise serializers.ValidationError("Sum of all payments must equal total_amount")
-        # Validate all users exist
-        group = Group.objects.get(id=group_id, is_active=True)
-        group_members = group.members.filter(id__in=user_ids)
-        if group_members.count() != len(user_ids):
-            group_member_ids = set(group_members.values_list('id', flat=True))
-            non_member_ids = set(user_ids) - group_member_ids
+        # Validate all users (and so all payers) exist and are group members
+        group, members = self.get_group_members(group_id)
+        if not set(user_ids) <= members.keys():
+            non_member_ids = set(user_ids) - members.keys()
             raise serializers.ValidationError(f"Users with IDs {non_member_ids} are not members of the specified group")
         attrs['user_ids'] = user_ids
+        attrs['group'] = group
+        attrs['user_map'] = {uid: members[uid] for uid in user_ids}
         # Percentage split validation
         if attrs.get('split_type', 'equal') == 'percentage':
             splits = attrs.get('splits')
@@ -104,67 +129,68 @@ class AddExpenseSerializer(serializers.Serializer):
                 raise serializers.ValidationError("Total percentage must equal 100%.")
         return attrs
 
-    def create(self, validated_data):
-        user_ids = validated_data.pop('user_ids')
-        payments = validated_data.pop('payments')
-        group_id = validated_data.pop('group_id')
-        split_type = validated_data.pop('split_type', 'equal')
-        splits = validated_data.pop('splits', None)
-        category_id = validated_data.pop('category_id', None)
-        users = User.objects.filter(id__in=user_ids)
-        group = Group.objects.get(id=group_id)
-        category = None
-        if category_id is not None:
-            category = ExpenseCategory.objects.get(id=category_id)
+    def build_expense(self, validated_data):
+        """Build the unsaved Expense for validated data"""
+        return Expense(
+            description=validated_data['description'],
+            total_amount=validated_data['total_amount'],
+            currency=validated_data.get('currency', 'INR'),
+            notes=validated_data.get('notes', ''),
+            group=validated_data['group'],
+            category_id=validated_data.get('category_id'),
+            split_type=validated_data.get('split_type', 'equal'),
+            created_by=self.context['request'].user
+        )
+
+    def build_rows(self, expense, validated_data):
+        """Build the unsaved ExpensePayment and ExpenseShare rows of a saved expense"""
+        user_map = validated_data['user_map']
         total_amount = validated_data['total_amount']
-        with transaction.atomic():
-            expense = Expense.objects.create(
-                **validated_data,
-                group=group,
-                category=category,
-                split_type=split_type,
-                created_by=self.context['request'].user
+        payments = [
+            ExpensePayment(
+                expense=expense,
+                payer=user_map[p['payer_id']],
+                amount_paid=p['amount_paid']
             )
-            for payment in payments:
-                payer = User.objects.get(id=payment['payer_id'])
-                ExpensePayment.objects.create(
+            for p in validated_data['payments']
+        ]
+        # Calculate total paid by each user
+        paid_by_user = {p.payer_id: Decimal(p.amount_paid) for p in payments}
+        shares = []
+        if validated_data.get('split_type', 'equal') == 'equal':
+            split_amount = (total_amount / len(user_map)).quantize(Decimal('0.01'))
+            for user in user_map.values():
+                paid = paid_by_user.get(user.id, Decimal('0'))
+                shares.append(ExpenseShare(
                     expense=expense,
-                    payer=payer,
-                    amount_paid=payment['amount_paid']
-                )
-            if split_type == 'equal':
-                split_amount = total_amount / len(users)
-                # Calculate total paid by each user
-                paid_by_user = {p['payer_id']: Decimal(p['amount_paid']) for p in payments}
-                for user in users:
-                    paid = paid_by_user.get(user.id, Decimal('0'))
-                    paid_back = min(split_amount, paid)
-                    ExpenseShare.objects.create(
-                        expense=expense,
-                        user=user,
-                        amount_owed=split_amount,
-                        amount_paid_back=paid_back
-                    )
-            elif split_type == 'percentage':
-                paid_by_user = {p['payer_id']: Decimal(p['amount_paid']) for p in payments}
-                for s in splits:
-                    share_user = User.objects.get(id=s['user_id'])
-                    percentage = Decimal(s['percentage'])
-                    owed = (total_amount * percentage / 100).quantize(Decimal('0.01'))
-                    paid = paid_by_user.get(share_user.id, Decimal('0'))
-                    paid_back = min(owed, paid)
-                    ExpenseShare.objects.create(
-                        expense=expense,
-                        user=share_user,
-                        percentage=percentage,
-                        amount_owed=owed,
-                        amount_paid_back=paid_back
-                    )
-            involved_users = set()
-            involved_users.update([s.user for s in expense.shares.all()])
-            involved_users.update([p.payer for p in expense.payments.all()])
-            for user in involved_users:
-                recalculate_user_balances(user)
+                    user=user,
+                    amount_owed=split_amount,
+                    amount_paid_back=min(split_amount, paid)
+                ))
+        else:
+            for s in validated_data['splits']:
+                share_user = user_map[int(s['user_id'])]
+                percentage = Decimal(s['percentage'])
+                owed = (total_amount * percentage / 100).quantize(Decimal('0.01'))
+                paid = paid_by_user.get(share_user.id, Decimal('0'))
+                shares.append(ExpenseShare(
+                    expense=expense,
+                    user=share_user,
+                    percentage=percentage,
+                    amount_owed=owed,
+                    amount_paid_back=min(owed, paid)
+                ))
+        return payments, shares
+
+    def create(self, validated_data):
+        with transaction.atomic():
+            expense = self.build_expense(validated_data)
+            expense.save()
+            payments, shares = self.build_rows(expense, validated_data)
+            ExpensePayment.objects.bulk_create(payments)
+            ExpenseShare.objects.bulk_create(shares)
+            # Apply only this expense's contribution to the balances
+            ledger.record_expense(expense, payments=payments, shares=shares)
             return expense
 
     @staticmethod
@@ -172,6 +198,71 @@ class AddExpenseSerializer(serializers.Serializer):
         return ExpenseCategory.objects.all().values('id', 'name', 'icon', 'color')
 
 
+class BatchAddExpenseSerializer(serializers.Serializer):
+    """
+    Validate and insert many group expenses in one transaction.
+    Every item is validated with AddExpenseSerializer against a shared
+    context, so each group's membership is looked up only once.
+    """
+    MAX_EXPENSES = 500
+
+    expenses = serializers.ListField(
+        child=serializers.DictField(),
+        min_length=1,
+        max_length=MAX_EXPENSES
+    )
+
+    def validate_expenses(self, value):
+        self.items = []
+        for item in value:
+            item_serializer = AddExpenseSerializer(data=item, context=self.context)
+            item_serializer.is_valid()
+            self.items.append(item_serializer)
+        return value
+
+    def create(self, validated_data):
+        """Insert every valid item and return one result per submitted item"""
+        valid = [item for item in self.items if not item.errors]
+        with transaction.atomic():
+            expenses = [item.build_expense(item.validated_data) for item in valid]
+            Expense.objects.bulk_create(expenses)
+            payments, shares, deltas = [], [], {}
+            for item, expense in zip(valid, expenses):
+                item_payments, item_shares = item.build_rows(expense, item.validated_data)
+                payments.extend(item_payments)
+                shares.extend(item_shares)
+                ledger.expense_deltas(expense, payments=item_payments, shares=item_shares, deltas=deltas)
+            ExpensePayment.objects.bulk_create(payments)
+            ExpenseShare.objects.bulk_create(shares)
+            # One balance write for the whole batch
+            ledger.apply_deltas(deltas)
+            # bulk_create skips the save signals that keep the search index
+            # fresh and tell group members about new expenses
+            for expense in expenses:
+                search.mark_dirty(expense.id)
+            by_group = {}
+            for expense in expenses:
+                by_group.setdefault(expense.group_id, []).append(expense)
+            for group_id, group_expenses in by_group.items():
+                notify_expenses_added(group_id, group_expenses, self.context['request'].user.id)
+
+        created = iter(expenses)
+        results = []
+        for index, item in enumerate(self.items):
+            if item.errors:
+                results.append({'index': index, 'status': 'invalid', 'errors': item.errors})
+            else:
+                expense = next(created)
+                results.append({
+                    'index': index,
+                    'status': 'created',
+                    'expense_id': expense.expense_id,
+                    'description': expense.description,
+                    'total_amount': str(expense.total_amount),
+                })
+        return results
+
+
 class ExpenseResponseSerializer(serializers.Serializer):
     """Serializer for expense response"""
     
@@ -226,8 +317,7 @@ class AddFriendExpenseSerializer(serializers.Serializer):
         if payer_id not in friend_ids:
             raise serializers.ValidationError("Payer must be included in friend_ids")
         # Validate all friend_ids are friends of payer
-        payer = User.objects.get(id=payer_id)
-        friends = set(u.id for u in Friendship.objects.friends_of(payer))
+        friends = friend_graph.friend_ids(payer_id)
         for uid in friend_ids:
             if uid != payer_id and uid not in friends:
                 raise serializers.ValidationError(f"User {uid} is not a friend of payer {payer_id}")
@@ -264,48 +354,113 @@ class AddFriendExpenseSerializer(serializers.Serializer):
                 split_type=split_type,
                 created_by=self.context['request'].user
             )
-            ExpensePayment.objects.create(
+            payment = ExpensePayment.objects.create(
                 expense=expense,
                 payer=payer,
                 amount_paid=total_amount
             )
+            # The single payer paid the whole amount
+            paid_by_user = {payer.id: total_amount}
+            shares = []
             if split_type == 'equal':
-                split_amount = total_amount / len(users)
-                # Calculate total paid by each user
-                paid_by_user = {p['payer_id']: Decimal(p['amount_paid']) for p in payments}
+                split_amount = (total_amount / len(users)).quantize(Decimal('0.01'))
                 for user in users:
                     paid = paid_by_user.get(user.id, Decimal('0'))
                     paid_back = min(split_amount, paid)
-                    ExpenseShare.objects.create(
+                    shares.append(ExpenseShare(
                         expense=expense,
                         user=user,
                         amount_owed=split_amount,
                         amount_paid_back=paid_back
-                    )
+                    ))
             elif split_type == 'percentage':
-                paid_by_user = {p['payer_id']: Decimal(p['amount_paid']) for p in payments}
                 for s in splits:
                     share_user = User.objects.get(id=s['user_id'])
                     percentage = Decimal(s['percentage'])
                     owed = (total_amount * percentage / 100).quantize(Decimal('0.01'))
                     paid = paid_by_user.get(share_user.id, Decimal('0'))
                     paid_back = min(owed, paid)
-                    ExpenseShare.objects.create(
+                    shares.append(ExpenseShare(
                         expense=expense,
                         user=share_user,
                         percentage=percentage,
                         amount_owed=owed,
                         amount_paid_back=paid_back
-                    )
-            # Recalculate balances for all involved users
-            involved_users = set()
-            involved_users.update([s.user for s in expense.shares.all()])
-            involved_users.update([p.payer for p in expense.payments.all()])
-            for user in involved_users:
-                recalculate_user_balances(user)
+                    ))
+            ExpenseShare.objects.bulk_create(shares)
+            # Apply only this expense's contribution to the balances
+            ledger.record_expense(expense, payments=[payment], shares=shares)
             return expense 
 
 
+class CreateSettlementSerializer(serializers.Serializer):
+    """
+    Record a payment between the current user and another user.
+    The current user must be the payer or the payee.
+    """
+    payer_id = serializers.IntegerField(required=False)
+    payee_id = serializers.IntegerField()
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=Decimal('0.01'))
+    group_id = serializers.IntegerField(required=False, allow_null=True)
+    settlement_method = serializers.ChoiceField(choices=Settlement.SETTLEMENT_METHODS, required=False, allow_blank=True)
+    notes = serializers.CharField(max_length=500, required=False, allow_blank=True)
+
+    def validate(self, attrs):
+        user = self.context['request'].user
+        payer_id = attrs.get('payer_id', user.id)
+        payee_id = attrs['payee_id']
+        if payer_id == payee_id:
+            raise serializers.ValidationError("Cannot settle with yourself")
+        if user.id not in (payer_id, payee_id):
+            raise serializers.ValidationError("You must be the payer or the payee of a settlement")
+
+        users = User.objects.in_bulk([payer_id, payee_id])
+        if len(users) != 2:
+            raise serializers.ValidationError("Payer or payee not found")
+        attrs['payer'] = users[payer_id]
+        attrs['payee'] = users[payee_id]
+
+        group_id = attrs.get('group_id')
+        attrs['group'] = None
+        if group_id is not None:
+            try:
+                group = Group.objects.get(id=group_id, is_active=True)
+            except Group.DoesNotExist:
+                raise serializers.ValidationError("Group not found or inactive")
+            if group.members.filter(id__in=[payer_id, payee_id]).count() != 2:
+                raise serializers.ValidationError("Payer and payee must both be members of the group")
+            attrs['group'] = group
+        return attrs
+
+    def create(self, validated_data):
+        return Settlement.objects.create_settlement(
+            payer=validated_data['payer'],
+            payee=validated_data['payee'],
+            amount=validated_data['amount'],
+            group=validated_data['group'],
+            settlement_method=validated_data.get('settlement_method', ''),
+            notes=validated_data.get('notes', ''),
+        )
+
+
+class SettlementSerializer(serializers.ModelSerializer):
+    payer = UserSerializer()
+    payee = UserSerializer()
+    allocated_amount = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Settlement
+        fields = ['settlement_id', 'payer', 'payee', 'amount', 'currency', 'group',
+                  'settlement_method', 'notes', 'allocated_amount', 'created_at']
+        read_only_fields = fields
+
+    def get_allocated_amount(self, obj):
+        """How much of the payment was matched to open expense shares"""
+        if hasattr(obj, 'allocated_amount'):
+            return obj.allocated_amount
+        return obj.allocations.aggregate(total=Sum('amount'))['total'] or Decimal('0')
+
+
 class UserTotalBalanceSerializer(serializers.ModelSerializer):
     other_user_id = serializers.SerializerMethodField()
     other_user_username = serializers.SerializerMethodField()
@@ -329,6 +484,13 @@ class UserTotalBalanceSerializer(serializers.ModelSerializer):
             return obj.user1.username 
 
 
+class UserBalanceSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UserBalanceSummary
+        fields = ['you_owe', 'you_are_owed', 'net_balance', 'owe_count', 'owed_by_count',
+                  'top_counterparties', 'groups', 'updated_at']
+
+
 class BalanceSerializer(serializers.ModelSerializer):
     user1 = UserSerializer()
     user2 = UserSerializer()
@@ -339,6 +501,13 @@ class BalanceSerializer(serializers.ModelSerializer):
 
 
 class ExpenseListSerializer(serializers.ModelSerializer):
+    """
+    Expense row for list screens.
+    Expects a queryset prepared with views.with_list_details(), which loads the
+    group, category, payments and shares up front and annotates ``you_owe``, so
+    serializing a page runs no per-row queries. Plain querysets still work,
+    one query per relation per row.
+    """
     payer_id = serializers.SerializerMethodField()
     payer_name = serializers.SerializerMethodField()
     payer_profile_pic = serializers.SerializerMethodField()
@@ -358,22 +527,27 @@ class ExpenseListSerializer(serializers.ModelSerializer):
                  'owed_breakdown', 'you_owe', 'category', 'is_user_expense', 'created_by', 'group_admin_id']
         read_only_fields = fields
 
+    def get_first_payment(self, obj):
+        """First payment by ID, taken from the prefetched payments"""
+        payments = sorted(obj.payments.all(), key=lambda payment: payment.id)
+        return payments[0] if payments else None
+
     def get_group_name(self, obj):
         return obj.group.name if obj.group else None
 
     def get_payer_id(self, obj):
-        payment = obj.payments.first()
-        return payment.payer.id if payment else None
+        payment = self.get_first_payment(obj)
+        return payment.payer_id if payment else None
 
     def get_payer_name(self, obj):
-        payment = obj.payments.first()
+        payment = self.get_first_payment(obj)
         if not payment:
             return None
         payer = payment.payer
         return payer.get_full_name() or payer.username
 
     def get_payer_profile_pic(self, obj):
-        payment = obj.payments.first()
+        payment = self.get_first_payment(obj)
         if not payment:
             return ''
         try:
@@ -382,12 +556,13 @@ class ExpenseListSerializer(serializers.ModelSerializer):
             return ''
 
     def get_owed_breakdown(self, obj):
-        payments = obj.payments.all()
-        if not payments:
+        payment = self.get_first_payment(obj)
+        if not payment:
             return []
-        payer = payments.first().payer
         breakdown = []
-        for share in obj.shares.exclude(user=payer):
+        for share in obj.shares.all():
+            if share.user_id == payment.payer_id:
+                continue
             user = share.user
             try:
                 profile_pic = user.profile.profile_picture_url or ''
@@ -402,6 +577,8 @@ class ExpenseListSerializer(serializers.ModelSerializer):
         return breakdown
 
     def get_you_owe(self, obj):
+        if hasattr(obj, 'you_owe'):
+            return obj.you_owe
         user = self.context.get('user')
         return obj.shares.filter(user=user).aggregate(total=Sum('amount_owed'))['total'] or 0 
 
@@ -419,8 +596,8 @@ class ExpenseListSerializer(serializers.ModelSerializer):
         user = self.context.get('user')
         if not user:
             return False
-        payment = obj.payments.first()
-        return payment.payer.id == user.id if payment else False 
+        payment = self.get_first_payment(obj)
+        return payment.payer_id == user.id if payment else False 
 
     def get_date(self, obj):
         """Return date in ISO format with proper timezone handling"""
@@ -432,14 +609,23 @@ class ExpenseListSerializer(serializers.ModelSerializer):
         return None 
 
     def get_created_by(self, obj):
-        return obj.created_by.id if obj.created_by else None
+        return obj.created_by_id
 
     def get_group_admin_id(self, obj):
-        if obj.group and obj.group.created_by:
-            return obj.group.created_by.id
+        if obj.group:
+            return obj.group.created_by_id
         return None
 
 
+class ExpenseListLiteSerializer(ExpenseListSerializer):
+    """Smaller field set for list screens that only show one line per expense"""
+
+    class Meta(ExpenseListSerializer.Meta):
+        fields = ['expense_id', 'description', 'total_amount', 'currency', 'date',
+                 'payer_id', 'payer_name', 'you_owe', 'is_user_expense']
+        read_only_fields = fields
+
+
 class EditExpenseSerializer(serializers.Serializer):
     expense_id = serializers.UUIDField(required=True)
     description = serializers.CharField(max_length=200, required=False)
@@ -519,10 +705,14 @@ class EditExpenseSerializer(serializers.Serializer):
         from .models import ExpenseShare, ExpensePayment, ExpenseCategory
         from django.contrib.auth.models import User
 
-        with transaction.atomic():
+        with transaction.atomic(), ledger.suspended():
+            # Lock the expense so concurrent edits and deletes compute their
+            # deltas one after another, each from the rows the last one wrote
+            instance = Expense.objects.select_for_update().get(pk=instance.pk, is_deleted=False)
             # Load all shares & payment info BEFORE any deletion or updates
             shares = list(instance.shares.all())
             payments = list(instance.payments.all())
+            before = ledger.expense_deltas(instance, payments=payments, shares=shares)
 
             # Update core fields only if present
             if 'description' in self.validated_data:
@@ -616,11 +806,8 @@ class EditExpenseSerializer(serializers.Serializer):
                             share.amount_owed = (instance.total_amount * share.percentage / 100).quantize(Decimal('0.01'))
                             share.save()
 
-            # Recalculate balances for all involved users
-            involved_users = set()
-            involved_users.update([s.user for s in instance.shares.all()])
-            involved_users.update([p.payer for p in instance.payments.all()])
-            for user in involved_users:
-                recalculate_user_balances(user)
+            # Apply the difference between the old and new contribution
+            after = ledger.expense_deltas(instance)
+            ledger.apply_deltas(ledger.diff(after, before))
 
         return instance 
\ No newline at end of file
@@ -0,0 +1,184 @@
+"""
+Group settlement planning (debt simplification).
+
+Each member's net position in a group is the sum of their Balance rows there
+(settlements are already applied to Balance). A plan is a list of transfers
+that brings every position back to zero:
+
+- groups with at most EXACT_SOLVER_LIMIT non-zero members are solved exactly:
+  the fewest transfers is ``n - k`` where ``k`` is the largest number of
+  disjoint zero-sum subsets, found with a DP over subsets
+- larger groups use the greedy max-heap algorithm (largest debtor pays the
+  largest creditor), at most ``n - 1`` transfers in O(n log n)
+
+Amounts are handled in integer paise so the plan always nets to exactly zero.
+Plans are cached per group and dropped whenever the group's balances change.
+"""
+
+import heapq
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+
+from .models import Balance
+
+EXACT_SOLVER_LIMIT = 10
+CACHE_TIMEOUT = 60 * 60
+
+
+# ============================================================================
+# NET POSITIONS
+# ============================================================================
+
+def to_paise(amount):
+    return int((amount * 100).to_integral_value())
+
+
+def from_paise(amount):
+    return str((Decimal(amount) / 100).quantize(Decimal('0.01')))
+
+
+def net_positions(group):
+    """
+    ``{user_id: paise}`` of every member with a non-zero position,
+    positive = the group owes them. Two grouped queries over Balance.
+    """
+    positions = {}
+    balances = Balance.objects.filter(group=group)
+    # balance_amount > 0 means user1 owes user2
+    for row in balances.values('user1_id').annotate(amount=Sum('balance_amount')).order_by():
+        positions[row['user1_id']] = positions.get(row['user1_id'], 0) - to_paise(row['amount'])
+    for row in balances.values('user2_id').annotate(amount=Sum('balance_amount')).order_by():
+        positions[row['user2_id']] = positions.get(row['user2_id'], 0) + to_paise(row['amount'])
+    return {user_id: amount for user_id, amount in positions.items() if amount}
+
+
+# ============================================================================
+# SOLVERS
+# ============================================================================
+
+def greedy_transfers(positions):
+    """
+    Largest debtor pays largest creditor until everyone is settled.
+    Returns ``[(debtor_id, creditor_id, paise)]``.
+    """
+    creditors = [(-amount, user_id) for user_id, amount in positions.items() if amount > 0]
+    debtors = [(amount, user_id) for user_id, amount in positions.items() if amount < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, creditor_id = heapq.heappop(creditors)
+        debt, debtor_id = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append((debtor_id, creditor_id, amount))
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor_id))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor_id))
+    return transfers
+
+
+def exact_transfers(positions):
+    """
+    Minimum number of transfers: split the members into as many disjoint
+    zero-sum subsets as possible, then settle each subset greedily.
+    """
+    user_ids = list(positions)
+    amounts = [positions[user_id] for user_id in user_ids]
+    size = len(user_ids)
+    full = (1 << size) - 1
+
+    subset_sum = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        low = mask & -mask
+        subset_sum[mask] = subset_sum[mask ^ low] + amounts[low.bit_length() - 1]
+
+    # best[mask] = most zero-sum subsets along a chain of removals ending at mask
+    best = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        value = max(best[mask ^ (1 << i)] for i in range(size) if mask >> i & 1)
+        best[mask] = value + (1 if subset_sum[mask] == 0 else 0)
+
+    # Walk the chain back down; the members removed between two zero-sum
+    # masks form one independently settleable subset.
+    transfers = []
+    mask, chunk_start = full, full
+    while mask:
+        for i in range(size):
+            if mask >> i & 1:
+                prev = mask ^ (1 << i)
+                if best[prev] + (1 if subset_sum[mask] == 0 else 0) == best[mask]:
+                    break
+        mask = prev
+        if subset_sum[mask] == 0:
+            chunk = chunk_start ^ mask
+            transfers.extend(greedy_transfers({
+                user_ids[i]: amounts[i] for i in range(size) if chunk >> i & 1
+            }))
+            chunk_start = mask
+    return transfers
+
+
+def plan_transfers(positions):
+    """Returns ``(method, transfers)`` for the given net positions"""
+    if len(positions) <= EXACT_SOLVER_LIMIT:
+        return 'exact', exact_transfers(positions)
+    return 'greedy', greedy_transfers(positions)
+
+
+# ============================================================================
+# PLANS AND CACHING
+# ============================================================================
+
+def cache_key(group_id):
+    return f'settle-plan:{group_id}'
+
+
+def build_plan(group):
+    positions = net_positions(group)
+    method, transfers = plan_transfers(positions)
+    users = User.objects.in_bulk(positions.keys())
+
+    def describe(user_id):
+        user = users[user_id]
+        return {'id': user.id, 'username': user.username, 'name': user.get_full_name() or user.username}
+
+    return {
+        'group_id': group.id,
+        'method': method,
+        'transfer_count': len(transfers),
+        'transfers': [
+            {
+                'from_user': describe(debtor_id),
+                'to_user': describe(creditor_id),
+                'amount': from_paise(amount),
+            }
+            for debtor_id, creditor_id, amount in transfers
+        ],
+        'positions': [
+            {'user_id': user_id, 'amount': from_paise(amount)}
+            for user_id, amount in sorted(positions.items(), key=lambda item: (-item[1], item[0]))
+        ],
+    }
+
+
+def get_plan(group):
+    """The group's settlement plan, from the cache when balances haven't changed"""
+    key = cache_key(group.id)
+    plan = cache.get(key)
+    if plan is None:
+        plan = build_plan(group)
+        cache.set(key, plan, CACHE_TIMEOUT)
+    return plan
+
+
+def invalidate(group_ids):
+    """Drop cached plans of groups whose balances change, once the write commits"""
+    keys = [cache_key(group_id) for group_id in set(group_ids) if group_id is not None]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
@@ -9,6 +9,8 @@ from .models import (
     Balance, ExpenseCategory, UserTotalBalance
 )
 from connections.models import Group, Profile
+from project import caching, events
+from . import ledger, search, settle_plan
 
 # ============================================================================
 # EXPENSE VALIDATION SIGNALS
@@ -33,106 +35,25 @@ def validate_expense_totals(sender, instance, created, **kwargs):
         if abs(total_owed - instance.total_amount) > Decimal('0.01'):
             print(f"Warning: Expense {instance.id} - Total owed (₹{total_owed}) doesn't match expense amount (₹{instance.total_amount})")
 
-@receiver(post_save, sender=Expense)
-def update_balances_on_expense(sender, instance, created, **kwargs):
-    """Update balances for all users when an expense is created or updated."""
-    if created or not created:
-        # Clear all balances for this expense (to avoid double counting)
-        for share in instance.shares.all():
-            for payment in instance.payments.all():
-                Balance.objects.update_balance(
-                    user1=share.user,
-                    user2=payment.payer,
-                    amount_change=-Balance.objects.get_balance_between_users(share.user, payment.payer, instance.group).balance_amount,
-                    group=instance.group
-                )
-        # Now recalculate net owed and update balances
-        total_amount = instance.total_amount
-        payments = list(instance.payments.all())
-        shares = list(instance.shares.all())
-        # Calculate total paid by each user
-        paid_by_user = {}
-        for payment in payments:
-            paid_by_user[payment.payer_id] = paid_by_user.get(payment.payer_id, Decimal('0')) + payment.amount_paid
-        for share in shares:
-            user = share.user
-            amount_owed = share.amount_owed
-            amount_paid = paid_by_user.get(user.id, Decimal('0'))
-            net_owed = amount_owed - amount_paid
-            if abs(net_owed) < Decimal('0.01'):
-                continue  # Settled
-            # Distribute net_owed to payers by their payment ratio
-            for payment in payments:
-                payer = payment.payer
-                if payer == user:
-                    continue  # Don't create balance with yourself
-                payer_ratio = payment.amount_paid / total_amount if total_amount else Decimal('0')
-                amount_owed_to_payer = net_owed * payer_ratio
-                Balance.objects.update_balance(
-                    user1=user,
-                    user2=payer,
-                    amount_change=amount_owed_to_payer,
-                    group=instance.group
-                )
-
 # ============================================================================
 # BALANCE UPDATE SIGNALS
 # ============================================================================
 
 @receiver(post_save, sender=Settlement)
 def update_balance_on_settlement(sender, instance, created, **kwargs):
-    """Update balances when a settlement is made"""
-    if created:
-        payer = instance.payer
-        payee = instance.payee
-        amount = instance.amount
-        
-        # Update balance - payer owes payee less money
-        Balance.objects.update_balance(
-            user1=payer,
-            user2=payee,
-            amount_change=-amount,  # Negative because debt is reduced
-            group=instance.group
-        )
-        
-        # Update related expense shares if specified
-        if instance.expense_shares.exists():
-            remaining_amount = amount
-            
-            for share in instance.expense_shares.all():
-                if remaining_amount <= 0:
-                    break
-                
-                # Calculate how much of this settlement applies to this share
-                settlement_for_share = min(
-                    remaining_amount, 
-                    share.amount_owed - share.amount_paid_back
-                )
-                
-                # Update the share's paid back amount
-                share.amount_paid_back += settlement_for_share
-                share.save()
-                
-                remaining_amount -= settlement_for_share
-        
-        print(f"Settlement: {payer.username} paid ₹{amount} to {payee.username}")
+    """Update balances when a settlement is created outside SettlementManager"""
+    if not created or ledger.is_suspended():
+        return
+    ledger.apply_deltas(ledger.settlement_deltas(instance))
+    print(f"Settlement: {instance.payer_id} paid ₹{instance.amount} to {instance.payee_id}")
 
 @receiver(post_delete, sender=Settlement)
 def reverse_balance_on_settlement_delete(sender, instance, **kwargs):
-    """Reverse balance changes when a settlement is deleted"""
-    payer = instance.payer
-    payee = instance.payee
-    amount = instance.amount
-    
-    # Reverse the balance change
-    Balance.objects.update_balance(
-        user1=payer,
-        user2=payee,
-        amount_change=amount,  # Positive to reverse the settlement
-        group=instance.group
-    )
-    
-    print(f"Reversed settlement: {payer.username} paid ₹{amount} to {payee.username}")
+    """Reverse balance changes when a settlement is deleted outside SettlementManager"""
+    if ledger.is_suspended():
+        return
+    ledger.apply_deltas(ledger.merge({}, ledger.settlement_deltas(instance), sign=-1))
+    print(f"Reversed settlement: {instance.payer_id} paid ₹{instance.amount} to {instance.payee_id}")
 
 # ============================================================================
 # EXPENSE SHARE SIGNALS
@@ -140,46 +61,24 @@ def reverse_balance_on_settlement_delete(sender, instance, **kwargs):
 
 @receiver(post_save, sender=ExpenseShare)
 def update_balance_on_expense_share_change(sender, instance, created, **kwargs):
-    """Update balances when expense shares are created or modified"""
+    """Update balances when an expense share is created outside the ledger"""
+    if not created or ledger.is_suspended():
+        return
     expense = instance.expense
-    share_user = instance.user
-    # ✅ Update balances for other users
-    if created:
-        for payment in expense.payments.all():
-            payer = payment.payer
-            if payer != share_user:  # Don't create balance with yourself
-                # Calculate how much this share_user owes this payer
-                payer_contribution_ratio = payment.amount_paid / expense.total_amount
-                amount_owed_to_payer = instance.amount_owed * payer_contribution_ratio
-                # Update balance
-                Balance.objects.update_balance(
-                    user1=share_user,
-                    user2=payer,
-                    amount_change=amount_owed_to_payer,
-                    group=expense.group
-                )
+    if expense.is_deleted:
+        return
+    ledger.apply_deltas(ledger.share_deltas(expense, instance, expense.payments.all()))
 
 @receiver(post_delete, sender=ExpenseShare)
 def reverse_balance_on_expense_share_delete(sender, instance, **kwargs):
-    """Reverse balance changes when an expense share is deleted"""
+    """Reverse balance changes when an expense share is deleted outside the ledger"""
+    if ledger.is_suspended():
+        return
     expense = instance.expense
-    share_user = instance.user
-    
-    # Reverse balance changes with all payers
-    for payment in expense.payments.all():
-        payer = payment.payer
-        
-        if payer != share_user:
-            payer_contribution_ratio = payment.amount_paid / expense.total_amount
-            amount_owed_to_payer = instance.amount_owed * payer_contribution_ratio
-            
-            # Reverse the balance
-            Balance.objects.update_balance(
-                user1=share_user,
-                user2=payer,
-                amount_change=-amount_owed_to_payer,  # Negative to reverse
-                group=expense.group
-            )
+    if expense.is_deleted:
+        return
+    deltas = ledger.share_deltas(expense, instance, expense.payments.all())
+    ledger.apply_deltas(ledger.merge({}, deltas, sign=-1))
 
 # ============================================================================
 # EXPENSE LIFECYCLE SIGNALS
@@ -192,6 +91,31 @@ def cleanup_on_expense_delete(sender, instance, **kwargs):
     # due to CASCADE, but their signals will handle balance reversals
     print(f"Expense deleted: {instance.description} - ₹{instance.total_amount}")
 
+# ============================================================================
+# SEARCH INDEX SIGNALS
+# ============================================================================
+
+@receiver(post_save, sender=Expense)
+def reindex_expense_on_save(sender, instance, **kwargs):
+    """Refresh the expense's search document once the transaction commits"""
+    search.mark_dirty(instance.id)
+
+@receiver(post_save, sender=ExpensePayment)
+@receiver(post_delete, sender=ExpensePayment)
+@receiver(post_save, sender=ExpenseShare)
+@receiver(post_delete, sender=ExpenseShare)
+def reindex_expense_on_participant_change(sender, instance, **kwargs):
+    """Payer and share holder usernames are part of the search document"""
+    search.mark_dirty(instance.expense_id)
+
+@receiver(post_save, sender=ExpenseCategory)
+def reindex_expenses_on_category_rename(sender, instance, created, **kwargs):
+    """Category names are part of the search document"""
+    if created:
+        return
+    for expense_id in instance.expense_set.values_list('id', flat=True):
+        search.mark_dirty(expense_id)
+
 # ============================================================================
 # GROUP MEMBERSHIP SIGNALS
 # ============================================================================
@@ -243,19 +167,46 @@ def cleanup_zero_balances(sender, instance, **kwargs):
 
 @receiver(post_save, sender=Balance)
 def update_user_total_balance_on_balance_change(sender, instance, **kwargs):
-    """Update UserTotalBalance whenever a Balance is created or updated."""
-    user1 = instance.user1
-    user2 = instance.user2
-    # Get all balances between these two users (across all groups)
-    from django.db.models import Q
-    balances = sender.objects.filter(
-        Q(user1=user1, user2=user2) | Q(user1=user2, user2=user1)
-    )
-    total = Decimal('0.00')
-    for bal in balances:
-        total += bal.get_balance_for_user(user1)
-    # Store the total balance (from user1's perspective)
-    UserTotalBalance.objects.update_total_balance(user1, user2, total - UserTotalBalance.objects.get_total_balance_between_users(user1, user2).total_balance)
+    """Queue the pair so its UserTotalBalance is re-synced once on commit"""
+    ledger.mark_pair_dirty(instance.user1_id, instance.user2_id)
+
+@receiver(post_save, sender=Balance)
+@receiver(post_delete, sender=Balance)
+def invalidate_settle_plan_on_balance_change(sender, instance, **kwargs):
+    """Cached settlement plans are only valid until the group's balances change"""
+    settle_plan.invalidate([instance.group_id])
+
+# ============================================================================
+# RESPONSE CACHE SIGNALS
+# ============================================================================
+
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+def invalidate_group_balances_on_expense_change(sender, instance, **kwargs):
+    """Expense edits and soft deletes change what the group's balance views show"""
+    caching.bump('group-balances', [instance.group_id])
+
+@receiver(post_save, sender=Balance)
+@receiver(post_delete, sender=Balance)
+def invalidate_balances_on_balance_change(sender, instance, **kwargs):
+    """Ledger bulk writes skip these signals and bump the same scopes themselves"""
+    caching.bump('balances', [instance.user1_id, instance.user2_id])
+    caching.bump('group-balances', [instance.group_id])
+
+@receiver(post_save, sender=ExpenseCategory)
+@receiver(post_delete, sender=ExpenseCategory)
+def invalidate_categories_on_change(sender, instance, **kwargs):
+    caching.bump('categories')
+
+# ============================================================================
+# PUSH EVENT SIGNALS
+# ============================================================================
+
+@receiver(post_save, sender=Expense)
+def publish_expense_added(sender, instance, created, **kwargs):
+    """Tell the other group members; balance_changed follows from the ledger"""
+    if created and instance.group_id:
+        notify_expenses_added(instance.group_id, [instance], instance.created_by_id)
 
 # ============================================================================
 # EXPENSE CATEGORY SIGNALS
@@ -272,71 +223,28 @@ def log_category_changes(sender, instance, created, **kwargs):
 # ============================================================================
 
 def recalculate_user_balances(user):
-    """Utility function to recalculate all balances for a user from scratch"""
+    """
+    Rebuild every balance involving a user from scratch.
+    This is an offline repair tool (see the rebuild_balances command);
+    regular expense writes go through the incremental ledger instead.
+    """
     print(f"Recalculating balances for {user.username}...")
-    
-    # Get all balances involving this user
-    user_balances = Balance.objects.filter(
-        models.Q(user1=user) | models.Q(user2=user)
-    )
-    
-    # Reset all balances to zero
-    user_balances.update(balance_amount=Decimal('0'))
-    
-    # Recalculate from all expense shares and payments
-    user_payments = ExpensePayment.objects.filter(payer=user, expense__is_deleted=False)
-    user_shares = ExpenseShare.objects.filter(user=user, expense__is_deleted=False)
-    
-    # Process each payment this user made
-    for payment in user_payments:
-        expense = payment.expense
-        for share in expense.shares.all():
-            if share.user != user:  # Don't create balance with self
-                payer_ratio = payment.amount_paid / expense.total_amount
-                amount_owed = share.amount_owed * payer_ratio
-                Balance.objects.update_balance(
-                    user1=share.user,
-                    user2=user,
-                    amount_change=amount_owed,
-                    group=expense.group
-                )
-
-    # Process each share this user owes (ensure balances for non-payers)
-    for share in user_shares:
-        expense = share.expense
-        for payment in expense.payments.all():
-            payer = payment.payer
-            if payer != user:  # Don't create balance with self
-                payer_ratio = payment.amount_paid / expense.total_amount
-                amount_owed = share.amount_owed * payer_ratio
-                Balance.objects.update_balance(
-                    user1=user,
-                    user2=payer,
-                    amount_change=-amount_owed,  # Negative because user owes payer
-                    group=expense.group
-                )
-    
-    # Subtract settlements
-    user_settlements_made = Settlement.objects.filter(payer=user)
-    for settlement in user_settlements_made:
-        Balance.objects.update_balance(
-            user1=user,
-            user2=settlement.payee,
-            amount_change=-settlement.amount,
-            group=settlement.group
-        )
-    
+    ledger.rebuild_balances(user=user)
     print(f"Balance recalculation complete for {user.username}")
 
-# ============================================================================
-# DEBUGGING SIGNALS (Remove in production)
-# ============================================================================
-
-@receiver(post_save, sender=Balance)
-def debug_balance_changes(sender, instance, created, **kwargs):
-    """Debug signal to track balance changes - remove in production"""
-    action = "Created" if created else "Updated"
-    print(f"[DEBUG] Balance {action}: {instance}")
+def notify_expenses_added(group_id, expenses, created_by_id):
+    """
+    Push an expense_added event to every member of the group except the
+    creator. Bulk inserts call this directly since they skip post_save.
+    """
+    member_ids = Group.members.through.objects.filter(group_id=group_id).exclude(
+        user_id=created_by_id
+    ).values_list('user_id', flat=True)
+    events.publish(member_ids, 'expense_added', {
+        'group_id': group_id,
+        'expense_ids': [str(expense.expense_id) for expense in expenses],
+        'created_by': created_by_id,
+    })
 
 # ============================================================================
 # SIGNAL REGISTRATION
@@ -0,0 +1,133 @@
+"""
+Materialized per-user balance summaries.
+
+UserBalanceSummary holds everything the home screen shows (what the user
+owes, what they are owed, per-friend and per-group balances) so it can be
+served with a single primary key read. Whenever the ledger writes balances
+it queues the users involved; their summaries are recomputed once, on
+commit, from UserTotalBalance and Balance with two queries and one upsert,
+and each refreshed user gets a ``balance_changed`` push event.
+"""
+
+import threading
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+
+from project import events
+from .models import Balance, UserTotalBalance, UserBalanceSummary
+
+TOP_COUNTERPARTIES = 5
+
+_state = threading.local()
+
+
+def _display_name(user):
+    return user.get_full_name() or user.username
+
+
+def build_summaries(user_ids):
+    """Unsaved UserBalanceSummary objects for ``user_ids``"""
+    user_ids = set(user_ids)
+    counterparties = {user_id: [] for user_id in user_ids}
+    groups = {user_id: {} for user_id in user_ids}
+
+    # UserTotalBalance.total_balance is positive when user2 owes user1
+    totals = UserTotalBalance.objects.filter(
+        Q(user1_id__in=user_ids) | Q(user2_id__in=user_ids)
+    ).exclude(total_balance=0).select_related('user1', 'user2')
+    for total in totals:
+        for user_id, other, amount in (
+            (total.user1_id, total.user2, total.total_balance),
+            (total.user2_id, total.user1, -total.total_balance),
+        ):
+            if user_id in counterparties:
+                counterparties[user_id].append({
+                    'user_id': other.id,
+                    'username': other.username,
+                    'name': _display_name(other),
+                    'amount': amount,
+                })
+
+    # Balance.balance_amount is positive when user1 owes user2
+    balances = Balance.objects.filter(
+        Q(user1_id__in=user_ids) | Q(user2_id__in=user_ids), group__isnull=False
+    ).exclude(balance_amount=0).values_list('user1_id', 'user2_id', 'group_id', 'group__name', 'balance_amount')
+    for user1_id, user2_id, group_id, group_name, amount in balances:
+        for user_id, signed in ((user1_id, -amount), (user2_id, amount)):
+            if user_id in groups:
+                entry = groups[user_id].setdefault(group_id, {'group_id': group_id, 'name': group_name, 'amount': Decimal('0')})
+                entry['amount'] += signed
+
+    summaries = []
+    for user_id in user_ids:
+        rows = counterparties[user_id]
+        you_are_owed = sum((row['amount'] for row in rows if row['amount'] > 0), Decimal('0'))
+        you_owe = -sum((row['amount'] for row in rows if row['amount'] < 0), Decimal('0'))
+        rows.sort(key=lambda row: (-abs(row['amount']), row['user_id']))
+        group_rows = sorted(
+            (entry for entry in groups[user_id].values() if entry['amount']),
+            key=lambda entry: (-abs(entry['amount']), entry['group_id'])
+        )
+        summaries.append(UserBalanceSummary(
+            user_id=user_id,
+            you_owe=you_owe,
+            you_are_owed=you_are_owed,
+            net_balance=you_are_owed - you_owe,
+            owe_count=sum(1 for row in rows if row['amount'] < 0),
+            owed_by_count=sum(1 for row in rows if row['amount'] > 0),
+            top_counterparties=[dict(row, amount=str(row['amount'])) for row in rows[:TOP_COUNTERPARTIES]],
+            groups=[dict(entry, amount=str(entry['amount'])) for entry in group_rows],
+        ))
+    return summaries
+
+
+def refresh_summaries(user_ids):
+    """Recompute and upsert the summaries of ``user_ids``; returns them"""
+    # Users queued by a transaction that was rolled back may not exist
+    user_ids = User.objects.filter(id__in=user_ids).values_list('id', flat=True)
+    summaries = build_summaries(user_ids)
+    UserBalanceSummary.objects.bulk_create(
+        summaries,
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['you_owe', 'you_are_owed', 'net_balance', 'owe_count', 'owed_by_count',
+                       'top_counterparties', 'groups', 'updated_at'],
+    )
+    return summaries
+
+
+def get_summary(user):
+    """The user's summary, computed on first use for users who have none yet"""
+    try:
+        return UserBalanceSummary.objects.get(user=user)
+    except UserBalanceSummary.DoesNotExist:
+        return refresh_summaries([user.id])[0]
+
+
+def mark_users_dirty(user_ids):
+    """
+    Queue users whose balances changed.
+    All users queued during a transaction are refreshed once, on commit.
+    """
+    pending = getattr(_state, 'dirty_users', None)
+    if pending is None:
+        pending = _state.dirty_users = set()
+    pending.update(user_ids)
+    transaction.on_commit(flush_dirty_users)
+
+
+def flush_dirty_users():
+    """Refresh the summary of every queued user and push it to them"""
+    pending = getattr(_state, 'dirty_users', None)
+    if not pending:
+        return
+    _state.dirty_users = set()
+    for summary in refresh_summaries(pending):
+        events.publish([summary.user_id], 'balance_changed', {
+            'you_owe': summary.you_owe,
+            'you_are_owed': summary.you_are_owed,
+            'net_balance': summary.net_balance,
+        })
@@ -1,7 +1,7 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.contrib.auth.models import User
 from decimal import Decimal
-from .models import Expense, ExpensePayment, ExpenseShare, Balance
+from .models import Expense, ExpensePayment, ExpenseShare, Balance, UserTotalBalance
 from django.utils import timezone
 
 class ExpenseDeleteTests(TestCase):
@@ -99,3 +99,624 @@ class ExpenseDeleteTests(TestCase):
         # Balance should be zero after recalculation since expense is deleted
         balance = Balance.objects.get_balance_between_users(self.user1, self.user2)
         self.assertEqual(balance.balance_amount, Decimal('0.00'))
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        from rest_framework.test import APIClient
+        from connections.models import Group
+
+        self.user1 = User.objects.create_user('user1', 'user1@test.com', 'pass123')
+        self.user2 = User.objects.create_user('user2', 'user2@test.com', 'pass123')
+        self.user3 = User.objects.create_user('user3', 'user3@test.com', 'pass123')
+        self.group = Group.objects.create(name='Trip', created_by=self.user1)
+        self.group.members.add(self.user1, self.user2, self.user3)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user1)
+
+    def add_expense(self, **overrides):
+        data = {
+            'description': 'Dinner',
+            'total_amount': '90.00',
+            'payments': [
+                {'payer_id': self.user1.id, 'amount_paid': '60.00'},
+                {'payer_id': self.user2.id, 'amount_paid': '30.00'},
+            ],
+            'user_ids': [self.user1.id, self.user2.id, self.user3.id],
+            'group_id': self.group.id,
+        }
+        data.update(overrides)
+        # Run on-commit work (search indexing) as a real request would
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/expenses/add/', data, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return Expense.objects.get(expense_id=response.data['expense_id'])
+
+    def balance(self, a, b):
+        """Amount ``a`` owes ``b`` inside the test group"""
+        balance = Balance.objects.get_balance_between_users(a, b, self.group)
+        return balance.balance_amount if a.id < b.id else -balance.balance_amount
+
+    def test_add_expense_applies_only_its_delta(self):
+        self.add_expense()
+        # user3 owes 30 split 2:1 between the payers, user2 paid 30 but owes 20 to user1
+        self.assertEqual(self.balance(self.user3, self.user1), Decimal('20.00'))
+        self.assertEqual(self.balance(self.user3, self.user2), Decimal('10.00'))
+        self.assertEqual(self.balance(self.user2, self.user1), Decimal('10.00'))
+
+        total = UserTotalBalance.objects.get_total_balance_between_users(self.user1, self.user3)
+        self.assertEqual(total.total_balance, Decimal('20.00'))
+
+        self.add_expense()
+        self.assertEqual(self.balance(self.user3, self.user1), Decimal('40.00'))
+
+    def test_delete_reverses_expense(self):
+        first = self.add_expense()
+        self.add_expense(total_amount='30.00', payments=[{'payer_id': self.user3.id, 'amount_paid': '30.00'}])
+
+        response = self.client.delete(f'/api/expenses/delete-expense/?expense_id={first.expense_id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.balance(self.user1, self.user3), Decimal('10.00'))
+        self.assertEqual(self.balance(self.user2, self.user1), Decimal('0.00'))
+
+        # Deleting again must not reverse twice
+        self.client.delete(f'/api/expenses/delete-expense/?expense_id={first.expense_id}')
+        self.assertEqual(self.balance(self.user1, self.user3), Decimal('10.00'))
+
+    def test_racing_deletes_and_edits_apply_once(self):
+        from unittest import mock
+
+        expense = self.add_expense()
+        url = f'/api/expenses/delete-expense/?expense_id={expense.expense_id}'
+        # Requests that loaded the expense before the first delete committed
+        stale = Expense.objects.get(pk=expense.pk)
+        self.assertEqual(self.client.delete(url).status_code, 200)
+        with mock.patch.object(Expense.objects, 'get', return_value=stale):
+            self.assertEqual(self.client.delete(url).status_code, 200)
+            response = self.client.put('/api/expenses/edit/', {
+                'expense_id': str(expense.expense_id), 'total_amount': '30.00',
+            }, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.balance(self.user3, self.user1), Decimal('0.00'))
+        self.assertEqual(self.balance(self.user2, self.user1), Decimal('0.00'))
+
+    def test_edit_applies_difference(self):
+        expense = self.add_expense()
+        response = self.client.put('/api/expenses/edit/', {
+            'expense_id': str(expense.expense_id),
+            'payments': [{'payer_id': self.user1.id, 'amount_paid': '90.00'}],
+            'user_ids': [self.user1.id, self.user3.id],
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.balance(self.user3, self.user1), Decimal('45.00'))
+        self.assertEqual(self.balance(self.user2, self.user1), Decimal('0.00'))
+        self.assertEqual(self.balance(self.user3, self.user2), Decimal('0.00'))
+
+    def test_recalculate_matches_incremental(self):
+        from .signals import recalculate_user_balances
+
+        self.add_expense()
+        self.add_expense(total_amount='30.00', payments=[{'payer_id': self.user3.id, 'amount_paid': '30.00'}])
+        incremental = {
+            (b.user1_id, b.user2_id): b.balance_amount for b in Balance.objects.filter(group=self.group)
+        }
+        for user in (self.user1, self.user2, self.user3):
+            recalculate_user_balances(user)
+        rebuilt = {
+            (b.user1_id, b.user2_id): b.balance_amount for b in Balance.objects.filter(group=self.group)
+        }
+        self.assertEqual(incremental, rebuilt)
+
+    def test_duplicate_user_ids_are_reported(self):
+        response = self.client.post('/api/expenses/add/', {
+            'description': 'Dinner',
+            'total_amount': '90.00',
+            'payments': [{'payer_id': self.user1.id, 'amount_paid': '90.00'}],
+            'user_ids': [self.user1.id, self.user2.id, self.user2.id],
+            'group_id': self.group.id,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(f'Duplicate user IDs in user_ids: [{self.user2.id}]', str(response.data))
+
+    def test_rebuild_matches_incremental_on_uneven_split(self):
+        from .ledger import rebuild_balances
+
+        # 33.34 x 10.00 / 100.01 is 3.3336..., rounded to 3.33 per expense
+        payments = [
+            {'payer_id': self.user1.id, 'amount_paid': '10.00'},
+            {'payer_id': self.user2.id, 'amount_paid': '90.01'},
+        ]
+        for _ in range(2):
+            self.add_expense(total_amount='100.01', payments=payments)
+        self.assertEqual(self.balance(self.user3, self.user1), Decimal('6.66'))
+        incremental = {
+            (b.user1_id, b.user2_id): b.balance_amount for b in Balance.objects.filter(group=self.group)
+        }
+        rebuild_balances(group=self.group)
+        rebuilt = {
+            (b.user1_id, b.user2_id): b.balance_amount for b in Balance.objects.filter(group=self.group)
+        }
+        self.assertEqual(incremental, rebuilt)
+
+    def test_ledger_handles_more_than_a_thousand_pairs(self):
+        from itertools import combinations
+        from .ledger import apply_deltas, rebuild_balances
+
+        users = User.objects.bulk_create(User(username=f'bulk{i}') for i in range(50))
+        keys = [(a.id, b.id, self.group.id) for a, b in combinations(users, 2)]
+        self.assertGreater(len(keys), 1000)
+        # First pass inserts every row, the second updates them all
+        apply_deltas({key: Decimal('1.00') for key in keys})
+        apply_deltas({key: Decimal('2.00') for key in keys})
+        self.assertEqual(Balance.objects.filter(group=self.group, balance_amount=Decimal('3.00')).count(), len(keys))
+        self.assertEqual(UserTotalBalance.objects.filter(total_balance=Decimal('-3.00')).count(), len(keys))
+
+        # No expenses back these balances, so a rebuild zeroes every pair
+        stats = rebuild_balances(group=self.group)
+        self.assertEqual(stats['totals_updated'], len(keys))
+        self.assertFalse(UserTotalBalance.objects.exclude(total_balance=0).exists())
+
+    def test_friend_feed_validates_page_size(self):
+        self.add_expense()
+        url = '/api/expenses/expenses-with-friend/'
+        response = self.client.get(url, {'user_id': self.user2.id, 'page_size': 'ten'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(url, {'user_id': self.user2.id, 'page_size': 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['pagination']['page_size'], 1)
+        self.assertEqual(len(response.data['expenses']), 1)
+
+    def test_group_feed_validates_page_size(self):
+        self.add_expense()
+        self.add_expense()
+        url = '/api/expenses/group-expenses/'
+        for params in ({'cursor': ''}, {}):
+            response = self.client.get(url, {'group_id': self.group.id, 'page_size': 'ten', **params})
+            self.assertEqual(response.status_code, 400)
+            response = self.client.get(url, {'group_id': self.group.id, 'page_size': 0, **params})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['pagination']['page_size'], 1)
+            self.assertEqual(len(response.data['expenses']), 1)
+            self.assertIsNotNone(response.data['pagination']['next_cursor'])
+
+    def test_rebuild_balances_command_repairs_drift(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        self.add_expense()
+        Balance.objects.filter(group=self.group).update(balance_amount=Decimal('999.00'))
+        UserTotalBalance.objects.update(total_balance=Decimal('0.00'))
+
+        out = StringIO()
+        call_command('rebuild_balances', '--group', str(self.group.id), stdout=out)
+        self.assertIn('Balances rebuilt in', out.getvalue())
+        self.assertEqual(self.balance(self.user3, self.user1), Decimal('20.00'))
+        self.assertEqual(self.balance(self.user2, self.user1), Decimal('10.00'))
+        total = UserTotalBalance.objects.get_total_balance_between_users(self.user1, self.user3)
+        self.assertEqual(total.total_balance, Decimal('20.00'))
+
+        Balance.objects.all().delete()
+        call_command('rebuild_balances', '--all', stdout=StringIO())
+        self.assertEqual(self.balance(self.user3, self.user2), Decimal('10.00'))
+
+    def test_balance_saves_sync_totals_once_on_commit(self):
+        self.add_expense()
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            Balance.objects.update_balance(self.user3, self.user1, Decimal('-5.00'), group=self.group)
+            Balance.objects.update_balance(self.user3, self.user1, Decimal('-5.00'), group=self.group)
+        # Totals are untouched until the transaction commits
+        total = UserTotalBalance.objects.get_total_balance_between_users(self.user1, self.user3)
+        self.assertEqual(total.total_balance, Decimal('20.00'))
+
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            for callback in callbacks:
+                callback()
+        # One aggregate over Balance and one UserTotalBalance write for the pair
+        sql = [q['sql'] for q in queries.captured_queries]
+        self.assertEqual(sum('FROM "expense_balance"' in q for q in sql), 1)
+        self.assertEqual(sum(q.startswith('UPDATE "expense_usertotalbalance"') for q in sql), 1)
+        total.refresh_from_db()
+        self.assertEqual(total.total_balance, Decimal('10.00'))
+
+    def test_add_expense_query_count_is_constant(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from connections.models import Group
+
+        def count_queries(size):
+            members = [
+                User.objects.create_user(f'g{size}_{i}', f'g{size}_{i}@test.com', 'pass123')
+                for i in range(size)
+            ]
+            group = Group.objects.create(name=f'Group of {size}', created_by=members[0])
+            group.members.add(*members)
+            self.client.force_authenticate(members[0])
+            with CaptureQueriesContext(connection) as queries:
+                self.add_expense(
+                    group_id=group.id,
+                    user_ids=[m.id for m in members],
+                    payments=[
+                        {'payer_id': members[0].id, 'amount_paid': '50.00'},
+                        {'payer_id': members[1].id, 'amount_paid': '40.00'},
+                    ],
+                )
+            return len(queries)
+
+        self.assertEqual(count_queries(3), count_queries(20))
+
+    def test_batch_add_expenses(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        item = {
+            'description': 'Taxi',
+            'total_amount': '30.00',
+            'payments': [{'payer_id': self.user1.id, 'amount_paid': '30.00'}],
+            'user_ids': [self.user1.id, self.user2.id, self.user3.id],
+            'group_id': self.group.id,
+        }
+        invalid = dict(item, user_ids=[self.user2.id, self.user3.id])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/expenses/batch-add/', {
+                'expenses': [item] * 10 + [invalid]
+            }, format='json')
+        self.assertEqual(response.status_code, 207, response.data)
+        self.assertEqual(response.data['created_count'], 10)
+        self.assertEqual(response.data['results'][10]['status'], 'invalid')
+        self.assertEqual(Expense.objects.filter(group=self.group).count(), 10)
+        self.assertEqual(self.balance(self.user2, self.user1), Decimal('100.00'))
+        self.assertEqual(self.balance(self.user3, self.user1), Decimal('100.00'))
+        # The group is loaded once no matter how many items reference it
+        group_lookups = [q for q in queries.captured_queries if 'FROM "connections_group" ' in q['sql']]
+        self.assertEqual(len(group_lookups), 1)
+
+    def test_group_expenses_query_count_is_constant(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        for _ in range(12):
+            self.add_expense()
+
+        def count_queries(page_size, **params):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/expenses/group-expenses/', {
+                    'group_id': self.group.id, 'page_size': page_size, **params
+                })
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['expenses']), page_size)
+            return len(queries)
+
+        self.assertEqual(count_queries(2), count_queries(12))
+        count_queries(2, search='user')  # warm up one-time search backend detection
+        self.assertEqual(count_queries(2, search='user'), count_queries(12, search='user'))
+
+        expense = self.client.get('/api/expenses/group-expenses/', {'group_id': self.group.id}).data['expenses'][0]
+        self.assertTrue(expense['is_user_expense'])
+        self.assertEqual(expense['payer_name'], 'user1')
+        self.assertEqual(len(expense['owed_breakdown']), 3)
+
+    def test_group_expenses_cursor_pagination(self):
+        for _ in range(5):
+            self.add_expense()
+        # Same timestamp on every row so the ID tie-breaker is exercised
+        Expense.objects.filter(group=self.group).update(date=timezone.now())
+        expected = list(
+            Expense.objects.filter(group=self.group).order_by('-id').values_list('expense_id', flat=True)
+        )
+
+        seen, cursor = [], ''
+        while cursor is not None:
+            response = self.client.get('/api/expenses/group-expenses/', {
+                'group_id': self.group.id, 'page_size': 2, 'cursor': cursor
+            })
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('total_count', response.data['pagination'])
+            seen.extend(e['id'] for e in response.data['expenses'])
+            cursor = response.data['pagination']['next_cursor']
+        self.assertEqual(seen, expected)
+
+        # Legacy page mode keeps its fields and also hands out a cursor
+        pagination = self.client.get('/api/expenses/group-expenses/', {
+            'group_id': self.group.id, 'page_size': 2, 'page': 1
+        }).data['pagination']
+        self.assertEqual(pagination['total_count'], 5)
+        self.assertEqual(pagination['total_pages'], 3)
+        self.assertTrue(pagination['has_next'])
+        self.assertIsNotNone(pagination['next_cursor'])
+
+        response = self.client.get('/api/expenses/group-expenses/', {
+            'group_id': self.group.id, 'cursor': 'not-a-cursor'
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_group_expenses_search_uses_index(self):
+        from .models import ExpenseSearchDocument, ExpenseCategory
+
+        category = ExpenseCategory.objects.create(name='Groceries')
+        taxi = self.add_expense(description='Airport taxi', notes='Late flight')
+        self.add_expense(description='Groceries run', category_id=category.id)
+        dinner = self.add_expense(description='Dinner', total_amount='123.45', payments=[
+            {'payer_id': self.user3.id, 'amount_paid': '123.45'}
+        ])
+        self.assertEqual(ExpenseSearchDocument.objects.filter(group=self.group).count(), 3)
+
+        def search(query, **params):
+            response = self.client.get('/api/expenses/group-expenses/', {
+                'group_id': self.group.id, 'search': query, **params
+            })
+            self.assertEqual(response.status_code, 200)
+            return response.data
+
+        self.assertEqual([e['id'] for e in search('TAXI')['expenses']], [taxi.expense_id])
+        self.assertEqual([e['id'] for e in search('flight')['expenses']], [taxi.expense_id])
+        self.assertEqual([e['id'] for e in search('123.4')['expenses']], [dinner.expense_id])
+        self.assertEqual(len(search('grocer')['expenses']), 1)
+        self.assertEqual(len(search('user3')['expenses']), 3)
+        self.assertEqual(search('nothing like this')['expenses'], [])
+
+        data = search('taxi', search_mode='chat')
+        self.assertEqual(data['expense_ids'], [taxi.expense_id])
+        self.assertEqual(data['expenses'][0]['payer_name'], 'user1')
+
+        # Edits and deletes are reflected once they commit
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put('/api/expenses/edit/', {
+                'expense_id': str(taxi.expense_id), 'description': 'Train'
+            }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(search('taxi')['expenses'], [])
+        self.assertEqual(len(search('train')['expenses']), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/expenses/delete-expense/?expense_id={dinner.expense_id}')
+        self.assertEqual(search('123.45')['expenses'], [])
+
+    def test_friend_expenses_query_count_is_constant(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        for _ in range(12):
+            self.add_expense()
+
+        def fetch(page_size, **params):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/expenses/expenses-with-friend/', {
+                    'user_id': self.user2.id, 'page_size': page_size, **params
+                })
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['expenses']), page_size)
+            return response.data, len(queries)
+
+        small, small_count = fetch(2)
+        large, large_count = fetch(12)
+        self.assertEqual(small_count, large_count)
+
+        expense = large['expenses'][0]
+        self.assertEqual(expense['you_owe'], Decimal('30.00'))
+        self.assertEqual(expense['payer_id'], self.user1.id)
+        self.assertTrue(expense['is_user_expense'])
+        self.assertEqual([row['user_id'] for row in expense['owed_breakdown']], [self.user2.id, self.user3.id])
+        self.assertEqual(large['balance']['other_user_id'], self.user2.id)
+
+        lite, _ = fetch(2, fields='lite')
+        self.assertNotIn('owed_breakdown', lite['expenses'][0])
+        self.assertEqual(lite['expenses'][0]['you_owe'], Decimal('30.00'))
+
+    def test_balance_summary_is_maintained_by_ledger(self):
+        from .models import UserBalanceSummary
+
+        expense = self.add_expense()
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/expenses/summary/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['you_are_owed'], '30.00')
+        self.assertEqual(response.data['you_owe'], '0.00')
+        self.assertEqual(response.data['owed_by_count'], 2)
+        self.assertEqual(response.data['top_counterparties'][0]['user_id'], self.user3.id)
+        self.assertEqual(response.data['top_counterparties'][0]['amount'], '20.00')
+        self.assertEqual(response.data['groups'], [{'group_id': self.group.id, 'name': 'Trip', 'amount': '30.00'}])
+
+        summary = UserBalanceSummary.objects.get(user=self.user3)
+        self.assertEqual(summary.you_owe, Decimal('30.00'))
+        self.assertEqual(summary.net_balance, Decimal('-30.00'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/expenses/delete-expense/?expense_id={expense.expense_id}')
+        summary.refresh_from_db()
+        self.assertEqual(summary.you_owe, Decimal('0.00'))
+        self.assertEqual(summary.top_counterparties, [])
+
+    def test_group_settle_plan(self):
+        self.add_expense()
+        response = self.client.get('/api/expenses/group-settle-plan/', {'group_id': self.group.id})
+        self.assertEqual(response.status_code, 200)
+        # user2 owes user1 10 and user3 owes user1 20, user2 10: user3 pays
+        # user1 30 and user2 is already even
+        self.assertEqual(response.data['method'], 'exact')
+        self.assertEqual(
+            [(t['from_user']['id'], t['to_user']['id'], t['amount']) for t in response.data['transfers']],
+            [(self.user3.id, self.user1.id, '30.00')]
+        )
+
+        # Served from the cache until the group's balances change
+        with self.assertNumQueries(2):
+            self.client.get('/api/expenses/group-settle-plan/', {'group_id': self.group.id})
+        self.add_expense(total_amount='30.00', payments=[{'payer_id': self.user3.id, 'amount_paid': '30.00'}])
+        response = self.client.get('/api/expenses/group-settle-plan/', {'group_id': self.group.id})
+        # user1 is now owed 20, by user2 and user3 equally
+        self.assertEqual(
+            sorted((t['from_user']['id'], t['amount']) for t in response.data['transfers']),
+            [(self.user2.id, '10.00'), (self.user3.id, '10.00')]
+        )
+
+    @override_settings(RESPONSE_CACHE_ENABLED=True)
+    def test_balance_lists_answer_conditional_gets(self):
+        self.add_expense()
+        urls = [
+            ('/api/expenses/user-total-balances/', {}),
+            ('/api/expenses/group-balances/', {'group_id': self.group.id}),
+        ]
+        etags = []
+        for url, params in urls:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            etags.append(response['ETag'])
+            # A matching If-None-Match skips the view: no queries, no body
+            with self.assertNumQueries(0):
+                response = self.client.get(url, params, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+
+        self.add_expense(total_amount='30.00', payments=[{'payer_id': self.user3.id, 'amount_paid': '30.00'}])
+        for (url, params), etag in zip(urls, etags):
+            response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+
+    def test_settlement_allocates_oldest_first_and_undoes(self):
+        from datetime import timedelta
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .models import Settlement
+
+        paid_by_user1 = [{'payer_id': self.user1.id, 'amount_paid': '90.00'}]
+        expenses = [self.add_expense(payments=paid_by_user1) for _ in range(3)]
+        for days, expense in enumerate(expenses):
+            Expense.objects.filter(id=expense.id).update(date=timezone.now() - timedelta(days=10 - days))
+        self.assertEqual(self.balance(self.user2, self.user1), Decimal('90.00'))
+
+        self.client.force_authenticate(self.user2)
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/expenses/settlements/add/', {
+                'payee_id': self.user1.id, 'amount': '45.00', 'group_id': self.group.id, 'settlement_method': 'upi'
+            }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['settlement']['allocated_amount'], Decimal('45.00'))
+        share_updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE "expense_expenseshare"')]
+        self.assertEqual(len(share_updates), 1)
+
+        paid_back = [
+            ExpenseShare.objects.get(expense=expense, user=self.user2).amount_paid_back for expense in expenses
+        ]
+        self.assertEqual(paid_back, [Decimal('30.00'), Decimal('15.00'), Decimal('0.00')])
+        self.assertEqual(self.balance(self.user2, self.user1), Decimal('45.00'))
+
+        listed = self.client.get('/api/expenses/settlements/', {'user_id': self.user1.id}).data
+        self.assertEqual(len(listed['settlements']), 1)
+        for page_size in ('abc', '0', '-5'):
+            response = self.client.get('/api/expenses/settlements/', {'page_size': page_size})
+            self.assertEqual(response.status_code, 400 if page_size == 'abc' else 200)
+        self.assertEqual(response.data['pagination']['page_size'], 1)
+        self.assertIsNone(response.data['pagination']['next_cursor'])
+        settlement_id = listed['settlements'][0]['settlement_id']
+
+        self.client.force_authenticate(self.user3)
+        response = self.client.post('/api/expenses/settlements/undo/', {'settlement_id': settlement_id}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_authenticate(self.user1)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/expenses/settlements/undo/', {'settlement_id': settlement_id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Settlement.objects.exists())
+        self.assertFalse(ExpenseShare.objects.filter(user=self.user2, amount_paid_back__gt=0).exists())
+        self.assertEqual(self.balance(self.user2, self.user1), Decimal('90.00'))
+
+    def test_settlement_allocates_only_the_payees_part_of_a_share(self):
+        # user1 paid 60 and user3 paid 30: user2's 30 share owes user1 20 and user3 10
+        self.add_expense(payments=[
+            {'payer_id': self.user1.id, 'amount_paid': '60.00'},
+            {'payer_id': self.user3.id, 'amount_paid': '30.00'},
+        ])
+        share = ExpenseShare.objects.get(user=self.user2)
+
+        self.client.force_authenticate(self.user2)
+        for payee, amount, allocated in [(self.user1, '30.00', '20.00'), (self.user3, '10.00', '10.00')]:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/expenses/settlements/add/', {
+                    'payee_id': payee.id, 'amount': amount, 'group_id': self.group.id, 'settlement_method': 'upi'
+                }, format='json')
+            self.assertEqual(response.status_code, 201, response.data)
+            self.assertEqual(response.data['settlement']['allocated_amount'], Decimal(allocated))
+
+        share.refresh_from_db()
+        self.assertEqual(share.amount_paid_back, Decimal('30.00'))
+        self.assertEqual(share.settlement_allocations.count(), 2)
+
+class SettlePlanSolverTests(TestCase):
+    def assertSettles(self, positions, transfers):
+        remaining = dict(positions)
+        for debtor_id, creditor_id, amount in transfers:
+            self.assertGreater(amount, 0)
+            remaining[debtor_id] += amount
+            remaining[creditor_id] -= amount
+        self.assertFalse(any(remaining.values()))
+
+    def test_exact_solver_finds_fewer_transfers_than_greedy(self):
+        from .settle_plan import exact_transfers, greedy_transfers
+
+        positions = {1: 900, 2: -800, 3: -900, 4: -600, 5: -300, 6: 1700}
+        exact = exact_transfers(positions)
+        greedy = greedy_transfers(positions)
+        self.assertSettles(positions, exact)
+        self.assertSettles(positions, greedy)
+        self.assertEqual(len(exact), 4)
+        self.assertEqual(len(greedy), 5)
+
+    def test_large_groups_use_greedy_solver(self):
+        import random
+        from .settle_plan import plan_transfers
+
+        rng = random.Random(7)
+        positions = {user_id: rng.randint(-100000, 100000) for user_id in range(1, 500)}
+        positions[500] = -sum(positions.values())
+        method, transfers = plan_transfers(positions)
+        self.assertEqual(method, 'greedy')
+        self.assertLess(len(transfers), 500)
+        self.assertSettles(positions, transfers)
+
+
+
+class BenchCommandTests(TestCase):
+    def test_bench_reports_every_scenario(self):
+        import json
+        from io import StringIO
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command(
+            'bench', '--use-current-db', '--users', '12', '--groups', '3', '--group-size', '4',
+            '--expenses', '40', '--iterations', '2', stdout=out, stderr=StringIO()
+        )
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['dataset']['expenses'], 40)
+        self.assertEqual(set(report['results']), {
+            'add_expense', 'group_expenses', 'expenses_and_balance_with_friend',
+            'list_user_total_balances', 'recalculate_user_balances', 'friends_list',
+            'profile_list_all', 'profile_list_others',
+        })
+        for result in report['results'].values():
+            self.assertGreater(result['queries_p50'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+
+
+class AutocommitLedgerTests(TransactionTestCase):
+    """Signal-driven ledger writes outside any transaction"""
+
+    def setUp(self):
+        self.user1 = User.objects.create_user('user1', 'user1@test.com', 'pass123')
+        self.user2 = User.objects.create_user('user2', 'user2@test.com', 'pass123')
+        self.expense = Expense.objects.create(
+            description='Dinner', total_amount=Decimal('100.00'), created_by=self.user1, date=timezone.now()
+        )
+        ExpensePayment.objects.create(expense=self.expense, payer=self.user1, amount_paid=Decimal('100.00'))
+
+    def test_share_saved_in_autocommit_updates_summary(self):
+        from .summaries import get_summary
+
+        ExpenseShare.objects.create(expense=self.expense, user=self.user2, amount_owed=Decimal('50.00'))
+        self.assertEqual(get_summary(self.user2).you_owe, Decimal('50.00'))
+        self.assertEqual(get_summary(self.user1).you_are_owed, Decimal('50.00'))
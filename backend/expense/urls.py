@@ -1,16 +1,23 @@
 from django.urls import path
-from .views import add_expense, list_expense_categories, add_friend_expense, list_user_total_balances, expenses_and_balance_with_friend, group_member_balances, group_expenses, delete_expense, edit_expense
+from project.asyncapi import serve
+from .views import add_expense, batch_add_expenses, list_expense_categories, add_friend_expense, list_user_total_balances, list_user_total_balances_async, balance_summary, expenses_and_balance_with_friend, group_member_balances, group_settle_plan, group_expenses, delete_expense, edit_expense, create_settlement, list_settlements, undo_settlement
 
 app_name = 'expense'
  
 urlpatterns = [
     path('add/', add_expense, name='add-expense'),
+    path('batch-add/', batch_add_expenses, name='batch-add-expenses'),
     path('categories/', list_expense_categories, name='expense-categories'),
     path('add-friend/', add_friend_expense, name='add-friend-expense'),
-    path('user-total-balances/', list_user_total_balances, name='list-user-total-balances'),
+    path('user-total-balances/', serve(list_user_total_balances, list_user_total_balances_async), name='list-user-total-balances'),
+    path('summary/', balance_summary, name='balance-summary'),
     path('expenses-with-friend/', expenses_and_balance_with_friend, name='expenses-and-balance-with-friend'),
     path('group-balances/', group_member_balances, name='group-member-balances'),
+    path('group-settle-plan/', group_settle_plan, name='group-settle-plan'),
     path('group-expenses/', group_expenses, name='group-expenses'),
     path('delete-expense/', delete_expense, name='delete-expense'),
     path('edit/', edit_expense, name='edit-expense'),
+    path('settlements/', list_settlements, name='list-settlements'),
+    path('settlements/add/', create_settlement, name='create-settlement'),
+    path('settlements/undo/', undo_settlement, name='undo-settlement'),
 ] 
\ No newline at end of file
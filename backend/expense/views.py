@@ -5,14 +5,80 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from django.contrib.auth.models import User
 from decimal import Decimal
-from .models import Expense, ExpensePayment, ExpenseShare, ExpenseCategory, UserTotalBalance, Balance
-from .serializers import AddExpenseSerializer, UserSerializer, AddFriendExpenseSerializer, UserTotalBalanceSerializer, ExpenseListSerializer, BalanceSerializer, EditExpenseSerializer
-from connections.models import Group
-from django.db import models
-from django.db.models import Q
+from .models import Expense, ExpensePayment, ExpenseShare, ExpenseCategory, UserTotalBalance, Balance, Settlement, SettlementAllocation
+from .serializers import AddExpenseSerializer, BatchAddExpenseSerializer, UserSerializer, AddFriendExpenseSerializer, UserTotalBalanceSerializer, UserBalanceSummarySerializer, ExpenseListSerializer, ExpenseListLiteSerializer, BalanceSerializer, EditExpenseSerializer, CreateSettlementSerializer, SettlementSerializer
+from connections.models import Group, Profile
+from . import ledger, search, settle_plan, summaries
+from .pagination import FEED_ORDERING, InvalidCursor, encode_cursor, paginate_by_cursor
+from django.db import models, transaction
+from django.db.models import Q, Exists, OuterRef, Prefetch, Subquery, Sum, Value
+from django.core.exceptions import ValidationError
+from django.db.models.functions import Coalesce
+from project.asyncapi import async_api_view, json_response
+from project.caching import async_cached_response, cached_response, conditional_response
+
+MAX_SETTLEMENTS_PAGE_SIZE = 100
+MAX_FEED_PAGE_SIZE = 100
+
+
+def with_expense_details(expenses, user):
+    """
+    Load everything an expense feed renders in a constant number of queries:
+    category, payments and shares with their users' profiles, plus
+    whether ``user`` paid for each expense and who paid first.
+    """
+    return expenses.select_related('category').prefetch_related(
+        Prefetch(
+            'payments',
+            queryset=ExpensePayment.objects.select_related('payer__profile').order_by('id')
+        ),
+        Prefetch(
+            'shares',
+            queryset=ExpenseShare.objects.select_related('user__profile').order_by('id')
+        ),
+    ).annotate(
+        is_user_expense=Exists(
+            ExpensePayment.objects.filter(expense=OuterRef('pk'), payer=user)
+        ),
+        first_payer_id=Subquery(
+            ExpensePayment.objects.filter(expense=OuterRef('pk')).order_by('id').values('payer_id')[:1]
+        ),
+    )
+
+def with_list_details(expenses, user):
+    """
+    Prepare expenses for ExpenseListSerializer: group, category, payments and
+    shares loaded up front and what ``user`` owes on each annotated as ``you_owe``.
+    """
+    return expenses.select_related('category', 'group').prefetch_related(
+        Prefetch(
+            'payments',
+            queryset=ExpensePayment.objects.select_related('payer__profile').order_by('id')
+        ),
+        Prefetch(
+            'shares',
+            queryset=ExpenseShare.objects.select_related('user__profile').order_by('id')
+        ),
+    ).annotate(
+        you_owe=Coalesce(
+            Subquery(
+                ExpenseShare.objects.filter(expense=OuterRef('pk'), user=user).values('amount_owed')[:1]
+            ),
+            Value(Decimal('0')),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2)
+        ),
+    )
+
+def _profile_picture(user):
+    """Profile picture URL of a user whose profile was loaded with select_related"""
+    try:
+        return user.profile.profile_picture_url
+    except Profile.DoesNotExist:
+        return ''
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@cached_response(lambda request: [('categories', None)], per_user=False)
 def list_expense_categories(request):
     """
     List all active expense categories
@@ -44,13 +110,12 @@ def add_expense(request):
     if serializer.is_valid():
         try:
             expense = serializer.save()
-            user_ids = serializer.validated_data['user_ids']
-            group_id = serializer.validated_data['group_id']
             split_type = serializer.validated_data.get('split_type', 'equal')
-            users = User.objects.filter(id__in=user_ids)
-            group = Group.objects.get(id=group_id)
+            user_map = serializer.validated_data['user_map']
+            users = list(user_map.values())
+            group = serializer.validated_data['group']
             total_amount = serializer.validated_data['total_amount']
-            splits = request.data.get('splits')
+            splits = serializer.validated_data.get('splits')
             payments = serializer.validated_data['payments']
             response_users = []
             if split_type == 'equal':
@@ -65,7 +130,7 @@ def add_expense(request):
                     })
             elif split_type == 'percentage' and splits:
                 for s in splits:
-                    share_user = User.objects.get(id=s['user_id'])
+                    share_user = user_map[int(s['user_id'])]
                     percentage = Decimal(s['percentage'])
                     owed = (total_amount * percentage / 100).quantize(Decimal('0.01'))
                     response_users.append({
@@ -78,7 +143,7 @@ def add_expense(request):
                     })
             response_payers = []
             for payment in payments:
-                payer = User.objects.get(id=payment['payer_id'])
+                payer = user_map[payment['payer_id']]
                 response_payers.append({
                     'id': payer.id,
                     'username': payer.username,
@@ -119,6 +184,50 @@ def add_expense(request):
             status=status.HTTP_400_BAD_REQUEST
         )
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def batch_add_expenses(request):
+    """
+    Add many group expenses in one request, e.g. when importing a trip.
+    Body: {"expenses": [...]} where each item is shaped like add_expense.
+    Valid items are inserted in one transaction, invalid ones are reported per item.
+    """
+    serializer = BatchAddExpenseSerializer(
+        data=request.data,
+        context={'request': request}
+    )
+    if not serializer.is_valid():
+        return Response(
+            {
+                'error': 'Invalid data',
+                'detail': serializer.errors
+            },
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        results = serializer.save()
+    except Exception as e:
+        return Response(
+            {
+                'error': 'Failed to create expenses',
+                'detail': str(e)
+            },
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    created_count = sum(1 for r in results if r['status'] == 'created')
+    if created_count == len(results):
+        response_status = status.HTTP_201_CREATED
+    elif created_count:
+        response_status = status.HTTP_207_MULTI_STATUS
+    else:
+        response_status = status.HTTP_400_BAD_REQUEST
+    return Response({
+        'message': f'Created {created_count} of {len(results)} expense(s)',
+        'created_count': created_count,
+        'failed_count': len(results) - created_count,
+        'results': results
+    }, status=response_status)
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def add_friend_expense(request):
@@ -188,22 +297,53 @@ def add_friend_expense(request):
             status=status.HTTP_400_BAD_REQUEST
         )
 
+def total_balances_of(user):
+    """The user's non-zero balances with other users"""
+    return UserTotalBalance.objects.filter(
+        models.Q(user1=user) | models.Q(user2=user)
+    ).exclude(total_balance=0).select_related('user1', 'user2')
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional_response(lambda request: [('balances', request.user.id)])
 def list_user_total_balances(request):
     """
     List all balances the current user has with all other users (friends).
     """
     user = request.user
-    balances = UserTotalBalance.objects.filter(models.Q(user1=user) | models.Q(user2=user)).exclude(total_balance=0)
-    serializer = UserTotalBalanceSerializer(balances, many=True, context={'user': user})
+    serializer = UserTotalBalanceSerializer(total_balances_of(user), many=True, context={'user': user})
     return Response(serializer.data)
 
+@async_api_view(['GET'])
+@async_cached_response(lambda request: [('balances', request.user.id)], cache_body=False)
+async def list_user_total_balances_async(request):
+    """
+    list_user_total_balances for the ASGI server.
+    """
+    user = request.user
+    balances = [balance async for balance in total_balances_of(user)]
+    serializer = UserTotalBalanceSerializer(balances, many=True, context={'user': user})
+    return json_response(serializer.data)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def balance_summary(request):
+    """
+    Home screen totals for the current user: what they owe, what they are
+    owed, their largest balances with friends and their balance in each group.
+    Served from the materialized UserBalanceSummary row.
+    """
+    summary = summaries.get_summary(request.user)
+    return Response(UserBalanceSummarySerializer(summary).data)
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def expenses_and_balance_with_friend(request):
     """
-    Show all expenses and the balance between the current user and a specified friend (by user_id).
+    Show the expenses and the balance between the current user and a specified friend (by user_id).
+    Expenses are paginated by cursor: pass next_cursor back as cursor to get the next page.
+    Query Parameters: user_id (required), cursor, page_size (default: 20, at most 100),
+    fields ('full' or 'lite', default: 'full')
     """
     user = request.user
     friend_id = request.GET.get('user_id')
@@ -214,20 +354,39 @@ def expenses_and_balance_with_friend(request):
     except User.DoesNotExist:
         return Response({'error': 'Friend not found.'}, status=status.HTTP_404_NOT_FOUND)
 
-    # Get all expenses involving both users (either as payer or share)
+    # Expenses involving both users (either as payer or share). EXISTS checks
+    # keep this a single scan of expenses instead of a DISTINCT over joins.
+    def paid_by(u):
+        return Exists(ExpensePayment.objects.filter(expense=OuterRef('pk'), payer=u))
+
+    def shared_by(u):
+        return Exists(ExpenseShare.objects.filter(expense=OuterRef('pk'), user=u))
+
     expenses = Expense.objects.filter(
-        (models.Q(payments__payer=user) & models.Q(shares__user=friend)) |
-        (models.Q(payments__payer=friend) & models.Q(shares__user=user)) |
-        (models.Q(shares__user=user) & models.Q(shares__user=friend)),
+        (paid_by(user) & shared_by(friend)) |
+        (paid_by(friend) & shared_by(user)) |
+        (shared_by(user) & shared_by(friend)),
         is_deleted=False
-    ).distinct().order_by('-date')
+    )
+    try:
+        page_size = int(request.GET.get('page_size', 20))
+    except ValueError:
+        return Response({'error': 'page_size must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+    page_size = max(1, min(page_size, MAX_FEED_PAGE_SIZE))
+    try:
+        expenses, next_cursor = paginate_by_cursor(
+            with_list_details(expenses, user), request.GET.get('cursor'), page_size
+        )
+    except InvalidCursor as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    expense_serializer = ExpenseListSerializer(expenses, many=True, context={'user': user})
+    serializer_class = ExpenseListLiteSerializer if request.GET.get('fields') == 'lite' else ExpenseListSerializer
+    expense_serializer = serializer_class(expenses, many=True, context={'user': user})
 
     # Fetch the UserTotalBalance object for the user pair, but do not create if missing
     user1, user2 = (user, friend) if user.id < friend.id else (friend, user)
     try:
-        balance_obj = UserTotalBalance.objects.get(user1=user1, user2=user2)
+        balance_obj = UserTotalBalance.objects.select_related('user1', 'user2').get(user1=user1, user2=user2)
     except UserTotalBalance.DoesNotExist:
         balance_obj = UserTotalBalance(user1=user1, user2=user2, total_balance=0)
     balance_serializer = UserTotalBalanceSerializer(balance_obj, context={'user': user})
@@ -235,11 +394,25 @@ def expenses_and_balance_with_friend(request):
 
     return Response({
         'expenses': expense_serializer.data,
-        'balance': balance_data
+        'balance': balance_data,
+        'pagination': {
+            'page_size': page_size,
+            'has_next': next_cursor is not None,
+            'next_cursor': next_cursor,
+        }
     })
 
+def _group_balance_scopes(request):
+    """Cache scopes of a group's balances; group_id as an int so spellings share a version"""
+    try:
+        group_id = int(request.query_params.get('group_id'))
+    except (TypeError, ValueError):
+        group_id = None
+    return [('group', group_id), ('group-balances', group_id)]
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional_response(_group_balance_scopes)
 def group_member_balances(request):
     """
     Show all balances between members of a specified group (by group_id).
@@ -262,6 +435,26 @@ def group_member_balances(request):
         'balances': serializer.data
     })
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def group_settle_plan(request):
+    """
+    Suggest who should pay whom to settle a group with the fewest transfers.
+    Query Parameters: group_id (required)
+    """
+    group_id = request.GET.get('group_id')
+    if not group_id:
+        return Response({'error': 'group_id parameter is required.'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        group = Group.objects.get(id=group_id, is_active=True)
+    except Group.DoesNotExist:
+        return Response({'error': 'Group not found or inactive.'}, status=status.HTTP_404_NOT_FOUND)
+
+    if not group.members.filter(id=request.user.id).exists():
+        return Response({'error': 'You are not a member of this group.'}, status=status.HTTP_403_FORBIDDEN)
+
+    return Response(settle_plan.get_plan(group))
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def group_expenses(request):
@@ -271,16 +464,28 @@ def group_expenses(request):
     Query Parameters:
     - group_id: ID of the group (required)
     - page: Page number (default: 1)
-    - page_size: Number of items per page (default: 20)
+    - page_size: Number of items per page (default: 20, at most 100)
+    - cursor: Opaque next_cursor from a previous response; switches to keyset
+      pagination, which costs the same on every page (pass it empty for the first page)
+    - include_total: 'true' or 'false', whether to count all matches
+      (default: 'true' with page, 'false' with cursor)
     - search: Search query to filter expenses (optional)
     - search_mode: 'chat' or 'normal' (default: 'normal')
-        - 'chat': Returns only expense IDs for chat search
+        - 'chat': Also returns 'expense_ids', every match's ID straight from
+          the search index (newest first, at most search.MAX_RESULTS)
         - 'normal': Returns full expense details with pagination
     """
     # Get query parameters
     group_id = request.GET.get('group_id')
-    page = int(request.GET.get('page', 1))
-    page_size = int(request.GET.get('page_size', 20))
+    try:
+        page = int(request.GET.get('page', 1))
+        page_size = int(request.GET.get('page_size', 20))
+    except ValueError:
+        return Response({'error': 'page and page_size must be integers.'}, status=status.HTTP_400_BAD_REQUEST)
+    page = max(1, page)
+    page_size = max(1, min(page_size, MAX_FEED_PAGE_SIZE))
+    cursor = request.GET.get('cursor')
+    include_total = request.GET.get('include_total', 'false' if cursor is not None else 'true').lower() == 'true'
     search_query = request.GET.get('search', '').strip()
     search_mode = request.GET.get('search_mode', 'normal')
 
@@ -293,40 +498,41 @@ def group_expenses(request):
         return Response({'error': 'Group not found or inactive.'}, status=status.HTTP_404_NOT_FOUND)
 
     # Only members can view group expenses
-    if request.user not in group.members.all():
+    if not group.members.filter(id=request.user.id).exists():
         return Response({'error': 'You are not a member of this group.'}, status=status.HTTP_403_FORBIDDEN)
 
     # Base queryset
     expenses = Expense.objects.filter(group=group, is_deleted=False)
 
-    # Apply search if provided
+    # Apply search if provided, through the per-expense search index
     if search_query:
         expenses = expenses.filter(
-            Q(description__icontains=search_query) |
-            Q(notes__icontains=search_query) |
-            Q(total_amount__icontains=search_query) |
-            Q(category__name__icontains=search_query) |
-            Q(payments__payer__username__icontains=search_query) |
-            Q(shares__user__username__icontains=search_query)
-        ).distinct()
-
-    # Order by date
-    expenses = expenses.order_by('-date')
-
-    # Calculate total count for pagination
-    total_count = expenses.count()
+            id__in=search.matching_documents(group, search_query).values('expense_id')
+        )
 
-    # Calculate pagination values
-    start_idx = (page - 1) * page_size
-    end_idx = start_idx + page_size
-    total_pages = (total_count + page_size - 1) // page_size
+    # Order by date, newest first, with the ID as a stable tie-breaker
+    expenses = expenses.order_by(*FEED_ORDERING)
+    total_count = expenses.count() if include_total else None
 
-    # Get paginated expenses
-    paginated_expenses = expenses[start_idx:end_idx]
+    # Get paginated expenses with everything the response needs loaded up front
+    detailed = with_expense_details(expenses, request.user)
+    if cursor is not None:
+        try:
+            paginated_expenses, next_cursor = paginate_by_cursor(detailed, cursor, page_size)
+        except InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        start_idx = (page - 1) * page_size
+        paginated_expenses = list(detailed[start_idx:start_idx + page_size + 1])
+        has_more = len(paginated_expenses) > page_size
+        paginated_expenses = paginated_expenses[:page_size]
+        next_cursor = encode_cursor(paginated_expenses[-1]) if has_more else None
 
     # Prepare response data
     expense_list = []
     for expense in paginated_expenses:
+        payments = list(expense.payments.all())
+        first_payer = next((p.payer for p in payments if p.payer_id == expense.first_payer_id), None)
         expense_data = {
             'id': expense.expense_id,
             'description': expense.description,
@@ -339,16 +545,13 @@ def group_expenses(request):
                     'first_name': payment.payer.first_name,
                     'last_name': payment.payer.last_name,
                     'amount_paid': str(payment.amount_paid),
-                    'profilePic': (
-                        payment.payer.profile.profile_picture_url
-                        if hasattr(payment.payer, 'profile') and hasattr(payment.payer.profile, 'profile_picture_url') else ''
-                    )
+                    'profilePic': _profile_picture(payment.payer)
                 }
-                for payment in expense.payments.all()
+                for payment in payments
             ],
-            'payer_name': expense.payments.first().payer.get_full_name() or expense.payments.first().payer.username if expense.payments.exists() else 'Unknown',
-            'created_by': expense.created_by.id if expense.created_by else None,
-            'group_admin_id': expense.group.created_by.id if expense.group and expense.group.created_by else None,
+            'payer_name': first_payer.get_full_name() or first_payer.username if first_payer else 'Unknown',
+            'created_by': expense.created_by_id,
+            'group_admin_id': group.created_by_id,
         }
         
         if search_mode == 'normal':
@@ -361,12 +564,12 @@ def group_expenses(request):
                     'icon': expense.category.icon,
                     'color': expense.category.color
                 } if expense.category else None,
-                'is_user_expense': expense.payments.filter(payer=request.user).exists(),
-                'payer_profile_pic': expense.payments.first().payer.profile.profile_picture_url if expense.payments.exists() and hasattr(expense.payments.first().payer.profile, 'profile_picture_url') else '',
+                'is_user_expense': expense.is_user_expense,
+                'payer_profile_pic': _profile_picture(first_payer) if first_payer else '',
                 'owed_breakdown': [{
                     'name': share.user.username,
                     'amount': str(share.amount_owed),
-                    'profilePic': share.user.profile.profile_picture_url if hasattr(share.user.profile, 'profile_picture_url') else ''
+                    'profilePic': _profile_picture(share.user)
                 } for share in expense.shares.all()]
             })
 
@@ -375,14 +578,20 @@ def group_expenses(request):
     response_data = {
         'expenses': expense_list,
         'pagination': {
-            'total_count': total_count,
-            'page': page,
             'page_size': page_size,
-            'total_pages': total_pages,
-            'has_next': page < total_pages,
-            'has_previous': page > 1
+            'has_next': next_cursor is not None,
+            'next_cursor': next_cursor,
         }
     }
+    if search_query and search_mode == 'chat':
+        response_data['expense_ids'] = search.search_expense_ids(group, search_query)
+    if total_count is not None:
+        response_data['pagination']['total_count'] = total_count
+    if cursor is None:
+        response_data['pagination']['page'] = page
+        response_data['pagination']['has_previous'] = page > 1
+        if total_count is not None:
+            response_data['pagination']['total_pages'] = (total_count + page_size - 1) // page_size
 
     return Response(response_data)
 
@@ -410,10 +619,101 @@ def delete_expense(request):
     if not (is_creator or is_group_admin):
         return Response({'error': 'You do not have permission to delete this expense.'}, status=status.HTTP_403_FORBIDDEN)
 
-    expense.is_deleted = True
-    expense.save(update_fields=['is_deleted'])
+    with transaction.atomic():
+        # Lock and re-check, so concurrent deletes reverse the expense once
+        expense = Expense.objects.select_for_update().get(pk=expense.pk)
+        if not expense.is_deleted:
+            expense.is_deleted = True
+            expense.save(update_fields=['is_deleted'])
+            # Take this expense's contribution back out of the balances
+            ledger.reverse_expense(expense)
     return Response({'message': 'Expense deleted successfully.'}, status=status.HTTP_200_OK)
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def create_settlement(request):
+    """
+    Record a payment between the current user and another user.
+    The amount is matched to the payer's open expense shares, oldest first.
+    """
+    serializer = CreateSettlementSerializer(data=request.data, context={'request': request})
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    settlement = serializer.save()
+    return Response({
+        'message': 'Settlement recorded successfully',
+        'settlement': SettlementSerializer(settlement).data,
+    }, status=status.HTTP_201_CREATED)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def list_settlements(request):
+    """
+    List settlements the current user paid or received, newest first.
+    Query Parameters: user_id (other party, optional), group_id (optional),
+    cursor (next_cursor of the previous page), page_size (default: 20, at most 100)
+    """
+    user = request.user
+    settlements = Settlement.objects.filter(Q(payer=user) | Q(payee=user))
+    other_id = request.GET.get('user_id')
+    if other_id:
+        settlements = settlements.filter(Q(payer_id=other_id) | Q(payee_id=other_id))
+    group_id = request.GET.get('group_id')
+    if group_id:
+        settlements = settlements.filter(group_id=group_id)
+    cursor = request.GET.get('cursor')
+    if cursor:
+        if not cursor.isdigit():
+            return Response({'error': 'Invalid cursor.'}, status=status.HTTP_400_BAD_REQUEST)
+        settlements = settlements.filter(id__lt=int(cursor))
+
+    try:
+        page_size = int(request.GET.get('page_size', 20))
+    except ValueError:
+        return Response({'error': 'page_size must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+    page_size = max(1, min(page_size, MAX_SETTLEMENTS_PAGE_SIZE))
+    page = list(
+        settlements.select_related('payer', 'payee').annotate(
+            allocated_amount=Coalesce(
+                Subquery(
+                    SettlementAllocation.objects.filter(settlement=OuterRef('pk'))
+                    .values('settlement').annotate(total=Sum('amount')).values('total')
+                ),
+                Value(Decimal('0')),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2)
+            )
+        ).order_by('-id')[:page_size + 1]
+    )
+    next_cursor = str(page[page_size - 1].id) if len(page) > page_size else None
+    return Response({
+        'settlements': SettlementSerializer(page[:page_size], many=True).data,
+        'pagination': {
+            'page_size': page_size,
+            'has_next': next_cursor is not None,
+            'next_cursor': next_cursor,
+        }
+    })
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def undo_settlement(request):
+    """
+    Undo a settlement by its settlement_id. Only its payer or payee can undo it.
+    """
+    settlement_id = request.data.get('settlement_id')
+    if not settlement_id:
+        return Response({'error': 'settlement_id is required.'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        settlement = Settlement.objects.get(settlement_id=settlement_id)
+    except (Settlement.DoesNotExist, ValidationError):
+        return Response({'error': 'Settlement not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+    if request.user.id not in (settlement.payer_id, settlement.payee_id):
+        return Response({'error': 'You do not have permission to undo this settlement.'}, status=status.HTTP_403_FORBIDDEN)
+
+    Settlement.objects.undo_settlement(settlement)
+    return Response({'message': 'Settlement undone successfully.'}, status=status.HTTP_200_OK)
+
 @api_view(['PUT'])
 @permission_classes([IsAuthenticated])
 def edit_expense(request):
@@ -468,6 +768,9 @@ def edit_expense(request):
             
             return Response(response_data, status=status.HTTP_200_OK)
             
+        except Expense.DoesNotExist:
+            # Deleted while the edit was waiting for the row lock
+            return Response({'error': 'Expense not found'}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response(
                 {
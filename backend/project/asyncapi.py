@@ -0,0 +1,92 @@
+"""
+Async views for the ASGI server.
+
+Under ``gunicorn project.asgi -k uvicorn_worker.UvicornWorker`` Django runs
+each request's sync view through ``sync_to_async(thread_sensitive=True)``,
+in a thread of that request's own context. Sync views of different requests
+still run side by side, but each holds a thread for its whole run and hops
+between the event loop and that thread. The read-heavy endpoints therefore
+have async variants, written with the async ORM and returning plain Django
+responses.
+
+``serve(sync_view, async_view)`` picks the variant for a URL pattern from
+the ASYNC_VIEWS setting, which an ASGI deployment turns on. The sync views
+stay the default, and render.yaml still serves project.wsgi, so the WSGI
+server never pays for an event loop per request.
+
+``async_api_view`` provides the parts of ``@api_view`` these views need:
+method checks and JWT authentication without a blocking database call.
+"""
+
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+
+def serve(sync_view, async_view):
+    """The view a URL pattern should route to in this deployment"""
+    return async_view if getattr(settings, 'ASYNC_VIEWS', False) else sync_view
+
+
+def json_response(data, status=status.HTTP_200_OK, headers=None):
+    """Renders ``data`` exactly like the DRF views do"""
+    return HttpResponse(
+        JSONRenderer().render(data), status=status, headers=headers, content_type='application/json'
+    )
+
+
+async def authenticate(request):
+    """
+    The user of the request's ``Authorization: Bearer <access token>``, or
+    None. The token is checked in process; only the user lookup touches the
+    database, through the async ORM.
+    """
+    authentication = JWTAuthentication()
+    try:
+        header = authentication.get_header(request)
+        raw_token = authentication.get_raw_token(header) if header else None
+        if raw_token is None:
+            return None
+        token = authentication.get_validated_token(raw_token)
+        user_id = token[jwt_settings.USER_ID_CLAIM]
+    except (AuthenticationFailed, KeyError):
+        return None
+    try:
+        user = await User.objects.aget(**{jwt_settings.USER_ID_FIELD: user_id})
+    except User.DoesNotExist:
+        return None
+    return user if user.is_active else None
+
+
+def async_api_view(methods, authenticated=True):
+    """``@api_view`` plus ``IsAuthenticated`` for async views"""
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return json_response(
+                    {'detail': f'Method "{request.method}" not allowed.'},
+                    status=status.HTTP_405_METHOD_NOT_ALLOWED,
+                    headers={'Allow': ', '.join(methods)},
+                )
+            if authenticated:
+                user = await authenticate(request)
+                if user is None:
+                    return json_response(
+                        {'detail': 'Authentication credentials were not provided or are invalid.'},
+                        status=status.HTTP_401_UNAUTHORIZED,
+                        headers={'WWW-Authenticate': 'Bearer realm="api"'},
+                    )
+                request.user = user
+            return await view(request, *args, **kwargs)
+        # Token authenticated like the DRF views, so no CSRF check
+        return csrf_exempt(wrapper)
+    return decorator
@@ -0,0 +1,233 @@
+"""
+Versioned response caching for read-heavy endpoints.
+
+Cached responses are never deleted on write. Instead every *scope* of data
+(one user's friends, one user's groups, one group, the category list, ...)
+has a version counter in the cache, and the key of a cached response
+includes the current versions of the scopes it was built from. Bumping a
+version makes every response built from the old data unreachable; the
+stale entries simply expire. Signal handlers bump versions once the writing
+transaction commits, so a response read before the commit can never be
+stored under the new version.
+
+The versions double as cheap ETags: a client that sends ``If-None-Match``
+with the ETag it already holds gets a 304 without the view running.
+
+The backend is ``CACHES['default']``: Redis when REDIS_URL is set,
+process-local memory otherwise. Local memory is fine for development and
+tests; deployments with several workers need Redis so every worker sees
+every bump.
+"""
+
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+RESPONSE_TIMEOUT = 60 * 60
+
+
+# ============================================================================
+# VERSIONS
+# ============================================================================
+
+def version_key(scope, scope_id=None):
+    return f'version:{scope}' if scope_id is None else f'version:{scope}:{scope_id}'
+
+
+def get_versions(scopes):
+    """Current versions of ``scopes``, a list of ``(scope, id)`` pairs"""
+    keys = [version_key(*scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        # Seed from the clock: a version evicted from the cache must never
+        # come back with a value some stale response is still stored under
+        seed = time.time_ns()
+        for key in missing:
+            cache.add(key, seed, timeout=None)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key, 0) for key in keys]
+
+
+async def aget_versions(scopes):
+    """``get_versions`` for async views, through the cache's async API"""
+    keys = [version_key(*scope) for scope in scopes]
+    versions = await cache.aget_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        seed = time.time_ns()
+        for key in missing:
+            await cache.aadd(key, seed, timeout=None)
+        versions.update(await cache.aget_many(missing))
+    return [versions.get(key, 0) for key in keys]
+
+
+def _increment(keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Not read since it was evicted; the next read seeds a fresh one
+            pass
+
+
+def bump(scope, ids=None):
+    """
+    Invalidate ``scope`` for each of ``ids`` (or the global ``scope`` when
+    ``ids`` is None) once the current transaction commits.
+    """
+    if ids is None:
+        keys = [version_key(scope)]
+    else:
+        keys = [version_key(scope, scope_id) for scope_id in set(ids) if scope_id is not None]
+    if keys:
+        transaction.on_commit(lambda: _increment(keys))
+
+
+# ============================================================================
+# CONDITIONAL RESPONSES
+# ============================================================================
+
+def make_etag(*parts):
+    digest = hashlib.md5(':'.join(str(part) for part in parts).encode(), usedforsecurity=False)
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(request, etag):
+    """Whether the request's If-None-Match already names ``etag``"""
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    # If-None-Match uses weak comparison
+    candidates = {candidate.removeprefix('W/') for candidate in parse_etags(header)}
+    return '*' in candidates or etag in candidates
+
+
+def with_etag(response, etag):
+    """Attach ``etag`` and revalidation headers to a per-user response"""
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ['Authorization'])
+    return response
+
+
+def not_modified(etag):
+    return with_etag(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+
+
+# ============================================================================
+# VIEW DECORATORS
+# ============================================================================
+
+def _etag_for(view, request, per_user, versions):
+    return make_etag(
+        view.__module__, view.__qualname__,
+        request.user.id if per_user else '*',
+        request.path, sorted(request.GET.lists()),
+        *versions
+    )
+
+
+def _response_etag(view, request, scopes, kwargs, per_user):
+    # Versions are read before the view queries anything, so a write
+    # committing in between can only make this response a miss later
+    return _etag_for(view, request, per_user, get_versions(scopes(request, **kwargs)))
+
+
+def conditional_response(scopes, per_user=True):
+    """
+    ETag a GET view from the versions of the scopes its response is built
+    from, without caching the body. A request whose If-None-Match matches
+    gets a 304 and the view never runs; that costs one cache read instead
+    of the queries and serialization of a full response.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not getattr(settings, 'RESPONSE_CACHE_ENABLED', True):
+                return view(request, *args, **kwargs)
+            etag = _response_etag(view, request, scopes, kwargs, per_user)
+            if etag_matches(request, etag):
+                return not_modified(etag)
+            response = view(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            return with_etag(response, etag)
+        return wrapper
+    return decorator
+
+
+def cached_response(scopes, per_user=True, timeout=RESPONSE_TIMEOUT):
+    """
+    Like ``conditional_response``, and also cache successful response
+    bodies under the same versions. ``scopes(request, **kwargs)`` returns
+    the view's ``(scope, id)`` pairs. Place it below ``@permission_classes``
+    so it only ever sees authenticated requests::
+
+        @api_view(['GET'])
+        @permission_classes([IsAuthenticated])
+        @cached_response(lambda request: [('friends', request.user.id)])
+        def get_friends_list(request):
+            ...
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not getattr(settings, 'RESPONSE_CACHE_ENABLED', True):
+                return view(request, *args, **kwargs)
+            etag = _response_etag(view, request, scopes, kwargs, per_user)
+            if etag_matches(request, etag):
+                return not_modified(etag)
+
+            key = 'response:' + etag.strip('"')
+            data = cache.get(key)
+            if data is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(key, response.data, timeout)
+            else:
+                response = Response(data)
+            return with_etag(response, etag)
+        return wrapper
+    return decorator
+
+
+def async_cached_response(scopes, per_user=True, timeout=RESPONSE_TIMEOUT, cache_body=True):
+    """
+    ``cached_response`` (or, without ``cache_body``, ``conditional_response``)
+    for async views returning plain Django responses. Rendered bodies are
+    cached, so a hit costs no rendering at all.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if not getattr(settings, 'RESPONSE_CACHE_ENABLED', True):
+                return await view(request, *args, **kwargs)
+            versions = await aget_versions(scopes(request, **kwargs))
+            etag = _etag_for(view, request, per_user, versions)
+            if etag_matches(request, etag):
+                return with_etag(HttpResponseNotModified(), etag)
+
+            key = 'response:' + etag.strip('"')
+            content = await cache.aget(key) if cache_body else None
+            if content is None:
+                response = await view(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                if cache_body:
+                    await cache.aset(key, response.content, timeout)
+            else:
+                response = HttpResponse(content, content_type='application/json')
+            return with_etag(response, etag)
+        return wrapper
+    return decorator
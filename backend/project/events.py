@@ -0,0 +1,187 @@
+"""
+Per-user push events.
+
+Signal handlers publish small JSON events to the users they concern once
+the writing transaction commits: a friend request or group invitation
+arrived or was answered, an expense was added to one of their groups,
+their balances changed. The ``/api/events/stream/`` view relays a user's
+events as server-sent events, so the app can stop polling.
+
+Events travel through a broker:
+
+- InProcessBroker (default) keeps subscribers in process memory, so the
+  stream only sees events published by the same process
+- RedisBroker uses one Redis pub/sub channel per user and is used when
+  EVENTS_REDIS_URL (or REDIS_URL) is set, so events reach streams held by
+  any worker
+
+Delivery is best effort and there is no replay: a client that (re)connects
+should refetch its state once, then rely on the stream.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Events buffered per stream before the oldest are dropped (slow clients)
+QUEUE_SIZE = 100
+
+
+# ============================================================================
+# BROKERS
+# ============================================================================
+
+def _offer(queue, message):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(message)
+
+
+class InProcessBroker:
+    """Subscribers are asyncio queues in this process, fed from any thread"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+
+    def publish(self, user_id, message):
+        with self.lock:
+            targets = list(self.subscribers.get(user_id, ()))
+        for loop, queue in targets:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, message)
+            except RuntimeError:
+                # The subscriber's event loop has shut down
+                pass
+
+    @asynccontextmanager
+    async def subscribe(self, user_id):
+        """Yields ``receive(timeout)``, which returns the next message or None"""
+        entry = (asyncio.get_running_loop(), asyncio.Queue(maxsize=QUEUE_SIZE))
+        with self.lock:
+            self.subscribers.setdefault(user_id, set()).add(entry)
+
+        async def receive(timeout):
+            try:
+                return await asyncio.wait_for(entry[1].get(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+        try:
+            yield receive
+        finally:
+            with self.lock:
+                subscribers = self.subscribers.get(user_id, set())
+                subscribers.discard(entry)
+                if not subscribers:
+                    self.subscribers.pop(user_id, None)
+
+
+class RedisBroker:
+    """One Redis pub/sub channel per user, shared by every worker"""
+
+    def __init__(self, url):
+        import redis
+
+        self.url = url
+        self.client = redis.Redis.from_url(url)
+
+    def channel(self, user_id):
+        return f'splitkar:events:{user_id}'
+
+    def publish(self, user_id, message):
+        self.client.publish(self.channel(user_id), message)
+
+    @asynccontextmanager
+    async def subscribe(self, user_id):
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(self.channel(user_id))
+
+        async def receive(timeout):
+            # get_message's own timeout avoids cancelling a read mid-reply
+            deadline = time.monotonic() + timeout
+            while (remaining := deadline - time.monotonic()) > 0:
+                message = await pubsub.get_message(timeout=remaining)
+                if message is not None:
+                    return message['data'].decode()
+            return None
+
+        try:
+            yield receive
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
+            await client.aclose()
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                url = getattr(settings, 'EVENTS_REDIS_URL', '')
+                _broker = RedisBroker(url) if url else InProcessBroker()
+    return _broker
+
+
+# ============================================================================
+# PUBLISHING
+# ============================================================================
+
+def _deliver(user_ids, message):
+    broker = get_broker()
+    for user_id in user_ids:
+        try:
+            broker.publish(user_id, message)
+        except Exception:
+            # Push is best effort; never fail the write that triggered it
+            logger.warning('Could not publish event to user %s', user_id, exc_info=True)
+
+
+def publish(user_ids, event_type, data=None):
+    """Send ``event_type`` with ``data`` to each of ``user_ids`` once the transaction commits"""
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not user_ids or not getattr(settings, 'EVENTS_ENABLED', True):
+        return
+    message = json.dumps({'type': event_type, 'data': data or {}, 'at': time.time()}, default=str)
+    transaction.on_commit(lambda: _deliver(user_ids, message))
+
+
+# ============================================================================
+# SERVER-SENT EVENTS
+# ============================================================================
+
+def format_sse(message):
+    event_type = json.loads(message)['type']
+    return f'event: {event_type}\ndata: {message}\n\n'
+
+
+async def sse_stream(user_id, heartbeat=None):
+    """
+    Server-sent events for ``user_id``: a ``ready`` event, then every event
+    published to the user, with a comment line as keep-alive whenever the
+    stream has been idle for ``heartbeat`` seconds (proxies drop idle
+    connections).
+    """
+    heartbeat = heartbeat or getattr(settings, 'EVENTS_HEARTBEAT_SECONDS', 15)
+    async with get_broker().subscribe(user_id) as receive:
+        yield 'retry: 5000\n\n'
+        yield format_sse(json.dumps({'type': 'ready', 'data': {'user_id': user_id}, 'at': time.time()}))
+        while True:
+            message = await receive(heartbeat)
+            yield ': keep-alive\n\n' if message is None else format_sse(message)
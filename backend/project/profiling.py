@@ -0,0 +1,272 @@
+"""
+Per-request profiling.
+
+ProfilingMiddleware records, for every request, the number of database
+queries and the time spent in them (through ``connection.execute_wrapper``),
+the time spent building serializer output and the total latency. Each
+request:
+
+- gets a ``Server-Timing`` header (visible in browser devtools)
+- is logged as one JSON line on the ``project.profiling`` logger
+- is added to per-route histograms, served in Prometheus text format by
+  the ``/metrics/`` view
+
+Metrics live in process memory, so with several gunicorn workers each
+worker reports its own numbers. Profiling is off unless the environment
+sets PROFILING_ENABLED=true.
+"""
+
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from asgiref.local import Local
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('project.profiling')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Context-local rather than thread-local: under ASGI one thread serves many
+# requests, and the stats must follow a request into sync_to_async threads
+_local = Local()
+
+
+# ============================================================================
+# HISTOGRAMS
+# ============================================================================
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is +Inf
+        self.total = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self):
+        running = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            running += count
+            yield bound, running
+
+
+class MetricsRegistry:
+    """Per-route request histograms, shared by every thread of the process"""
+
+    METRICS = (
+        ('splitkar_request_duration_seconds', 'Total request latency', LATENCY_BUCKETS),
+        ('splitkar_db_query_duration_seconds', 'Time spent in database queries per request', LATENCY_BUCKETS),
+        ('splitkar_db_queries', 'Database queries per request', QUERY_COUNT_BUCKETS),
+        ('splitkar_serializer_duration_seconds', 'Time spent building serializer output per request', LATENCY_BUCKETS),
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.responses = {}
+
+    def observe(self, route, method, status_code, stats):
+        labels = (route, method)
+        values = (stats['total'], stats['db_time'], stats['queries'], stats['serializer_time'])
+        with self.lock:
+            for (name, _, buckets), value in zip(self.METRICS, values):
+                key = (name, labels)
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(buckets)
+                self.histograms[key].observe(value)
+            response_key = labels + (str(status_code),)
+            self.responses[response_key] = self.responses.get(response_key, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.responses.clear()
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            lines.append('# HELP splitkar_responses_total Responses by route, method and status code')
+            lines.append('# TYPE splitkar_responses_total counter')
+            for (route, method, status_code), count in sorted(self.responses.items()):
+                lines.append(f'splitkar_responses_total{{{_labels(route, method)},status="{status_code}"}} {count}')
+
+            for name, description, _ in self.METRICS:
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} histogram')
+                for (metric, (route, method)), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    labels = _labels(route, method)
+                    for bound, count in histogram.cumulative():
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                    lines.append(f'{name}_sum{{{labels}}} {histogram.total:.6f}')
+                    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(route, method):
+    route = route.replace('\\', '\\\\').replace('"', '\\"')
+    return f'route="{route}",method="{method}"'
+
+
+registry = MetricsRegistry()
+
+
+# ============================================================================
+# MEASUREMENT
+# ============================================================================
+
+class QueryRecorder:
+    """``execute_wrapper`` hook counting queries and their time"""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.stats['queries'] += 1
+            self.stats['db_time'] += time.perf_counter() - started
+
+
+def _install_serializer_timing():
+    """
+    Time ``BaseSerializer.data``, where DRF turns instances into primitives.
+    Serializer.data and ListSerializer.data both go through it; only the
+    outermost call of a request is counted so nested ``.data`` isn't doubled.
+    """
+    from rest_framework.serializers import BaseSerializer
+
+    original = BaseSerializer.data
+    if getattr(original.fget, 'profiled', False):
+        return
+
+    def data(self):
+        stats = getattr(_local, 'stats', None)
+        if stats is None or stats['serializer_depth']:
+            return original.fget(self)
+        stats['serializer_depth'] += 1
+        started = time.perf_counter()
+        try:
+            return original.fget(self)
+        finally:
+            stats['serializer_depth'] -= 1
+            stats['serializer_time'] += time.perf_counter() - started
+
+    data.profiled = True
+    BaseSerializer.data = property(data)
+
+
+def _route(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return '/' + match.route if match.route else match.view_name or 'unknown'
+
+
+class ProfilingMiddleware:
+    """Records query count, query time, serializer time and latency per request"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        self.enabled = getattr(settings, 'PROFILING_ENABLED', False)
+        if self.enabled:
+            _install_serializer_timing()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.enabled or request.path == '/metrics/':
+            return self.get_response(request)
+
+        stats = _new_stats()
+        _local.stats = stats
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                _record_queries(stack, stats)
+                response = self.get_response(request)
+                # DRF renders lazily; include rendering in the measurement
+                if _needs_render(response):
+                    response.render()
+        finally:
+            _local.stats = None
+        stats['total'] = time.perf_counter() - started
+        return self.report(request, response, stats)
+
+    async def __acall__(self, request):
+        if not self.enabled or request.path == '/metrics/':
+            return await self.get_response(request)
+
+        stats = _new_stats()
+        _local.stats = stats
+        started = time.perf_counter()
+        # Async views query from the request's thread-sensitive executor
+        # thread, so the query hooks are installed (and removed) there
+        stack = ExitStack()
+        try:
+            await sync_to_async(_record_queries)(stack, stats)
+            response = await self.get_response(request)
+            if _needs_render(response):
+                await sync_to_async(response.render)()
+        finally:
+            await sync_to_async(stack.close)()
+            _local.stats = None
+        stats['total'] = time.perf_counter() - started
+        return self.report(request, response, stats)
+
+    def report(self, request, response, stats):
+        route = _route(request)
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={stats["db_time"] * 1000:.1f};desc="{stats["queries"]} queries"',
+            f'serializer;dur={stats["serializer_time"] * 1000:.1f}',
+            f'total;dur={stats["total"] * 1000:.1f}',
+        ])
+        registry.observe(route, request.method, response.status_code, stats)
+        logger.info(json.dumps({
+            'event': 'request',
+            'method': request.method,
+            'path': request.path,
+            'route': route,
+            'status': response.status_code,
+            'queries': stats['queries'],
+            'db_ms': round(stats['db_time'] * 1000, 2),
+            'serializer_ms': round(stats['serializer_time'] * 1000, 2),
+            'total_ms': round(stats['total'] * 1000, 2),
+        }))
+        return response
+
+
+def _new_stats():
+    return {'queries': 0, 'db_time': 0.0, 'serializer_time': 0.0, 'serializer_depth': 0}
+
+
+def _record_queries(stack, stats):
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(QueryRecorder(stats)))
+
+
+def _needs_render(response):
+    return hasattr(response, 'render') and callable(response.render) and not response.is_rendered
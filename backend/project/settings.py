@@ -62,6 +62,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'project.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -109,6 +110,46 @@ DATABASES = {
 }
 
 
+# Cache
+# Redis when REDIS_URL is set. Deployments running several workers need it so
+# cached responses and their invalidations are shared; otherwise each process
+# keeps its own in-memory cache.
+
+REDIS_URL = os.environ.get('REDIS_URL', '')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'splitkar',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'splitkar',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+# Versioned response caching for read-heavy endpoints (see project/caching.py).
+# Off by default without Redis: a per-process cache never sees the version
+# bumps other workers and cron jobs make, so it would serve stale responses.
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', str(bool(REDIS_URL))).lower() == 'true'
+
+# Push events (see project/events.py). Redis pub/sub carries events between
+# workers when a URL is set; otherwise only the publishing process sees them.
+EVENTS_ENABLED = os.environ.get('EVENTS_ENABLED', 'true').lower() == 'true'
+EVENTS_REDIS_URL = os.environ.get('EVENTS_REDIS_URL', REDIS_URL)
+EVENTS_HEARTBEAT_SECONDS = int(os.environ.get('EVENTS_HEARTBEAT_SECONDS', '15'))
+
+# Route read-heavy endpoints to their async views (see project/asyncapi.py).
+# Turn on when serving project.asgi with uvicorn workers, off under WSGI.
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'false').lower() == 'true'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -280,4 +321,31 @@ SIMPLE_JWT = {
 CORS_ALLOW_ALL_ORIGINS = True
 CSRF_TRUSTED_ORIGINS = [
     'https://edd3-2405-201-27-518b-5477-e6bb-9995-49d3.ngrok-free.app/',
-]
\ No newline at end of file
+]
+
+# Request profiling (see project/profiling.py). Off by default: it logs a
+# line per request and its Server-Timing headers expose internals
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+# Bearer token for /metrics/; without it only staff sessions can read metrics
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json_line': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'profiling_console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json_line',
+        },
+    },
+    'loggers': {
+        'project.profiling': {
+            'handlers': ['profiling_console'],
+            'level': os.environ.get('PROFILING_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
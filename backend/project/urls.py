@@ -25,8 +25,10 @@ urlpatterns = [
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
     path('health/', views.health, name='health'),
+    path('metrics/', views.metrics, name='metrics'),
     path('', include('social_django.urls', namespace='social')),
     path('api/', include([
+        path('events/stream/', views.event_stream, name='event-stream'),
         path('', include('api.urls')),
         path('', include('connections.urls')),
         path('expenses/', include('expense.urls')),
@@ -1,8 +1,13 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth import logout
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
 from django.db import connection
+from . import events
+from .asyncapi import authenticate
+from .profiling import registry
 
 
 @login_required
@@ -29,4 +34,36 @@ def health(request):
         status["db"] = "ok"
     except Exception:
         status["db"] = "error"
-    return JsonResponse(status)
\ No newline at end of file
+    return JsonResponse(status)
+
+
+def metrics(request):
+    """
+    Per-route request metrics in Prometheus text format.
+    Requires ``Authorization: Bearer <METRICS_TOKEN>`` or a staff session.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    header = request.headers.get('Authorization', '')
+    authorized = bool(token) and constant_time_compare(header, f'Bearer {token}')
+    if not authorized and not (request.user.is_authenticated and request.user.is_staff):
+        return HttpResponse('Forbidden\n', status=403, content_type='text/plain')
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+async def event_stream(request):
+    """
+    Server-sent events for the authenticated user (see project/events.py).
+    Authenticates with the API's ``Authorization: Bearer <access token>``.
+    Only served under ASGI: under WSGI an open stream would hold a worker.
+    """
+    if 'wsgi.version' in request.META:
+        return JsonResponse({'error': 'The event stream is only available on the ASGI server.'}, status=503)
+    user = await authenticate(request)
+    if user is None:
+        return JsonResponse({'error': 'Authentication credentials were not provided or are invalid.'}, status=401)
+
+    response = StreamingHttpResponse(events.sse_stream(user.id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx-style proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response